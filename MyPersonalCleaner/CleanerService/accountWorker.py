@@ -0,0 +1,67 @@
+'''
+Cleanup of one AWS account in a worker process, see jobs.run_cleanup().
+Each account runs in its own process with its own clients, so an account that fails or gets throttled (the adaptive
+retries slow its clients down) doesn't stall the others. The report rows are sent back to the job process which
+merges them in the accounts order.
+The worker processes import this module before Django is set up, the cleanup modules are imported in the functions.
+'''
+import logging
+import os
+
+import django
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+def init_worker(log_queue):
+    '''
+    ProcessPoolExecutor initializer, the processes are spawned so Django has to be set up again
+    :param log_queue: the cleaners log records go to the job process, see cleanerLogging.listen()
+    '''
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'MyPersonalCleaner.settings')
+    django.setup()
+    from .cleanerLogging import forward_to
+    forward_to(log_queue)
+
+
+def clean_account(report_key, target_account, dry_run, sheets, job_id, full_sweep):
+    '''
+    Scan (and clean) the account
+    :param report_key: name of the in memory report of the account, the xlsx file is written by the job
+    :param sheets: the EC2..S3_Objects flags of run_aws_cleanup()
+    :return: (dict of sheet -> rows with the header first, error message or None), see _collect()
+    '''
+    from .cleanResources import run_aws_cleanup
+    return _collect(report_key, run_aws_cleanup, report_key, dry_run, *sheets, target_account=target_account,
+                    job_id=job_id, full_sweep=full_sweep, savexlsx=False)
+
+
+def apply_account(report_key, scan_id, sheets, job_id):
+    '''
+    Apply the plan of the dry run scan of the account, see clean_account()
+    :param scan_id: the ScanRun of the dry run
+    '''
+    from .cleanResources import run_aws_apply
+    from .models import ScanRun
+    return _collect(report_key, run_aws_apply, report_key, ScanRun.objects.get(pk=scan_id), *sheets, job_id=job_id,
+                    savexlsx=False)
+
+
+def _collect(report_key, run, *args, **kwargs):
+    '''
+    Run the account cleanup and return the rows of its report, with the error of the run if it failed: the rows
+    added before the error (resources already deleted) are returned as well
+    :return: (dict of sheet -> rows, None or the error as a string, exceptions may not pickle)
+    '''
+    from .reportSink import get_report, close_report
+    try:
+        try:
+            run(*args, **kwargs)
+        except Exception as e:
+            logger.exception('%s failed', report_key)
+            return get_report(report_key).sheets, f'{type(e).__name__}: {e}'
+        return get_report(report_key).sheets, None
+    finally:
+        close_report(report_key)
+        connections.close_all()
@@ -1,3 +1,35 @@
-from django.contrib import admin
-
-# Register your models here.
+from django.contrib import admin
+from .models import CleanupJob, ScanRun, InventoryResource, Decision, RegionScanState
+
+
+# Register your models here.
+@admin.register(CleanupJob)
+class CleanupJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'status', 'report_name', 'created', 'finished')
+    list_filter = ('status',)
+
+
+@admin.register(ScanRun)
+class ScanRunAdmin(admin.ModelAdmin):
+    list_display = ('id', 'cloud', 'account', 'dry_run', 'started', 'resource_count', 'changed_count')
+    list_filter = ('cloud', 'account')
+
+
+@admin.register(InventoryResource)
+class InventoryResourceAdmin(admin.ModelAdmin):
+    list_display = ('resource_id', 'resource_type', 'account', 'region', 'operation', 'gone', 'changed')
+    list_filter = ('resource_type', 'account', 'operation', 'gone')
+    search_fields = ('resource_id',)
+
+
+@admin.register(Decision)
+class DecisionAdmin(admin.ModelAdmin):
+    list_display = ('id', 'run', 'resource', 'operation', 'error')
+    list_filter = ('operation',)
+    list_select_related = ('resource',)
+
+
+@admin.register(RegionScanState)
+class RegionScanStateAdmin(admin.ModelAdmin):
+    list_display = ('account', 'resource_type', 'region', 'empty_scans', 'last_scan', 'last_found')
+    list_filter = ('resource_type', 'account')
@@ -0,0 +1,125 @@
+'''
+Counts and latencies of the AWS API calls, taken from the botocore events of the clients (before-call, after-call
+and needs-retry) so every call of the cleaners is measured without touching them.
+The stats of a run go to the Metrics sheet of the report and, once the job has them, to the Prometheus counters
+served on /metrics (django_prometheus). The counters are only updated in the job process, the account worker
+processes send their stats back with the report rows.
+'''
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from prometheus_client import Counter
+
+from .deleteExecutor import THROTTLING_CODES
+
+METRICS_HEADERS = ("Service", "Operation", "Region", "Account", "Calls", "Errors", "Retries", "Throttled",
+                   "Total (s)", "Average (ms)", "Max (ms)")
+
+_LABELS = ('service', 'operation', 'region', 'account')
+_calls_total = Counter('cleaner_aws_api_calls', 'AWS API calls made by the cleaner', _LABELS)
+_errors_total = Counter('cleaner_aws_api_errors', 'AWS API calls that returned an error', _LABELS)
+_retries_total = Counter('cleaner_aws_api_retries', 'Retries made by botocore for the AWS API calls', _LABELS)
+_throttles_total = Counter('cleaner_aws_api_throttles', 'AWS API attempts rejected with a throttling error', _LABELS)
+_seconds_total = Counter('cleaner_aws_api_seconds', 'Time spent in the AWS API calls, retries included', _LABELS)
+
+
+@dataclass
+class CallStats:
+    calls: int = 0
+    errors: int = 0
+    retries: int = 0
+    throttles: int = 0
+    seconds: float = 0.0
+    max_seconds: float = 0.0
+
+
+class ApiMetrics:
+    '''
+    The stats of one run per (service, operation, region), register() the clients of the run to measure their calls
+    '''
+
+    def __init__(self):
+        self._stats = {}  # (service, operation, region) -> CallStats
+        self._lock = threading.Lock()  # the handlers run on the region threads and the delete workers
+
+    def register(self, client):
+        '''
+        Add the event handlers to the boto3 client (for a boto3 resource register resource.meta.client)
+        '''
+        region = client.meta.region_name or ''
+        events = client.meta.events
+        events.register('before-call', self._before_call)
+        events.register('after-call', functools.partial(self._after_call, region))
+        events.register('needs-retry', functools.partial(self._needs_retry, region))
+        return client
+
+    @contextmanager
+    def timed(self, service, operation, region=''):
+        '''
+        Measure a step of the run that is not an API call, e.g. writing the inventory
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record(service, operation, region, time.perf_counter() - start)
+
+    def rows(self, account):
+        '''
+        Rows of the Metrics sheet, slowest first
+        '''
+        with self._lock:
+            stats = sorted(self._stats.items(), key=lambda item: item[1].seconds, reverse=True)
+        return [(service, operation, region, account, stat.calls, stat.errors, stat.retries, stat.throttles,
+                 round(stat.seconds, 3), round(stat.seconds * 1000 / stat.calls, 1) if stat.calls else 0,
+                 round(stat.max_seconds * 1000, 1))
+                for (service, operation, region), stat in stats]
+
+    def _before_call(self, model, context, **kwargs):
+        context['metrics_start'] = time.perf_counter()
+
+    def _after_call(self, region, http_response, parsed, model, context, **kwargs):
+        start = context.pop('metrics_start', None)
+        if start is None:
+            return
+        self._record(model.service_model.service_name, model.name, region, time.perf_counter() - start,
+                     error=http_response.status_code >= 300,
+                     retries=parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0))
+
+    def _needs_retry(self, region, operation, response=None, **kwargs):
+        # called after each attempt, only count the throttled ones, botocore decides about the retry
+        if response is None or response[1].get('Error', {}).get('Code') not in THROTTLING_CODES:
+            return
+        with self._lock:
+            self._stat(operation.service_model.service_name, operation.name, region).throttles += 1
+
+    def _record(self, service, operation, region, seconds, error=False, retries=0):
+        with self._lock:
+            stat = self._stat(service, operation, region)
+            stat.calls += 1
+            stat.errors += error
+            stat.retries += retries
+            stat.seconds += seconds
+            stat.max_seconds = max(stat.max_seconds, seconds)
+
+    def _stat(self, service, operation, region):
+        key = (service, operation, region)
+        if key not in self._stats:
+            self._stats[key] = CallStats()
+        return self._stats[key]
+
+
+def publish(rows):
+    '''
+    Add the rows of a Metrics sheet (see ApiMetrics.rows()) to the Prometheus counters
+    '''
+    for service, operation, region, account, calls, errors, retries, throttles, seconds, *_ in rows:
+        labels = (service, operation, region, account)
+        _calls_total.labels(*labels).inc(calls)
+        _errors_total.labels(*labels).inc(errors)
+        _retries_total.labels(*labels).inc(retries)
+        _throttles_total.labels(*labels).inc(throttles)
+        _seconds_total.labels(*labels).inc(seconds)
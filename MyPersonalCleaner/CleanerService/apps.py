@@ -1,6 +1,6 @@
-from django.apps import AppConfig
-
-
-class CleanerserviceConfig(AppConfig):
-    default_auto_field = 'django.db.models.BigAutoField'
-    name = 'CleanerService'
+from django.apps import AppConfig
+
+
+class CleanerserviceConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'CleanerService'
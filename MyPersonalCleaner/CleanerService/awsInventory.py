@@ -0,0 +1,139 @@
+'''
+Lazy inventory of AWS resources, every describe_* call is walked page by page with the botocore paginators
+so only one page of the response is kept in memory at a time
+'''
+
+# max page size allowed by each API, bigger pages means less round trips
+EC2_PAGE_SIZE = 1000
+RDS_PAGE_SIZE = 100
+
+
+def iter_pages(client, operation, page_size=None, **kwargs):
+    '''
+    Yield the raw response pages of a describe/list call
+    :param client: boto3 client
+    :param operation: client method name, e.g. describe_snapshots
+    :param page_size: page size to ask for, None will use the API default
+    :param kwargs: passed as is to the API call
+    '''
+    if client.can_paginate(operation):
+        pagination_config = {'PageSize': page_size} if page_size else {}
+        yield from client.get_paginator(operation).paginate(PaginationConfig=pagination_config, **kwargs)
+    else:  # no paginator for this call in the installed botocore, single call
+        yield getattr(client, operation)(**kwargs)
+
+
+def iter_resources(client, operation, result_key, page_size=None, **kwargs):
+    '''
+    Yield the resources of a describe/list call one by one, e.g. iter_resources(ec2, 'describe_volumes', 'Volumes')
+    '''
+    for page in iter_pages(client, operation, page_size, **kwargs):
+        yield from page.get(result_key, [])
+
+
+def iter_instances(ec2, **kwargs):
+    '''
+    Yield the EC2 instances of all reservations
+    '''
+    page_size = None if kwargs.get('InstanceIds') else EC2_PAGE_SIZE  # MaxResults cant be used with InstanceIds
+    for reservation in iter_resources(ec2, 'describe_instances', 'Reservations', page_size, **kwargs):
+        yield from reservation['Instances']
+
+
+def iter_snapshots(ec2, **kwargs):
+    return iter_resources(ec2, 'describe_snapshots', 'Snapshots', EC2_PAGE_SIZE, **kwargs)
+
+
+def iter_volumes(ec2, **kwargs):
+    return iter_resources(ec2, 'describe_volumes', 'Volumes', EC2_PAGE_SIZE, **kwargs)
+
+
+def iter_images(ec2, **kwargs):
+    return iter_resources(ec2, 'describe_images', 'Images', EC2_PAGE_SIZE, **kwargs)
+
+
+def iter_security_groups(ec2, **kwargs):
+    return iter_resources(ec2, 'describe_security_groups', 'SecurityGroups', EC2_PAGE_SIZE, **kwargs)
+
+
+def iter_db_instances(rds, **kwargs):
+    return iter_resources(rds, 'describe_db_instances', 'DBInstances', RDS_PAGE_SIZE, **kwargs)
+
+
+def iter_db_snapshots(rds, **kwargs):
+    return iter_resources(rds, 'describe_db_snapshots', 'DBSnapshots', RDS_PAGE_SIZE, **kwargs)
+
+
+def iter_network_interfaces(ec2, **kwargs):
+    return iter_resources(ec2, 'describe_network_interfaces', 'NetworkInterfaces', EC2_PAGE_SIZE, **kwargs)
+
+
+FILTER_VALUES_BATCH = 100  # ids per describe call when reading resources by id
+
+
+def iter_by_ids(iterate, client, filter_name, ids, **kwargs):
+    '''
+    Yield the resources with the given ids, e.g. iter_by_ids(iter_volumes, ec2, 'volume-id', ids).
+    The ids are passed as a filter, in batches, so ids that don't exist anymore are just missing from the results
+    instead of failing the whole call like with VolumeIds=[..]
+    :param iterate: one of the iter_* functions above
+    :param filter_name: the id filter of the describe call, e.g. volume-id, db-snapshot-id
+    '''
+    ids = list(ids)
+    for i in range(0, len(ids), FILTER_VALUES_BATCH):
+        yield from iterate(client, Filters=[{'Name': filter_name, 'Values': ids[i:i + FILTER_VALUES_BATCH]}],
+                           **kwargs)
+
+
+def build_sg_usage_index(ec2):
+    '''
+    Map each security group id of the region to what is using it, built from one pass of describe_instances
+    and one of describe_network_interfaces so ENIs of Lambda, RDS, ELB etc. count as usage as well
+    :return: dict of group id -> list of users (instance id, or eni id with the interface type/description)
+    '''
+    index = {}
+
+    for instance in iter_instances(ec2):
+        for group in instance.get('SecurityGroups', []):
+            index.setdefault(group['GroupId'], {})[instance['InstanceId']] = None
+
+    for eni in iter_network_interfaces(ec2):
+        instance_id = eni.get('Attachment', {}).get('InstanceId')
+        if instance_id:
+            user = instance_id
+        else:
+            user = f"{eni['NetworkInterfaceId']}({eni.get('InterfaceType') or eni.get('Description') or 'eni'})"
+        for group in eni.get('Groups', []):
+            index.setdefault(group['GroupId'], {})[user] = None
+
+    return {group_id: list(users) for group_id, users in index.items()}  # dict keys keep order & remove duplicates
+
+
+S3_DELETE_BATCH = 1000  # max keys of a single delete_objects call
+
+
+def iter_object_batches(s3, bucket, versions=False):
+    '''
+    Yield the objects of the bucket in batches ready for delete_objects, each bucket page is yielded as it arrives
+    :param versions: list all object versions and delete markers (versioned buckets) instead of the current keys
+    :return: lists of up to 1000 {'Key': .., 'VersionId': ..} dicts
+    '''
+    if versions:
+        pages = iter_pages(s3, 'list_object_versions', S3_DELETE_BATCH, Bucket=bucket)
+    else:
+        pages = iter_pages(s3, 'list_objects_v2', S3_DELETE_BATCH, Bucket=bucket)
+
+    batch = []
+    for page in pages:
+        if versions:
+            objects = [{'Key': obj['Key'], 'VersionId': obj['VersionId']}
+                       for key in ('Versions', 'DeleteMarkers') for obj in page.get(key, [])]
+        else:
+            objects = [{'Key': obj['Key']} for obj in page.get('Contents', [])]
+
+        batch.extend(objects)
+        while len(batch) >= S3_DELETE_BATCH:
+            yield batch[:S3_DELETE_BATCH]
+            batch = batch[S3_DELETE_BATCH:]
+    if batch:
+        yield batch
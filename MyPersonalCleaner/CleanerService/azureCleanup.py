@@ -1,122 +1,194 @@
-# todo - connect to auzre
-# todo - get list of RG
-# todo - check tags
-# todo - delete RG
-import configparser
-from time import strftime
-from azure.mgmt.resource import ResourceManagementClient
-from azure.identity import ClientSecretCredential
-from openpyxl import Workbook, load_workbook
-
-xlsx_name = None
-console = False
-Logfile = False
-log_name = strftime('clean_log_Azure_' + "%Y-%b-%d_%H-%M-%S.log")
-
-def create_xlsx():
-    _log(f"INFO: entering create_xlsx()")
-    try:
-        wb = load_workbook(xlsx_name)
-
-    except FileNotFoundError:
-        wb = Workbook()
-
-    ws_ec2 = wb.create_sheet()
-    ws_ec2.title = 'azure RG'
-
-    ws_ec2.append(
-        ("OperationDone", "name", "location", "tags"))
-
-    try:
-        del wb['Sheet']
-    except: pass
-    wb.save(xlsx_name)
-
-
-def print_results_xlsx(**kwargs):
-    _log(f"INFO: entering print_results_xlsx()")
-    wb = load_workbook(xlsx_name)
-    ws = wb[kwargs['sheetname']]
-
-    error = kwargs.get('error')
-
-    row = (
-        kwargs['OperationDone'], kwargs['Name'], kwargs['Location'], str(kwargs['Tags']))
-
-    ws.append(row)
-    wb.save(xlsx_name)
-
-
-def get_config_account(value, section='azure_details',type='string'):
-    _log(f"INFO: entering get_config_account()")
-    config = configparser.ConfigParser()
-    config.read('config.txt')
-    if type == 'string':
-        value = [config[section][value]]
-    elif type == 'bool':
-        value = config[section].getboolean(value)
-    return value
-
-
-def _log(line):
-    '''
-    Print to console and/or file
-    '''
-
-    if Logfile:
-        with open(log_name, "a") as file:
-            file.write(str(line) + '\n')
-    if console:
-        print(line)
-
-def clean_az_rg(xlsxname, dry_run=True):
-
-    client_secret = get_config_account('client_secret')[0]
-    client_id = get_config_account('client_id')[0]
-    tenant_id =get_config_account('tenant_id')[0]
-    subscription_id = get_config_account('subscription_id')[0]
-
-    credential = ClientSecretCredential(tenant_id=tenant_id, client_id=client_id, client_secret=client_secret)
-
-    # subscription_client = SubscriptionClient(credential)
-    # for sub in subscription_client.subscriptions.list():
-    #     print(sub)
-    #     print(sub.__getattribute__('subscription_id'))
-
-    resource_client = ResourceManagementClient(credential, subscription_id)
-    group_list = resource_client.resource_groups.list()
-
-    global xlsx_name
-    global console
-    global Logfile
-
-
-    console = get_config_account('logs_console', 'general','bool')
-    Logfile = get_config_account('logs_file', 'general','bool')
-    _log(f"INFO: entering clean_az_rg()")
-
-    xlsx_name = xlsxname
-    create_xlsx()
-    _log(f'in clean_az_rg(), Dry_run is {dry_run}')
-    for RG in group_list:
-
-        if RG.__getattribute__('tags') is None :
-            _log('Deleting Name: ' + RG.__getattribute__('name'))
-            print_results_xlsx(OperationDone='Delete', Name=RG.__getattribute__('name'),
-                               Location=RG.__getattribute__('location'), Tags=RG.__getattribute__('tags'), sheetname="azure RG")
-            if not dry_run:
-
-                delete_async_operation = resource_client.resource_groups.begin_delete(RG.__getattribute__('name'))
-
-        elif 'keep' not in RG.__getattribute__('tags'):
-            _log('Deleting Name: ' + RG.__getattribute__('name') + ', Tag ' + str(RG.__getattribute__('tags')))
-            print_results_xlsx(OperationDone='Delete', Name=RG.__getattribute__('name'),
-                               Location=RG.__getattribute__('location'), Tags=RG.__getattribute__('tags'), sheetname="azure RG")
-            if not dry_run:
-
-                delete_async_operation = resource_client.resource_groups.begin_delete((RG.__getattribute__('name')))
-
-        else:
-            _log('keeping: ' + RG.__getattribute__('name'))
-            print_results_xlsx(OperationDone='Keep',Name=RG.__getattribute__('name'),Location=RG.__getattribute__('location'),Tags=RG.__getattribute__('tags'), sheetname="azure RG")
-
+# todo - connect to auzre
+# todo - get list of RG
+# todo - check tags
+# todo - delete RG
+import logging
+import time
+from azure.core.exceptions import AzureError, ResourceNotFoundError
+from azure.mgmt.resource import ResourceManagementClient
+from azure.identity import ClientSecretCredential
+from .reportSink import get_report
+from .cleanerConfig import load_config
+from .cleanerLogging import set_outputs
+from .cleanupPolicy import compile_policy
+from .inventoryStore import InventoryWriter, load_plan, fingerprint
+
+logger = logging.getLogger(__name__)
+xlsx_name = None
+
+def create_xlsx():
+    logger.info('entering create_xlsx()')
+    report = get_report(xlsx_name)  # reuse the report of the AWS run if there is one
+
+    report.add_sheet('azure RG',
+        ("OperationDone", "name", "location", "tags", "Status", "Duration (s)"))
+
+
+def print_results_xlsx(**kwargs):
+    logger.debug('entering print_results_xlsx()')
+    report = get_report(xlsx_name)
+
+    error = kwargs.get('error')
+
+    row = (
+        kwargs['OperationDone'], kwargs['Name'], kwargs['Location'], str(kwargs['Tags']), kwargs['Status'],
+        kwargs['Duration'])
+
+    report.append(kwargs['sheetname'], row)
+
+
+def clean_az_rg(xlsxname, dry_run=True, config=None, job_id=None):
+
+    config = config or load_config()  # read config.txt once for the whole run
+
+    resource_client = _resource_client(config)
+    group_list = resource_client.resource_groups.list()
+
+    global xlsx_name
+
+    set_outputs(config)
+    logger.info('entering clean_az_rg()')
+
+    xlsx_name = xlsxname
+    create_xlsx()
+    logger.debug('in clean_az_rg(), Dry_run is %s', dry_run)
+    groups = [_group(RG) for RG in group_list]  # report rows, written once the deletions are done
+    # the resource groups list has no creation time, only the keep tag is checked
+    policy = compile_policy(config, 'azure_rg')
+    decisions, _ = policy.decide([group['Name'] for group in groups], [group['Tags'] for group in groups])
+    for group, decision in zip(groups, decisions.tolist()):
+        group['OperationDone'] = policy.operations[decision]
+        if group['OperationDone'] == 'Delete':
+            logger.info('Deleting Name: %s, Tag %s', group['Name'], group['Tags'])
+            if not dry_run:
+                _begin_delete(resource_client, group)
+        else:
+            logger.info('keeping: %s', group['Name'])
+
+    _wait_deletes(groups, config.azure_delete_timeout)
+    _report_groups(groups, InventoryWriter('azure', config.azure_subscription_id, dry_run, {'azure RG': None},
+                                           job_id=job_id))
+
+
+def apply_az_plan(xlsxname, plan_run, config=None, job_id=None):
+    '''
+    Delete the resource groups planned by a dry run scan (see inventoryStore.load_plan()) without listing them all
+    again, each planned group is read again and only deleted if it did not change since the dry run
+    :param plan_run: ScanRun of the dry run
+    '''
+    config = config or load_config()
+    resource_client = _resource_client(config)
+
+    global xlsx_name
+
+    set_outputs(config)
+    logger.info('entering apply_az_plan() for scan %s', plan_run.pk)
+
+    xlsx_name = xlsxname
+    create_xlsx()
+    groups = []
+    for planned in load_plan(plan_run).get('azure RG', {}).values():
+        for name, (operation, planned_fingerprint) in planned.items():
+            try:
+                group = _group(resource_client.resource_groups.get(name))
+            except ResourceNotFoundError:
+                logger.info('%s not found anymore, skipped', name)
+                continue
+
+            group['OperationDone'] = operation
+            if fingerprint(_group_state(group), operation) != planned_fingerprint:
+                logger.info('%s changed since the dry run, skipped', name)
+                group['OperationDone'] = 'Skip(changed)'
+            else:
+                _begin_delete(resource_client, group)
+            groups.append(group)
+
+    _wait_deletes(groups, config.azure_delete_timeout)
+    _report_groups(groups, InventoryWriter('azure', config.azure_subscription_id, False, {'azure RG': ()},
+                                           job_id=job_id))
+
+
+def _resource_client(config):
+    credential = ClientSecretCredential(tenant_id=config.azure_tenant_id, client_id=config.azure_client_id,
+                                        client_secret=config.azure_client_secret)
+
+    # subscription_client = SubscriptionClient(credential)
+    # for sub in subscription_client.subscriptions.list():
+    #     print(sub)
+    #     print(sub.__getattribute__('subscription_id'))
+
+    return ResourceManagementClient(credential, config.azure_subscription_id)
+
+
+def _group(RG):
+    '''
+    Report row of the resource group, kept until the deletions are done
+    '''
+    return dict(OperationDone='Keep', Name=RG.__getattribute__('name'), Location=RG.__getattribute__('location'),
+                Tags=RG.__getattribute__('tags'), Status='N/A', Duration='N/A', sheetname="azure RG")
+
+
+def _group_state(group):
+    '''
+    The resource group fields kept in the local inventory
+    '''
+    return {'name': group['Name'], 'location': group['Location'], 'tags': group['Tags']}
+
+
+def _report_groups(groups, inventory):
+    '''
+    Write the groups to the report and the local inventory once their deletions are done
+    '''
+    for group in groups:
+        group.pop('poller', None)
+        print_results_xlsx(**group)
+        error = group['Status'] if group['Status'].startswith(('Failed', 'Timeout')) else None
+        inventory.add('azure RG', group['Location'], group['Name'], _group_state(group), group['OperationDone'],
+                      error)
+    inventory.flush()
+
+    logger.info('Writing excel')
+    get_report(xlsx_name).save()
+
+
+def _begin_delete(resource_client, group):
+    '''
+    Start the deletion of the resource group without waiting for it, the poller is kept on the group
+    and the time it completed is recorded by its done callback
+    '''
+    group['started'] = time.monotonic()
+    try:
+        poller = resource_client.resource_groups.begin_delete(group['Name'])
+    except AzureError as e:
+        logger.error('%s', e)
+        group['Status'] = f'Failed: {e}'
+        return
+
+    def finished(_):
+        group['finished'] = time.monotonic()
+
+    poller.add_done_callback(finished)
+    group['poller'] = poller
+
+
+def _wait_deletes(groups, timeout):
+    '''
+    Wait for the deletions started by _begin_delete(), every poller polls in its own thread so they all run
+    concurrently and the timeout is for the whole run, not for each group
+    :param timeout: seconds, groups not deleted by then are reported with a Timeout status
+    '''
+    deadline = time.monotonic() + timeout
+    for group in groups:
+        poller = group.get('poller')
+        if poller is None:
+            continue
+
+        try:
+            poller.wait(max(0, deadline - time.monotonic()))
+        except AzureError as e:
+            logger.error('deleting %s: %s', group['Name'], e)
+            group['Status'] = f'Failed: {e}'
+        else:
+            group['Status'] = poller.status() if poller.done() else f'Timeout ({poller.status()})'
+        group['Duration'] = round(group.get('finished', time.monotonic()) - group['started'], 1)
+        logger.info('%s delete %s after %ss', group['Name'], group['Status'], group['Duration'])
@@ -1,910 +1,1129 @@
-import boto3
-from time import strftime
-import configparser
-from botocore.exceptions import ClientError, WaiterError
-from openpyxl import Workbook, load_workbook
-import datetime, time
-
-log_name = strftime('clean_log_' + "%Y-%b-%d_%H-%M-%S.log")
-xlsx_name = None
-console = False
-Logfile = False
-
-def get_config_regions():
-    """
-    read the region configuration from config.txt and validate it is correct
-    :return: return list of region based on user config.txt
-    """
-    existing_regions = ('eu-north-1', 'ap-south-1', 'eu-west-3', 'eu-west-2', 'eu-west-1', 'ap-northeast-2',
-                        'ap-northeast-1', 'sa-east-1', 'ca-central-1', 'ap-southeast-1', 'ap-southeast-2',
-                        'eu-central-1', 'us-east-1', 'us-east-2', 'us-west-1', 'us-west-2')
-
-    _log('INFO: Checking region config')
-    config = configparser.ConfigParser()
-    config.read('config.txt')
-
-    if config['general'].getboolean('aws_regions_all'):
-        _log('INFO: Regions from config file are - All regions')
-        return existing_regions
-    else:
-        region_list = config['general']['aws_regions'].split(",")
-
-        bad_region = [region for region in region_list if region.strip() not in existing_regions]
-        if bad_region:
-            _log(f"ERROR: Not found - {bad_region}, Please check your configuration")
-        region_list = [region for region in region_list if region.strip() in existing_regions]
-        _log(f"INFO: Valid regions from config file are - {region_list}")
-        return region_list
-
-
-def get_config(value, section,type='string'):
-    '''
-    General get config function, return
-    :param type: whether to get the value as a bool or string from config.txt
-    :return: requested value from config.xt
-    '''
-    config = configparser.ConfigParser()
-    config.read('config.txt')
-    if type == 'string':
-        value = [config[section][value]]
-    elif type == 'bool':
-        value  = config[section].getboolean(value)
-
-    _log(f"INFO: got {value} from section {section}")
-    return value
-
-def clean_ec2(regions, target_account ='Main', dry_run=True):
-    _log(f"INFO: Starting EC2 cleaning for target {target_account}")
-
-    cleanup_mode = get_config('Snapshots', 'cleanup')[0]
-    _log(f'cleanup_mode={cleanup_mode}')
-
-    # going over each region configured and checking for EC2
-    for region in regions:
-        _log(f"INFO: Checking EC2 instances in region - {region}")
-
-        stop_list = []  # will store list of EC2 to be shutdown
-        terminate_list = []  # will store list of EC2 to be terminated
-
-        if target_account == 'Main':
-            _log("INFO: Normal Client")
-            ec2 = boto3.client('ec2', region_name=region.strip())
-        else:
-            _log("INFO: Assume Role Client")
-            ec2 = _assume_role('ec2', region.strip(), 'client')
-
-        response = ec2.describe_instances()
-        ec2_instances = [i for instance in response['Reservations'] for i in
-                         instance['Instances']]  # extract the list of instances from the response
-        if not ec2_instances:
-            _log(f'WARNING: region {region}: No EC2 instances found')
-        else:
-            _log(f'INFO: region {region}: Found EC2 instances')
-            for instance in ec2_instances:
-
-                instance['Account'] = target_account
-
-                # update OperationDone based on cleanup mode selected
-                operation = 'keep'
-                if instance.get('Tags'):
-                    Tags = {tag.get('Key'): tag.get('Value') for tag in instance.get('Tags')}
-
-                    if 'keep' not in Tags:  # no keep tag
-                        operation = 'Terminate'
-                    elif Tags['keep'] != instance['InstanceId']:  # keep tag not equal snapID
-                        operation = 'Terminate'
-                    elif 'keep_state' not in Tags:# instance is tagged, check if need to shutdown
-                        operation = 'Shutdown'
-                else:
-                    Tags = 'N/A'
-                    operation = 'Terminate'
-
-                # for keeptag_withdate option, if less the time param, disable delete
-                instance['ec2_time'] = 'N/A'
-                if cleanup_mode == 'keeptag_withdate':
-                    instance['ec2_time'] = calc_day_time_delta(instance['LaunchTime'], True)
-                    cleanup_mode_time = int(get_config('time', 'cleanup')[0])
-                    if instance['ec2_time'] <= cleanup_mode_time:
-                        operation = 'keep'
-
-                # get tags and check what operation need to be done
-                # if not instance.get('Tags'):
-                #     Tags = 'N/A'
-                #     operation = 'Terminate'
-                # else:
-                #     Tags = {tag.get('Key'): tag.get('Value') for tag in instance.get('Tags')}
-                #     if Tags.get('keep') == 'on':
-                #         operation = 'DoNothing'
-                #     elif Tags.get('keep') == 'off' or Tags.get('keep') == '':
-                #         operation = 'Shutdown'
-                #     else:
-                #         operation = 'Terminate'
-
-                _log(f"INFO: instance: {instance}")
-                print_results_xlsx(data=instance, sheetname='EC2', Tags=str(Tags), OperationDone=operation)
-
-                if operation == 'Shutdown':
-                    stop_list.append(instance['InstanceId'])
-                elif operation == 'Terminate':
-                    terminate_list.append(instance['InstanceId'])
-
-            if stop_list:  # stop the instances
-                _log(f'INFO: Stopping in region{region}: {stop_list}')
-                try:
-                    response = ec2.stop_instances(InstanceIds=stop_list, DryRun=dry_run)
-                    _log(f"INFO: Stopping instance response {response}")
-                except ClientError as e:
-                    if "Request would have succeeded, but DryRun flag is set" not in str(e):
-                        _log(f"ERROR: {e}")
-                        print_results_xlsx(data=str(stop_list), sheetname='EC2', OperationDone='ERROR-Shutdown',
-                                           error=str(e))
-
-            if terminate_list:  # terminate the instances
-                _log(f'INFO: Terminating in region{region}: {terminate_list}')
-                try:
-                    response = ec2.terminate_instances(InstanceIds=terminate_list, DryRun=dry_run)
-                    _log(f"INFO: terminate instance response {response}")
-                except ClientError as e:  # probably some permission error
-                    if "Request would have succeeded, but DryRun flag is set" not in str(e):
-                        _log(f"ERROR: {e}")
-                        print_results_xlsx(data=str(terminate_list), sheetname='EC2', OperationDone='ERROR-Terminate',
-                                           error=str(e))
-                else:  # if termination raised no error, check if it finished (as volume are depended on this)
-                    try:
-                        waiter = ec2.get_waiter('instance_terminated')
-                        waiter.wait(InstanceIds=terminate_list, WaiterConfig={'Delay': 15, 'MaxAttempts': 12},
-                                    DryRun=dry_run)
-                    except WaiterError as e:
-                        _log(f"ERROR: {e}")
-                        print_results_xlsx(data=str(terminate_list), sheetname='EC2',
-                                           OperationDone='ERROR-waitTerminate',
-                                           error=str(e))
-
-        _log(f"INFO: region end: {region}")
-    _log("INFO: existing clean_ec2()")
-
-
-
-def clean_snapshot(regions, target_account ='Main', dry_run=True):
-    """
-    check for snapshot in all regions and delete them all
-    :param dry_run: for BOTO3 call
-    """
-    _log(f"INFO: entering clean_snapshot() for target {target_account}")
-    if target_account == 'Main':
-        account = get_config('aws_account','aws_details')
-    else:
-        account = get_config('aws_account','aws_details_2nd')
-
-    cleanup_mode = get_config('Snapshots','cleanup')[0]
-    _log(f'cleanup_mode={cleanup_mode}')
-
-    for region in regions:
-
-        _log(f'INFO: Cleaning snapshots for {region}')
-        if target_account == 'Main':
-            _log("INFO: Normal Client")
-            ec2 = boto3.client('ec2', region_name=region.strip())
-        else:
-            _log("INFO: Assume Role Client")
-            ec2 = _assume_role('ec2', region.strip(), 'client')
-
-        response = ec2.describe_snapshots(OwnerIds=account)
-        _log(f'describe_snapshots response {response}')
-
-        for snap in response['Snapshots']:
-
-            snap['Operation'] = 'keep'
-            snap['Account'] = target_account
-
-            if snap.get('Tags'):
-                snap['Tags'] = {tag.get('Key'): tag.get('Value') for tag in snap['Tags']}
-            else: snap['Tags'] = 'None'
-
-            #update OperationDone based on cleanup mode selected
-            if snap.get('Tags'):
-                if 'keep' not in snap['Tags']: #no keep tag
-                    snap['Operation'] = 'Delete'
-                elif snap['Tags']['keep'] !=snap['SnapshotId']: # keep tag not equal snapID
-                        snap['Operation'] = 'Delete'
-            else: snap['Operation'] = 'Delete' # no tags
-
-            # for keeptag_withdate option, if less the time param, disable delete
-            snap['snap_time']='N/A'
-            if cleanup_mode == 'keeptag_withdate':
-                snap['snap_time']  = calc_day_time_delta(snap['StartTime'],True)
-                cleanup_mode_time = int(get_config('time', 'cleanup')[0])
-                if snap['snap_time'] <= cleanup_mode_time:
-                    snap['Operation'] = 'keep'
-
-            try:
-                _log(f"INFO: Found {snap['SnapshotId']} for volume: {snap['VolumeId']}, size {snap['VolumeSize']} GB")
-                if snap['Operation'] == 'Delete':
-                    ec2.delete_snapshot(SnapshotId=snap['SnapshotId'], DryRun=dry_run)
-            except ClientError as e:
-                if "Request would have succeeded, but DryRun flag is set" not in str(e):
-                    _log(f'ERROR: {e}')
-                    print_results_xlsx(data=snap, sheetname='Snapshots', region=region, error=e)
-                else:
-                    print_results_xlsx(data=snap, sheetname='Snapshots', region=region)
-            else:
-                print_results_xlsx(data=snap, sheetname='Snapshots', region=region)
-    _log("INFO: existing clean_snapshot()")
-
-
-def clean_volumes(regions, target_account ='Main', dry_run=True):
-    """
-    check for volumes in all regions and delete all state=available volumes
-    :param dry_run: for BOTO 3 call
-    """
-    _log(f"INFO: entering clean_volumes() for target {target_account}")
-    cleanup_mode = get_config('Volumes', 'cleanup')[0]  # get cleanup mode
-    _log(f'cleanup_mode={cleanup_mode}')
-
-    for region in regions:
-        _log(f'INFO: Cleaning available volumes for {region}')
-        if target_account == 'Main':
-            ec2 = boto3.client('ec2', region_name=region.strip())
-        else:
-            ec2 = _assume_role('ec2', region.strip(), 'client')
-
-        response = ec2.describe_volumes()
-        for volume in response['Volumes']:
-            volume['Account'] = target_account
-
-            Tags = volume.get('Tags')
-            if Tags:
-                Tags = {tag.get('Key'): tag.get('Value') for tag in Tags}
-            else: Tag = 'None'
-            _log(f"INFO: Found volume in {volume['AvailabilityZone']}: {volume['VolumeId']}({volume['State']},"
-                f" {volume['Iops']} IOPS, {volume['VolumeType']}) with Tag: {Tags}")
-
-            # update OperationDone based on cleanup mode selected
-            State = 'Keep'
-            volume['volume_time'] = 'N/A'
-            if volume['State'] == 'available':
-                if not Tags:  # no tags at all, delete
-                    State = 'Terminate'
-                elif 'keep' not in Tags:  # no keep tag, delete
-                    State = 'Terminate'
-                elif Tags['keep'] != volume['VolumeId']:
-                    State = 'Terminate'
-
-                # for keeptag_withdate option, if less the time param, disable delete
-
-                if cleanup_mode == 'keeptag_withdate':
-                    volume['volume_time'] = calc_day_time_delta(volume['CreateTime'], True)
-                    cleanup_mode_time = int(get_config('time', 'cleanup')[0])
-                    if volume['volume_time'] <= cleanup_mode_time:
-                        State = 'Keep'
-            try:
-                if State == 'Terminate':
-                    _log('INFO: Deleting Volume')
-                    ec2.delete_volume(VolumeId=volume['VolumeId'], DryRun=dry_run)
-            except ClientError as e:
-                if "Request would have succeeded, but DryRun flag is set" not in str(e):
-                    _log(f'ERROR: {e}')
-                    print_results_xlsx(data=volume, sheetname='Volumes', Tags=Tags, OperationDone=State, error=e)
-                else:
-                    print_results_xlsx(data=volume, sheetname='Volumes', Tags=Tags, OperationDone=State)
-            else:
-                print_results_xlsx(data=volume, sheetname='Volumes', Tags=Tags, OperationDone=State)
-
-    _log("INFO: existing clean_volumes()")
-
-
-def clean_images(regions, target_account ='Main', dry_run=True):
-    """
-    check for AMI's in all regions and Deregister if there is no tag keep
-    :param dry_run: for BOTO 3 call
-    """
-
-    _log(f"INFO: entering clean_images() for target {target_account}")
-    if target_account == 'Main':
-        account = get_config('aws_account', 'aws_details')
-    else:
-        account = get_config('aws_account', 'aws_details_2nd')
-    _log(account)
-
-    cleanup_mode = get_config('Images','cleanup')[0] #get cleanup mode
-    _log(f'cleanup_mode={cleanup_mode}')
-
-    for region in regions:
-        _log(f'INFO: Cleaning available images for {region}')
-        if target_account == 'Main':
-            ec2 = boto3.client('ec2', region_name=region.strip())
-        else:
-            ec2 = _assume_role('ec2', region.strip(), 'client')
-
-        images = ec2.describe_images(Owners=account)
-        if not images['Images']:
-            _log(f'WARNING: no images found for {region}')
-        else:
-            for img in images['Images']:
-
-                Tags = img.get('Tags')
-                if Tags: #get tags
-                    Tags = img.get('Tags')
-                    Tags = {tag.get('Key'): tag.get('Value') for tag in Tags}
-
-                # update OperationDone based on cleanup mode selected
-                OperationDone = 'Keep'
-                if not Tags: # no tags at all, delete
-                    OperationDone = 'Deregister'
-                elif 'keep' not in Tags: # no keep tag, delete
-                    OperationDone = 'Deregister'
-                elif Tags['keep']!= img['ImageId']:
-                    OperationDone = 'Deregister'
-
-                # for keeptag_withdate option, if less the time param, disable delete
-                img['amitime'] ='N/A'
-                if cleanup_mode == 'keeptag_withdate':
-                    DATETIME_FORMAT_YMD_HMS = "%Y-%m-%dT%H:%M:%S.%fZ"
-                    img['amitime'] = datetime.datetime.strptime(img['CreationDate'], DATETIME_FORMAT_YMD_HMS)
-                    img['amitime'] = calc_day_time_delta(img['amitime'], False)
-                    cleanup_mode_time = int(get_config('time', 'cleanup')[0])
-                    if img['amitime'] <= cleanup_mode_time:
-                        OperationDone = 'Keep'
-
-                img['Account'] = target_account
-                try:
-                    if OperationDone == "Deregister":
-                        ec2.deregister_image(ImageId=img['ImageId'], DryRun=dry_run)
-
-                except ClientError as e:
-                    if "Request would have succeeded, but DryRun flag is set" not in str(e):
-                        print_results_xlsx(data=img, sheetname='Images', region=region, OperationDone=OperationDone,
-                                           Tags=Tags, error=e)
-                    else:
-                        print_results_xlsx(data=img, sheetname='Images', region=region, OperationDone=OperationDone,
-                                           Tags=Tags)
-                else:
-                    print_results_xlsx(data=img, sheetname='Images', region=region, OperationDone=OperationDone,
-                                       Tags=Tags)
-    _log("INFO: existing clean_images()")
-
-
-def clean_sg(regions, target_account ='Main', dry_run=True):
-    """
-    Check each region for security groups with boto3, delete SG that are unused & untagged
-    :param dry_run: used for boto call, to avoid actually deleting anything
-    :return: None
-    """
-    _log(f"INFO: Cleaning SG for target {target_account}")
-    headers = ["Region", "OwnerId", "SG Name", "SG Id", "VpcId", "FromPort",
-               "ToPort", "IpProtocol", "Source", "Instances", "Tags", "OperationDone"]
-
-    for region in regions:  # iterate over the region list and get the SG's
-        if target_account == 'Main':
-            ec2 = boto3.client('ec2', region_name=region.strip())
-        else:
-            ec2 = _assume_role('ec2', region.strip(), 'client')
-
-        response = ec2.describe_security_groups()
-
-        _log(f"INFO: Checking SG in region - {region}")
-
-        security_group_record = {'Region': region}  # dict for the SG, will be send later to the report
-
-        for sg in response['SecurityGroups']:  # iterate over all the SG in the current region and add data to dict
-            _log(f"INFO: Found security group")
-            _log(f"INFO: {sg}")
-
-            security_group_record['GroupName'] = sg['GroupName']
-            security_group_record['VpcId'] = sg.get('VpcId')
-            security_group_record['Account'] = target_account
-
-            security_group_record['Instances'] = ''
-
-            # get instances so we have SG -> relation
-            instances_for_sg = ec2.describe_instances(
-                Filters=[{'Name': 'instance.group-id', 'Values': [sg.get('GroupId'), ]}, ])
-            instances_for_sg = [i for instance in instances_for_sg['Reservations'] for i in
-                                instance['Instances']]
-            instances_for_sg = [instance['InstanceId'] for instance in instances_for_sg]
-
-            # set OperationDone to N/A, will be updated later if we delete
-            security_group_record['OperationDone'] = 'N/A'
-            security_group_record['GroupId'] = sg.get('GroupId')
-            if sg.get('Tags'):
-                security_group_record['Tags'] = {tag.get('Key'): tag.get('Value') for tag in sg.get('Tags')}
-            else: security_group_record['Tags'] = 'None'
-
-            delete_error = "None"
-            if not instances_for_sg:  # if no instances found, check for tag and update 'OperationDone'
-                security_group_record['Instances'] = 'N/A'
-
-                sg_tag_no_delete = False
-
-                if sg.get('Tags'):  # check if there are any tags at all
-                    for tag in sg.get('Tags'):  # check for the relevant tag
-                        if tag.get('Key') == 'keep':
-                            _log('INFO: Found no delete tag(keep)')
-                            sg_tag_no_delete = True  # don't delete
-
-                if security_group_record['GroupName'] == 'default':  # cant delete default groups
-                    sg_tag_no_delete = True  # don't delete
-
-                if not sg_tag_no_delete:
-                    security_group_record['OperationDone'] = 'Deleting'
-                    _log(f'INFO: removing sg - {sg.get("GroupId")}')
-                    try:
-                        ec2.delete_security_group(GroupId=sg.get('GroupId'), DryRun=dry_run)
-                    except ClientError as e:
-                        if "Request would have succeeded, but DryRun flag is set" not in str(e):
-
-                            delete_error = e
-                        else:
-                            delete_error = 'None'
-
-            else:
-                security_group_record['Instances'] = ', '.join(instances_for_sg)  # convert instance list to string
-
-            print_results_xlsx(data=security_group_record, sheetname='SG',
-                               OperationDone=security_group_record['OperationDone'], error=delete_error)
-        _log("INFO: Region END")
-
-
-def clean_rds_instances(regions, target_account ='Main', dry_run=True):
-    '''
-    Clean all untagged RDS instance in the target region
-    '''
-
-    _log(f"INFO: entering clean_rds_instances() for target {target_account}")
-    cleanup_mode = get_config('RDS', 'cleanup')[0]
-    _log(f'cleanup_mode={cleanup_mode}')
-
-    for region in regions:
-        _log(f'INFO: Cleaning available RDS for {region}')
-        if target_account == 'Main':
-            rds = boto3.client('rds', region_name=region.strip())
-        else:
-            rds = _assume_role('rds', region.strip(), 'client')
-
-        databases = rds.describe_db_instances()
-        for db in databases['DBInstances']:
-            db['region'] = region.strip()
-            db['Account'] = target_account
-
-
-            if db['BackupRetentionPeriod'] == 0: # related to automatic backup for excel
-                db['BackupRetentionPeriod'] = 'Disable'
-            else:
-                db['BackupRetentionPeriod'] = 'Enable'
-
-            db['operation'] = 'DoNothing'
-            if not db.get('TagList'): # no tags at all, terminate
-                db['TagList'] = 'None'
-                db['operation'] = 'Terminate'
-
-            else: #tags exist
-                db['TagList'] = {tag.get('Key'): tag.get('Value') for tag in db.get('TagList')}
-                if db['TagList'].get('keep') != db['DBInstanceIdentifier']: #check if keep != db ID and if so delete
-                    db['operation'] = 'Terminate'
-                elif not db['TagList'].get('keep_state'): #db is tagged, check if need to shutdown
-                    db['operation'] = 'Shutdown'
-
-            #check if keeptag_withdate and update operaion if needed
-            db['db_time'] = 'N/A'
-            if cleanup_mode == 'keeptag_withdate':
-                db['db_time'] = calc_day_time_delta(db['InstanceCreateTime'], True)
-                cleanup_mode_time = int(get_config('time', 'cleanup')[0])
-                if db['db_time'] <= cleanup_mode_time:
-                    db['operation'] = 'Ignore'
-            try:
-                if not dry_run:
-                    if db['operation']  == 'Terminate' :
-                        rds.delete_db_instance(DBInstanceIdentifier=db['DBInstanceIdentifier'], SkipFinalSnapshot=True,
-                                               DeleteAutomatedBackups=True)
-                    elif db['operation']  == 'Shutdown':
-                        rds.stop_db_instance(DBInstanceIdentifier=db['DBInstanceIdentifier'])
-
-            except ClientError as e:
-                db['error'] = e
-
-            else:
-                db['error'] = 'None'
-            print_results_xlsx(data=db, sheetname='RDS Instances')
-
-
-def clean_rds_instances_snaps(regions, target_account ='Main', dry_run=True):
-    '''
-    Clean all Manual RDS Snapshots from the target regions
-    '''
-
-    _log(f"INFO: entering clean_rds_instances_snaps() for target {target_account}")
-
-    cleanup_mode = get_config('RDS_Snaps', 'cleanup')[0]
-    _log(f'cleanup_mode={cleanup_mode}')
-
-    for region in regions:
-        _log(f'INFO: Cleaning available RDS snaps for {region}')
-        if target_account == 'Main':
-            rds = boto3.client('rds', region_name=region.strip())
-        else:
-            rds = _assume_role('rds', region.strip(), 'client')
-
-        databases_snapshots = rds.describe_db_snapshots()
-
-        for db_snap in databases_snapshots['DBSnapshots']:
-
-            db_snap['region'] = region.strip()
-            db_snap['Account'] = target_account
-
-            if db_snap.get('TagList'): # check for tags
-                db_snap['TagList'] = {tag.get('Key'): tag.get('Value') for tag in db_snap['TagList']}
-            else: db_snap['TagList'] = 'None'
-            db_snap['operation'] = 'Ignore'
-            if db_snap['SnapshotType'] == 'manual': # can only delete manual snaps
-                if 'keep' not in db_snap['TagList']: # if no keep tag delete
-                    db_snap['operation'] = 'Delete'
-                elif db_snap['TagList']['keep'] != db_snap['DBSnapshotIdentifier']: #if keep != snap-Id delete
-                    db_snap['operation'] = 'Delete'
-
-            # for keeptag_withdate option, if less the time param, disable delete
-            db_snap['snap_time'] = 'N/A'
-            if cleanup_mode == 'keeptag_withdate': # check for snapshot age
-                db_snap['snap_time'] = calc_day_time_delta(db_snap['SnapshotCreateTime'], True)
-                cleanup_mode_time = int(get_config('time', 'cleanup')[0])
-                if db_snap['snap_time'] <= cleanup_mode_time:
-                    db_snap['operation'] = 'Ignore'
-
-            try:
-
-                if not dry_run and db_snap['SnapshotType'] == 'manual' and db_snap['operation'] == 'Delete':
-                    rds.delete_db_snapshot(DBSnapshotIdentifier=db_snap['DBSnapshotIdentifier'])
-
-            except ClientError as e:
-                db_snap['error'] = e
-
-            else:
-                db_snap['error'] = 'None'
-            print_results_xlsx(data=db_snap, sheetname='RDS Snapshots')
-
-
-def clean_S3_objects(target_account ='Main', dry_run=True):
-    '''
-    Clean all S3 objects from untagged bucket
-    '''
-
-    _log(f"INFO: entering clean_S3_objects() for target {target_account}")
-
-    if target_account =='Main':
-        s3 = boto3.client('s3')
-    else:
-        s3 = _assume_role('s3', 'us-east-1', 'client')
-
-    bucket_list = s3.list_buckets()
-    for bucket in bucket_list['Buckets']:
-        bucket['failcount'] = 0
-        bucket['Account'] = target_account
-
-        if target_account == 'Main':
-            s3cleanup = boto3.resource('s3')
-        else:
-            s3cleanup = _assume_role('s3', 'us-east-1', 'resource')
-
-        _log(f" In bucket {bucket['Name']}, created boto3.resource, timestamp: {datetime.datetime.now()}")
-        mybucket = s3cleanup.Bucket(bucket['Name'])
-        keycount = sum(1 for _ in mybucket.objects.all())
-
-
-        try:
-            bucket['error']='None'
-            tags = s3.get_bucket_tagging(Bucket=bucket['Name'])
-
-        except ClientError as e:
-
-            if 'NoSuchTagSet' in str(e) and keycount > 0:
-                bucket['TagList'] = '[]'
-                bucket['operation'] = 'Delete'
-
-            elif keycount == 0:
-                bucket['TagList'] = '[]'
-                bucket['operation'] = 'DoNothing'
-
-            else:
-                bucket['error'] = e
-                bucket['TagList'] = '[]'
-                bucket['operation'] = 'N/A'
-
-        else:
-            tags['TagSet'] = {tag.get('Key'): tag.get('Value') for tag in tags['TagSet']}
-            if 'keep' not in str(tags['TagSet']) and keycount > 0:
-                bucket['TagList'] = tags['TagSet']
-                bucket['operation'] = 'Delete'
-
-            else:
-                bucket['TagList'] = tags['TagSet']
-                bucket['operation'] = 'DoNothing'
-
-
-
-
-        if bucket['operation'] == 'Delete' and not dry_run:
-            if keycount > 0:
-                _log(f" keycount:  {keycount}, Doing delete(),  timestamp: {datetime.datetime.now()}")
-                res = mybucket.objects.all().delete()
-                if res[0].get('Errors'):
-                    bucket['failcount'] += len(res[0]['Errors'])
-                    bucket['error'] = res[0]['Errors'][0]['Code']
-                _log(f" Finished delete(),  timestamp: {datetime.datetime.now()}")
-
-
-        bucket['KeyCount'] = str(keycount)
-        bucket['Account'] = target_account
-        print_results_xlsx(data=bucket, sheetname='S3 Objects')
-
-
-def create_xlsx(EC2=False, Volumes=False, Snapshots=False, Images=False, SG=False, RDS=False, RDS_Snaps=False, S3_Objects=False):
-    '''
-    Create the intial xlsx file with the releavant tabs based on the above param,
-    '''
-    _log('INFO: Creating excel')
-    wb = Workbook()
-
-    if EC2:
-        # ws_ec2 = wb.active
-        ws_ec2 = wb.create_sheet()
-        ws_ec2.title = 'EC2'
-        ws_ec2.append(
-            ("OperationDone", "Age", "InstanceId", "InstanceType", "AvailabilityZone",
-             "State", "Volumes",  "Account",
-             "Tags"))
-
-    if Volumes:
-        ws_volumes = wb.create_sheet()
-        ws_volumes.title = 'Volumes'
-        ws_volumes.append(
-            ("OperationDone","Age" ,"VolumeId", "AvailabilityZone", "State", "VolumeType", "Size(GB)", "Iops", "Account", "Tags",
-             "Errors"))
-
-    if Images:
-        ws_images = wb.create_sheet()
-        ws_images.title = 'Images'
-        ws_images.append(
-            ("OperationDone", "Age", "ImageId", "Name", "Region", "Account", "ImageType", "CreationDate", "Tags", "Errors"))
-
-    if Snapshots:
-        ws_snapshots = wb.create_sheet()
-        ws_snapshots.title = 'Snapshots'
-        ws_snapshots.append(("OperationDone","Age","SnapshotID", "VolumeId", "Region", "Account", "Tags", "Errors"))
-
-    if SG:
-        ws_images = wb.create_sheet()
-        ws_images.title = 'SG'
-        ws_images.append(
-            ("OperationDone", "SG Id", "SG Name", "Account", "Region", "VpcId", "Instances", "Tags","Errors"))
-
-    if RDS:
-        ws_images = wb.create_sheet()
-        ws_images.title = 'RDS Instances'
-        ws_images.append(
-            ("OperationDone", "Age","Region", "DBInstanceIdentifier", "DBInstanceStatus", "DBInstanceClass",
-             "AllocatedStorage", "Automatic Backups", "Account",  "Tags", "Errors"))
-
-    if RDS_Snaps:
-        ws_images = wb.create_sheet()
-        ws_images.title = 'RDS Snapshots'
-        ws_images.append(
-            ("OperationDone", "Age", "Region", "DBSnapshotIdentifier", "DBInstanceIdentifier", "SnapshotType", "Account",
-             "Tags", "Errors"))
-
-    if S3_Objects:
-        ws_images = wb.create_sheet()
-        ws_images.title = 'S3 Objects'
-        ws_images.append(("OperationDone", "Bucket", "Tags", "Key Count", "Failed Count","Account", "Errors"))
-
-    del wb['Sheet']
-    wb.save(xlsx_name)
-def print_results_xlsx(**kwargs):
-    '''
-    Add row to the xlsx file created with create_xlsx()
-    :param kwargs: holds all info passed from the releavnt clean functions
-    '''
-    wb = load_workbook(xlsx_name)
-    ws = wb[kwargs['sheetname']]
-
-    error = kwargs.get('error')
-    if kwargs['sheetname'] == 'Volumes':
-        row = (
-            kwargs['OperationDone'], kwargs['data']['volume_time'],  kwargs['data']['VolumeId'], kwargs['data']['AvailabilityZone'],
-            kwargs['data']['State'], kwargs['data']['VolumeType'], kwargs['data']['Size'], kwargs['data']['Iops'], kwargs['data']['Account'],
-            str(kwargs['Tags']), str(error)
-        )
-        ws.append(row)
-        wb.save(xlsx_name)
-
-    elif kwargs['sheetname'] == 'Snapshots':
-        if not kwargs['data'].get('Tags'):
-            kwargs['data']['Tags'] = 'N/A'
-        row = (kwargs['data']['Operation'],kwargs['data']['snap_time'], kwargs['data']['SnapshotId'],kwargs['data']['VolumeId'], kwargs['region'], kwargs['data']['Account'], str(kwargs['data']['Tags']),
-               str(error))
-        ws.append(row)
-        wb.save(xlsx_name)
-
-    elif kwargs['sheetname'] == 'Images':
-        row = (kwargs['OperationDone'], kwargs['data']["amitime"], kwargs['data']["ImageId"], kwargs['data']["Name"], kwargs['region'],
-               kwargs['data']["Account"], kwargs['data']["ImageType"], kwargs['data']["CreationDate"],
-               str(kwargs["Tags"]), str(error))
-        ws.append(row)
-        wb.save(xlsx_name)
-
-    elif kwargs['sheetname'] == 'EC2' and error == None:
-
-        volume_list = ''
-        for volume in kwargs['data']['BlockDeviceMappings']:
-            volume_list += f"{(volume['Ebs']['VolumeId'])}({volume['Ebs']['Status']}),  "
-
-        # sg_list_name = ''
-        # sg_list_id = ''
-        # for sg in kwargs['data']['SecurityGroups']:
-        #     sg_list_name += f"{sg['GroupName']},  "
-        #     sg_list_id += f"{sg['GroupId']},  "
-
-        row = (kwargs['OperationDone'], kwargs['data']['ec2_time'], kwargs['data']['InstanceId'], kwargs['data']['InstanceType'],
-               kwargs['data']['Placement']['AvailabilityZone'],
-               kwargs['data']['State']['Name'],
-               volume_list, kwargs['data']['Account'],
-               kwargs['Tags'])
-        ws.append(row)
-        wb.save(xlsx_name)
-    elif kwargs['sheetname'] == 'EC2':
-        ws.append((kwargs['OperationDone'], kwargs['data'], error))
-        wb.save(xlsx_name)
-
-    elif kwargs['sheetname'] == 'SG':
-
-        row = (
-            kwargs['OperationDone'], kwargs['data']["GroupId"], kwargs['data']["GroupName"], kwargs['data']["Account"],
-            kwargs['data']['Region'], kwargs['data']["VpcId"], kwargs['data']["Instances"], str(kwargs['data']["Tags"]),
-            str(error))
-
-        ws.append(row)
-        wb.save(xlsx_name)
-
-    elif kwargs['sheetname'] == 'RDS Instances':
-
-        row = (kwargs['data']["operation"], kwargs['data']["db_time"], kwargs['data']["region"], kwargs['data']["DBInstanceIdentifier"],
-               kwargs['data']["DBInstanceStatus"], kwargs['data']["DBInstanceClass"],
-               kwargs['data']["AllocatedStorage"], kwargs['data']["BackupRetentionPeriod"], kwargs['data']["Account"],
-               str(kwargs['data']["TagList"]),
-               str(kwargs['data']["error"]))
-
-        ws.append(row)
-        wb.save(xlsx_name)
-
-    elif kwargs['sheetname'] == 'RDS Snapshots':
-        # ("OperationDone", "Region", "DBSnapshotIdentifier", "DBInstanceIdentifier", "SnapshotType",
-        #  "Tags", "Errors")
-        row = ( kwargs['data']['operation'], kwargs['data']['snap_time'], kwargs['data']["region"], kwargs['data']["DBSnapshotIdentifier"], kwargs['data']["DBInstanceIdentifier"],
-               kwargs['data']["SnapshotType"], kwargs['data']["Account"], str(kwargs['data']["TagList"]),
-               str(kwargs['data']["error"]))
-
-        ws.append(row)
-        wb.save(xlsx_name)
-
-    elif kwargs['sheetname'] == 'S3 Objects':
-        # ("OperationDone", "Region", "DBSnapshotIdentifier", "DBInstanceIdentifier", "SnapshotType",
-        #  "Tags", "Errors")
-        row = ( kwargs['data']['operation'],  kwargs['data']["Name"], str(kwargs['data']["TagList"]), str(kwargs['data']["KeyCount"]),
-                str(kwargs['data']["failcount"]),str(kwargs['data']["Account"]),str(kwargs['data']["error"]))
-
-        ws.append(row)
-        wb.save(xlsx_name)
-
-
-def _log(line):
-    '''
-    Print to console and/or file
-    '''
-
-    if Logfile:
-        with open(log_name, "a") as file:
-            file.write(str(line) + '\n')
-    if console:
-        print(line)
-
-def run_aws_cleanup(xlsxname, dry_run=True,EC2=False, Volumes=False, Snapshots=False, Images=False, SG=False, RDS=False, RDS_Snaps=False, S3_Objects=False, target_account='Main', createxlsx= True):
-    '''
-    Called from view.py, main function to run the cleanup operation, will call relevant cleanup function based on param recieved from views.py
-    :param xlsxname: name of the xlsx file
-    :param target_account: Main or Second
-    :param createxlsx: does xlsx file need to be created or not
-    :return:
-    '''
-    global xlsx_name
-    global console
-    global Logfile
-
-
-    xlsx_name = xlsxname
-
-    console = get_config('logs_console', 'general', 'bool')
-    Logfile = get_config('logs_file', 'general', 'bool')
-    _log(f"INFO: entering run_aws_cleanup() for target {target_account}")
-
-    regions = get_config_regions()
-
-    if createxlsx:
-        create_xlsx(EC2=EC2, Volumes=Volumes, Snapshots=Snapshots, Images=Images, SG=SG, RDS=RDS, RDS_Snaps=RDS_Snaps, S3_Objects=S3_Objects)
-
-
-    if EC2:
-        clean_ec2(regions, target_account, dry_run)
-
-    if Volumes:
-        clean_volumes(regions, target_account, dry_run)
-
-    if Images:
-        clean_images(regions, target_account, dry_run)
-
-    if Snapshots:
-        clean_snapshot(regions, target_account, dry_run)
-
-    if SG:
-        clean_sg(regions, target_account, dry_run)
-    if RDS:
-        clean_rds_instances(regions, target_account, dry_run)
-
-    if RDS_Snaps:
-        clean_rds_instances_snaps(regions, target_account, dry_run)
-
-    if S3_Objects:
-        clean_S3_objects(target_account, dry_run)
-
-
-
-def _assume_role(service,region='us-east-1', type='client'):
-    '''
-    Used to create assume role client for the requested service
-    :param service: which AWS service
-    :param type: default is client, can be resource(for S3)
-    :return: the created client
-    '''
-
-    _log(f'INFO Entering _assume_role() for service {service} for region {region}')
-
-    sts = boto3.client('sts')
-
-    sts_response = sts.assume_role(
-        RoleArn=get_config('role_to_assume', 'aws_details_2nd')[0].strip(),
-        RoleSessionName='cleanersession' + service
-    )
-
-    new_session_id = sts_response["Credentials"]["AccessKeyId"]
-    new_session_key = sts_response["Credentials"]["SecretAccessKey"]
-    new_session_token = sts_response["Credentials"]["SessionToken"]
-
-    if type=='client':
-        assumed_client = boto3.client(
-            service,
-            region_name=region,
-            aws_access_key_id=new_session_id,
-            aws_secret_access_key=new_session_key,
-            aws_session_token=new_session_token
-        )
-        return assumed_client
-    else:
-        assumed_resource = boto3.resource(
-            service,
-            region_name=region,
-            aws_access_key_id=new_session_id,
-            aws_secret_access_key=new_session_key,
-            aws_session_token=new_session_token
-        )
-        return assumed_resource
-
-def calc_day_time_delta(resourceTime,tz=True):
-    '''
-    calc the delta between current time and time param, used for datebased cleanup
-    :param time: the time of the creation of the resource or snapshot
-    :return: delta in days
-    '''
-    if tz:
-        now = datetime.datetime.combine(datetime.datetime.now(datetime.timezone.utc) , datetime.time.max,tzinfo=datetime.timezone.utc)
-        resourceTime =  datetime.datetime.combine(resourceTime,datetime.time.min, tzinfo=datetime.timezone.utc)
-        return (now - resourceTime).days
-    else: return (datetime.datetime.utcnow() -resourceTime).days
-
-
+import boto3
+from botocore.exceptions import ClientError
+from botocore.credentials import RefreshableCredentials
+from botocore.session import get_session
+from .reportSink import create_report, get_report
+from .cleanerConfig import load_config, AWS_REGIONS
+from .deleteExecutor import DeleteExecutor
+from .clientFactory import ClientFactory
+from .cleanerLogging import set_outputs
+from .apiMetrics import ApiMetrics, METRICS_HEADERS
+from .taskScheduler import TaskScheduler, Pending
+from .referenceGraph import ReferenceGraph
+from .cleanupPolicy import compile_policy, batches, DELETE
+from .inventoryStore import InventoryWriter, load_plan, record_state, fingerprint, empty_regions, record_region_scans
+from .resourceRecords import tags_from_list, Ec2Record, VolumeRecord, ImageRecord, SnapshotRecord, SecurityGroupRecord, \
+    DBInstanceRecord, DBSnapshotRecord, BucketRecord
+from .awsInventory import iter_instances, iter_snapshots, iter_volumes, iter_images, iter_security_groups, \
+    iter_db_instances, iter_db_snapshots, build_sg_usage_index, iter_object_batches, iter_by_ids
+import datetime, time
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+xlsx_name = None
+_role_sessions = {}  # role arn -> boto3 session with auto refreshed credentials, see _role_session()
+_role_sessions_lock = threading.RLock()
+_clients = None  # ClientFactory of the running cleanup, see _aws_client()
+_metrics = None  # ApiMetrics of the running cleanup, measure the calls of its clients
+new_session = boto3.session.Session  # creates the Main account session, the benchmark command serves a synthetic fleet
+_discovered_regions = {}  # account id -> (time, regions), see _discover_regions()
+REGIONS_CACHE_SECONDS = 24 * 3600
+_region_rows = threading.local()  # report rows of the task handled by the current thread, see _run_cleaners()
+_inventory = None  # InventoryWriter of the running scan, the reported records are added to the local inventory
+
+# server side filters of the cleaners, only the resources that can be cleaned are returned by the API
+EC2_FILTERS = [{'Name': 'instance-state-name', 'Values': ['pending', 'running', 'stopping', 'stopped']}]
+VOLUME_FILTERS = [{'Name': 'status', 'Values': ['available']}]
+RDS_SNAPSHOT_TYPE = 'manual'  # automated snapshots are deleted by RDS itself, can't be deleted
+
+# cleaner -> cleaners that must be done in the same region first, a resource can't be deleted while it is in use
+_DEPENDS_ON = {
+    'Volumes': ('EC2',),  # the volumes of the terminated instances are available once they are terminated
+    'SG': ('EC2',),  # the SGs (and ENIs) of the terminated instances are in use until then
+    'Snapshots': ('Images',),  # the snapshots of an AMI can't be deleted until it is deregistered
+}
+# the most cleaners sharing the client of a region: EC2, Volumes, Snapshots, Images and SG all use the ec2 client
+REGION_CLIENT_CLEANERS = 5
+TERMINATE_POLL_SECONDS = 15  # how often the instances terminated by the EC2 cleaner are checked
+TERMINATE_TIMEOUT_SECONDS = 180  # the cleaners depending on EC2 start anyway after that, with an error row
+
+# cheap check of a region that was empty on the last scans: (service, call, params for the account id, result key),
+# a single call with the smallest page, same filters as the cleaner. SG is not here as the default SG is always there
+# and Images as describe_images has no page size in the pinned botocore
+_REGION_PROBES = {
+    'EC2': ('ec2', 'describe_instances', lambda account: {'Filters': EC2_FILTERS, 'MaxResults': 5}, 'Reservations'),
+    'Volumes': ('ec2', 'describe_volumes', lambda account: {'Filters': VOLUME_FILTERS, 'MaxResults': 5}, 'Volumes'),
+    'Snapshots': ('ec2', 'describe_snapshots', lambda account: {'OwnerIds': [account], 'MaxResults': 5}, 'Snapshots'),
+    'RDS Instances': ('rds', 'describe_db_instances', lambda account: {'MaxRecords': 20}, 'DBInstances'),
+    'RDS Snapshots': ('rds', 'describe_db_snapshots',
+                      lambda account: {'SnapshotType': RDS_SNAPSHOT_TYPE, 'MaxRecords': 20}, 'DBSnapshots'),
+}
+
+def clean_ec2(regions, target_account ='Main', dry_run=True, config=None):
+    logger.info('Starting EC2 cleaning for target %s', target_account)
+    config = config or load_config()
+
+    # going over each region configured and checking for EC2, regions run in parallel
+    _run_regions(regions, _clean_ec2_region, target_account, dry_run, config, 'EC2')
+    logger.info('existing clean_ec2()')
+
+
+def _clean_ec2_region(region, target_account, dry_run, config, graphs=None):
+    '''
+    EC2 cleanup for a single region, called by clean_ec2() for each region
+    :param graphs: region -> ReferenceGraph of the run, the instances are added for the snapshots cleaner
+    '''
+    policy = compile_policy(config, 'EC2')
+    logger.debug('cleanup_mode=%s', config.cleanup_mode('EC2'))
+    logger.info('Checking EC2 instances in region - %s', region)
+
+    stop_list = []  # will store list of EC2 to be shutdown
+    terminate_list = []  # will store list of EC2 to be terminated
+    terminating = None  # Pending while the terminated instances are not gone
+
+    ec2 = _aws_client('ec2', region, target_account, config)
+    graph = ReferenceGraph() if graphs is None else graphs.setdefault(region, ReferenceGraph())
+
+    found = 0
+    # instances are read page by page, no terminated ones
+    instances = (Ec2Record.from_api(instance, region, target_account)
+                 for instance in iter_instances(ec2, Filters=EC2_FILTERS))
+    for batch in batches(instances):
+        if not found:
+            logger.info('region %s: Found EC2 instances', region)
+        found += len(batch)
+
+        # update OperationDone based on cleanup mode selected
+        policy.apply(batch)
+
+        for instance in batch:
+            logger.debug('instance: %s', instance)
+            print_results_xlsx(data=instance, sheetname='EC2')
+            graph.add_instance(instance.instance_id, [volume_id for volume_id, status in instance.volumes])
+
+            if instance.operation == 'Shutdown':
+                stop_list.append(instance.instance_id)
+            elif instance.operation == 'Terminate':
+                terminate_list.append(instance.instance_id)
+
+    graph.instances_listed = True
+    _report_filter('EC2', region, target_account, EC2_FILTERS, found)
+    if not found:
+        logger.warning('region %s: No EC2 instances found', region)
+    else:
+        if stop_list:  # stop the instances
+            logger.info('Stopping in region%s: %s', region, stop_list)
+            try:
+                response = ec2.stop_instances(InstanceIds=stop_list, DryRun=dry_run)
+                logger.debug('Stopping instance response %s', response)
+            except ClientError as e:
+                if "Request would have succeeded, but DryRun flag is set" not in str(e):
+                    logger.error('%s', e)
+                    print_results_xlsx(data=str(stop_list), sheetname='EC2', OperationDone='ERROR-Shutdown',
+                                       error=str(e))
+
+        if terminate_list:  # terminate the instances
+            logger.info('Terminating in region%s: %s', region, terminate_list)
+            try:
+                response = ec2.terminate_instances(InstanceIds=terminate_list, DryRun=dry_run)
+                logger.debug('terminate instance response %s', response)
+            except ClientError as e:  # probably some permission error
+                if "Request would have succeeded, but DryRun flag is set" not in str(e):
+                    logger.error('%s', e)
+                    print_results_xlsx(data=str(terminate_list), sheetname='EC2', OperationDone='ERROR-Terminate',
+                                       error=str(e))
+            else:  # the volumes and SGs of the region wait for the termination (see _DEPENDS_ON), not this thread
+                terminating = _wait_terminated(ec2, region, terminate_list)
+
+    logger.info('region end: %s', region)
+    return terminating
+
+
+def _wait_terminated(ec2, region, instance_ids):
+    '''
+    Pending result of the EC2 region task, polled by the scheduler instead of blocking the region thread on the
+    instance_terminated waiter. Each poll reads all the instances still running with one call per 100 ids, after
+    TERMINATE_TIMEOUT_SECONDS an ERROR-waitTerminate row is added and the dependent cleaners start anyway
+    '''
+    remaining = set(instance_ids)
+    deadline = time.monotonic() + TERMINATE_TIMEOUT_SECONDS
+    rows = _region_rows.rows  # the rows of the region task, still merged into the report after the poll
+
+    def poll():
+        try:
+            states = {instance['InstanceId']: instance['State']['Name']
+                      for instance in iter_by_ids(iter_instances, ec2, 'instance-id', sorted(remaining))}
+        except ClientError as e:  # polled again next time
+            logger.error('region %s: reading the terminated instances failed: %s', region, e)
+        else:
+            remaining.difference_update(instance_id for instance_id in list(remaining)
+                                        if states.get(instance_id, 'terminated') == 'terminated')
+        if not remaining:
+            return True
+        if time.monotonic() >= deadline:
+            error = f'not terminated after {TERMINATE_TIMEOUT_SECONDS}s'
+            logger.error('region %s: %s %s', region, sorted(remaining), error)
+            rows.append(('EC2', ('ERROR-waitTerminate', str(sorted(remaining)), error)))
+            return True
+        return False
+
+    return Pending(None, poll)
+
+
+def clean_snapshot(regions, target_account ='Main', dry_run=True, config=None):
+    """
+    check for snapshot in all regions and delete them all
+    :param dry_run: for BOTO3 call
+    """
+    logger.info('entering clean_snapshot() for target %s', target_account)
+    config = config or load_config()
+
+    _run_regions(regions, _clean_snapshot_region, target_account, dry_run, config, 'Snapshots')
+    logger.info('existing clean_snapshot()')
+
+
+def _clean_snapshot_region(region, target_account, dry_run, config, graphs=None):
+    '''
+    Snapshots cleanup for a single region, called by clean_snapshot() for each region
+    :param graphs: region -> ReferenceGraph of the run, with the AMIs of the images cleaner if it ran
+    '''
+    policy = compile_policy(config, 'Snapshots')
+    logger.info('Cleaning snapshots for %s', region)
+    ec2 = _aws_client('ec2', region, target_account, config)
+    graph = _region_graph(ec2, region, target_account, config, graphs)
+
+    def list_instances():  # only if a snapshot needs them and the EC2 cleaner of the run didn't list them
+        for instance in iter_instances(ec2, Filters=EC2_FILTERS):
+            yield instance['InstanceId'], [bdm['Ebs']['VolumeId'] for bdm in instance.get('BlockDeviceMappings', [])
+                                           if 'Ebs' in bdm]
+
+    def report(snap, error):
+        if error:
+            logger.error('%s', error)
+        snap.error = error
+        print_results_xlsx(data=snap, sheetname='Snapshots')
+
+    # the snapshots reported with their deregistered AMI by the images cleaner are left out
+    snapshots = (SnapshotRecord.from_api(snap, region, target_account)
+                 for snap in iter_snapshots(ec2, OwnerIds=[config.aws_account(target_account)])
+                 if not graph.is_handled(snap['SnapshotId']))
+    with DeleteExecutor(config.delete_workers) as deleter:
+        for batch in batches(snapshots):
+            #update OperationDone based on cleanup mode selected
+            policy.apply(batch)
+
+            for snap in batch:
+                images = graph.images_using(snap.snapshot_id)
+                if images:
+                    snap.used_by = ', '.join(images)
+                    if snap.operation == 'Delete':  # would fail with InvalidSnapshot.InUse
+                        snap.operation = 'Keep(AMI)'
+                else:
+                    instance_id = graph.volume_instance(snap.volume_id, list_instances)
+                    if instance_id:
+                        snap.used_by = f'{snap.volume_id} of {instance_id}'
+
+                logger.debug('Found %s for volume: %s, size %s GB', snap.snapshot_id, snap.volume_id,
+                             snap.volume_size)
+                if snap.operation == 'Delete':
+                    deleter.submit(snap, ec2.delete_snapshot, SnapshotId=snap.snapshot_id, DryRun=dry_run)
+                else:
+                    deleter.submit(snap)
+                for done in deleter.results():
+                    report(*done)
+
+        for done in deleter.results(wait=True):
+            report(*done)
+
+
+def _region_graph(ec2, region, target_account, config, graphs=None):
+    '''
+    ReferenceGraph of the region for the snapshots cleaner, the images cleaner of the run already added the AMIs
+    if it ran, else they are listed here
+    :param graphs: region -> ReferenceGraph of the run, None when the cleaner runs on its own
+    '''
+    graph = ReferenceGraph() if graphs is None else graphs.setdefault(region, ReferenceGraph())
+    if not graph.images_listed:
+        for image in iter_images(ec2, Owners=[config.aws_account(target_account)]):
+            image = ImageRecord.from_api(image, region, target_account)
+            graph.add_image(image.image_id, image.snapshots)
+        graph.images_listed = True
+    return graph
+
+
+def clean_volumes(regions, target_account ='Main', dry_run=True, config=None):
+    """
+    check for volumes in all regions and delete all state=available volumes
+    :param dry_run: for BOTO 3 call
+    """
+    logger.info('entering clean_volumes() for target %s', target_account)
+    config = config or load_config()
+
+    _run_regions(regions, _clean_volumes_region, target_account, dry_run, config, 'Volumes')
+
+    logger.info('existing clean_volumes()')
+
+
+def _clean_volumes_region(region, target_account, dry_run, config):
+    '''
+    Volumes cleanup for a single region, called by clean_volumes() for each region
+    '''
+    policy = compile_policy(config, 'Volumes')
+    logger.info('Cleaning available volumes for %s', region)
+    ec2 = _aws_client('ec2', region, target_account, config)
+
+    def report(volume, error):
+        if error:
+            logger.error('%s', error)
+        volume.error = error
+        print_results_xlsx(data=volume, sheetname='Volumes')
+
+    found = 0
+    # only the available (not attached) volumes
+    volumes = (VolumeRecord.from_api(volume, region, target_account)
+               for volume in iter_volumes(ec2, Filters=VOLUME_FILTERS))
+    with DeleteExecutor(config.delete_workers) as deleter:
+        for batch in batches(volumes):
+            found += len(batch)
+
+            # update OperationDone based on cleanup mode selected
+            policy.apply(batch, eligible=[volume.state == 'available' for volume in batch])
+
+            for volume in batch:
+                logger.debug('Found volume in %s: %s(%s, %s IOPS, %s) with Tag: %s', volume.availability_zone, volume.volume_id, volume.state, volume.iops, volume.volume_type, volume.tags)
+                if volume.operation == 'Terminate':
+                    logger.debug('Deleting Volume')
+                    deleter.submit(volume, ec2.delete_volume, VolumeId=volume.volume_id, DryRun=dry_run)
+                else:
+                    deleter.submit(volume)
+                for done in deleter.results():
+                    report(*done)
+
+        for done in deleter.results(wait=True):
+            report(*done)
+    _report_filter('Volumes', region, target_account, VOLUME_FILTERS, found)
+
+
+def clean_images(regions, target_account ='Main', dry_run=True, config=None):
+    """
+    check for AMI's in all regions and Deregister if there is no tag keep
+    :param dry_run: for BOTO 3 call
+    """
+
+    logger.info('entering clean_images() for target %s', target_account)
+    config = config or load_config()
+
+    _run_regions(regions, _clean_images_region, target_account, dry_run, config, 'Images')
+    logger.info('existing clean_images()')
+
+
+def _clean_images_region(region, target_account, dry_run, config, graphs=None):
+    '''
+    Images cleanup for a single region, called by clean_images() for each region
+    :param graphs: region -> ReferenceGraph of the run, the AMIs are added for the snapshots cleaner
+    '''
+    policy = compile_policy(config, 'Images')
+    logger.info('Cleaning available images for %s', region)
+    ec2 = _aws_client('ec2', region, target_account, config)
+    graph = ReferenceGraph() if graphs is None else graphs.setdefault(region, ReferenceGraph())
+
+    def report(img, error):
+        img.error = error
+        if img.operation == 'Deregister' and error is None:  # or would be, in dry run
+            graph.remove_image(img.image_id)
+        print_results_xlsx(data=img, sheetname='Images')
+
+    images = (ImageRecord.from_api(img, region, target_account)
+              for img in iter_images(ec2, Owners=[config.aws_account(target_account)]))
+    with DeleteExecutor(config.delete_workers) as deleter:
+        found = False
+        for batch in batches(images):
+            found = True
+
+            # update OperationDone based on cleanup mode selected
+            policy.apply(batch)
+
+            for img in batch:
+                graph.add_image(img.image_id, img.snapshots)
+                if img.operation == "Deregister":
+                    deleter.submit(img, ec2.deregister_image, ImageId=img.image_id, DryRun=dry_run)
+                else:
+                    deleter.submit(img)
+                for done in deleter.results():
+                    report(*done)
+
+        for done in deleter.results(wait=True):
+            report(*done)
+    graph.images_listed = True
+    if not found:
+        logger.warning('no images found for %s', region)
+
+    _clean_image_snapshots(ec2, region, target_account, dry_run, config, graph)
+
+
+def _clean_image_snapshots(ec2, region, target_account, dry_run, config, graph):
+    '''
+    Delete the snapshots of the AMIs deregistered in the region (the ones no registered AMI uses) right after
+    them instead of leaving them for the next run, the snapshots keep tags are checked like in the snapshots cleaner.
+    They are reported in the Snapshots sheet and left out by the snapshots cleaner
+    '''
+    orphaned = graph.orphaned_snapshots()
+    if not orphaned:
+        return
+    policy = compile_policy(config, 'Snapshots')
+
+    def report(snap, error):
+        if error:
+            logger.error('%s', error)
+        snap.error = error
+        print_results_xlsx(data=snap, sheetname='Snapshots')
+
+    snapshots = (SnapshotRecord.from_api(snap, region, target_account)
+                 for snap in iter_by_ids(iter_snapshots, ec2, 'snapshot-id', orphaned,
+                                         OwnerIds=[config.aws_account(target_account)]))
+    with DeleteExecutor(config.delete_workers) as deleter:
+        for batch in batches(snapshots):
+            policy.apply(batch)
+            for snap in batch:
+                graph.mark_handled(snap.snapshot_id)
+                snap.used_by = f'{orphaned[snap.snapshot_id]} (deregistered)'
+                if snap.operation == 'Delete':
+                    deleter.submit(snap, ec2.delete_snapshot, SnapshotId=snap.snapshot_id, DryRun=dry_run)
+                else:
+                    deleter.submit(snap)
+                for done in deleter.results():
+                    report(*done)
+
+        for done in deleter.results(wait=True):
+            report(*done)
+
+
+def clean_sg(regions, target_account ='Main', dry_run=True, config=None):
+    """
+    Check each region for security groups with boto3, delete SG that are unused & untagged
+    :param dry_run: used for boto call, to avoid actually deleting anything
+    :return: None
+    """
+    logger.info('Cleaning SG for target %s', target_account)
+    headers = ["Region", "OwnerId", "SG Name", "SG Id", "VpcId", "FromPort",
+               "ToPort", "IpProtocol", "Source", "Instances", "Tags", "OperationDone"]
+
+    config = config or load_config()
+
+    _run_regions(regions, _clean_sg_region, target_account, dry_run, config, 'SG')
+
+
+def _clean_sg_region(region, target_account, dry_run, config):
+    '''
+    SG cleanup for a single region, called by clean_sg() for each region
+    '''
+    policy = compile_policy(config, 'SG')
+    ec2 = _aws_client('ec2', region, target_account, config)
+
+    logger.info('Checking SG in region - %s', region)
+
+    # SG -> instances/ENIs relation for the whole region, built once instead of a describe call per SG
+    sg_usage = build_sg_usage_index(ec2)
+
+    # record for each SG, OperationDone is N/A and will be updated later if we delete
+    groups = (SecurityGroupRecord.from_api(sg, region, target_account) for sg in iter_security_groups(ec2))
+    for batch in batches(groups):
+        # the SG in use and the default groups (cant delete them) are kept whatever their tags
+        policy.apply(batch, eligible=[not sg_usage.get(record.group_id) and record.group_name != 'default'
+                                      for record in batch])
+
+        for security_group_record in batch:
+            logger.debug('Found security group %s', security_group_record.group_id)
+
+            # instances and ENIs using the SG
+            instances_for_sg = sg_usage.get(security_group_record.group_id, [])
+            if instances_for_sg:
+                security_group_record.instances = ', '.join(instances_for_sg)  # convert instance list to string
+
+            if security_group_record.operation == 'Deleting':
+                logger.info('removing sg - %s', security_group_record.group_id)
+                try:
+                    ec2.delete_security_group(GroupId=security_group_record.group_id, DryRun=dry_run)
+                except ClientError as e:
+                    if "Request would have succeeded, but DryRun flag is set" not in str(e):
+                        security_group_record.error = e
+
+            print_results_xlsx(data=security_group_record, sheetname='SG')
+    logger.info('Region END')
+
+
+def clean_rds_instances(regions, target_account ='Main', dry_run=True, config=None):
+    '''
+    Clean all untagged RDS instance in the target region
+    '''
+
+    logger.info('entering clean_rds_instances() for target %s', target_account)
+    config = config or load_config()
+
+    _run_regions(regions, _clean_rds_instances_region, target_account, dry_run, config, 'RDS Instances')
+
+
+def _clean_rds_instances_region(region, target_account, dry_run, config):
+    '''
+    RDS instances cleanup for a single region, called by clean_rds_instances() for each region
+    '''
+    policy = compile_policy(config, 'RDS')
+    logger.info('Cleaning available RDS for %s', region)
+    rds = _aws_client('rds', region, target_account, config)
+
+    databases = (DBInstanceRecord.from_api(db, region, target_account) for db in iter_db_instances(rds))
+    for batch in batches(databases):
+        #check the tags (and the age for keeptag_withdate) and update operaion
+        policy.apply(batch)
+
+        for db in batch:
+            try:
+                if not dry_run:
+                    if db.operation == 'Terminate' :
+                        rds.delete_db_instance(DBInstanceIdentifier=db.db_instance_id, SkipFinalSnapshot=True,
+                                               DeleteAutomatedBackups=True)
+                    elif db.operation == 'Shutdown':
+                        rds.stop_db_instance(DBInstanceIdentifier=db.db_instance_id)
+
+            except ClientError as e:
+                db.error = e
+            print_results_xlsx(data=db, sheetname='RDS Instances')
+
+
+def clean_rds_instances_snaps(regions, target_account ='Main', dry_run=True, config=None):
+    '''
+    Clean all Manual RDS Snapshots from the target regions
+    '''
+
+    logger.info('entering clean_rds_instances_snaps() for target %s', target_account)
+    config = config or load_config()
+
+    _run_regions(regions, _clean_rds_instances_snaps_region, target_account, dry_run, config, 'RDS Snapshots')
+
+
+def _clean_rds_instances_snaps_region(region, target_account, dry_run, config):
+    '''
+    RDS snapshots cleanup for a single region, called by clean_rds_instances_snaps() for each region
+    '''
+    policy = compile_policy(config, 'RDS_Snaps')
+    logger.info('Cleaning available RDS snaps for %s', region)
+    rds = _aws_client('rds', region, target_account, config)
+
+    def report(db_snap, error):
+        db_snap.error = error
+        print_results_xlsx(data=db_snap, sheetname='RDS Snapshots')
+
+    found = 0
+    db_snaps = (DBSnapshotRecord.from_api(db_snap, region, target_account)
+                for db_snap in iter_db_snapshots(rds, SnapshotType=RDS_SNAPSHOT_TYPE))
+    with DeleteExecutor(config.delete_workers) as deleter:
+        for batch in batches(db_snaps):
+            found += len(batch)
+            # can only delete manual snaps, a snapshot still being created (no create time yet) is kept
+            policy.apply(batch, eligible=[db_snap.snapshot_type == 'manual' for db_snap in batch])
+
+            for db_snap in batch:
+                if not dry_run and db_snap.operation == 'Delete':
+                    deleter.submit(db_snap, rds.delete_db_snapshot, DBSnapshotIdentifier=db_snap.snapshot_id)
+                else:
+                    deleter.submit(db_snap)
+                for done in deleter.results():
+                    report(*done)
+
+        for done in deleter.results(wait=True):
+            report(*done)
+    _report_filter('RDS Snapshots', region, target_account, [{'Name': 'SnapshotType', 'Values': [RDS_SNAPSHOT_TYPE]}],
+                   found)
+
+
+def clean_S3_objects(target_account ='Main', dry_run=True, config=None):
+    '''
+    Clean all S3 objects from untagged bucket, buckets are handled in parallel (s3_bucket_workers in config.txt)
+    '''
+
+    logger.info('entering clean_S3_objects() for target %s', target_account)
+    config = config or load_config()
+
+    s3 = _aws_client('s3', 'us-east-1', target_account, config)  # clients are thread safe, shared by all buckets
+    policy = compile_policy(config, 'S3_Objects')
+
+    bucket_list = s3.list_buckets()
+    with ThreadPoolExecutor(max_workers=config.s3_bucket_workers, thread_name_prefix='bucket') as pool:
+        buckets = pool.map(lambda bucket: _clean_bucket(s3, bucket, target_account, dry_run, policy),
+                           bucket_list['Buckets'])
+
+        for bucket in buckets:  # map keeps the list_buckets order
+            print_results_xlsx(data=bucket, sheetname='S3 Objects')
+
+
+def _clean_bucket(s3, bucket, target_account, dry_run, policy):
+    '''
+    List the bucket once and delete its objects in 1000 keys batches while the pages arrive,
+    versioned buckets get all their versions and delete markers removed
+    :param policy: CleanupPolicy of the S3 objects, decides from the bucket tags and creation date
+    :return: the BucketRecord of the bucket
+    '''
+    created = bucket.get('CreationDate')
+    bucket = BucketRecord.from_api(bucket, target_account)
+    logger.info('In bucket %s, timestamp: %s', bucket.name, datetime.datetime.now())
+
+    tag_error = None
+    try:
+        tags = s3.get_bucket_tagging(Bucket=bucket.name)
+    except ClientError as e:
+        if 'NoSuchTagSet' not in str(e):
+            tag_error = e
+    else:
+        bucket.tags = tags_from_list(tags['TagSet']) or {}
+    # the apply of a plan only has the bucket name, its age was checked by the dry run
+    decisions, _ = policy.decide([bucket.name], [bucket.tags], [created] if created else None)
+    delete = tag_error is None and decisions[0] == DELETE
+
+    try:
+        versioning = s3.get_bucket_versioning(Bucket=bucket.name).get('Status')
+        for batch in iter_object_batches(s3, bucket.name, versions=versioning in ('Enabled', 'Suspended')):
+            bucket.key_count += len(batch)
+            if delete and not dry_run:
+                _delete_objects_batch(s3, bucket, batch)
+    except ClientError as e:
+        bucket.error = e
+        bucket.operation = 'N/A'
+    else:
+        if bucket.key_count == 0:
+            bucket.operation = 'DoNothing'
+        elif tag_error:
+            bucket.error = tag_error
+            bucket.operation = 'N/A'
+        else:
+            bucket.operation = 'Delete' if delete else 'DoNothing'
+
+    logger.info('Finished bucket %s, keycount: %s, timestamp: %s', bucket.name, bucket.key_count, datetime.datetime.now())
+    return bucket
+
+
+def _delete_objects_batch(s3, bucket, batch):
+    '''
+    Delete one batch of up to 1000 keys, failed keys are added to the bucket 'Failed Count'
+    '''
+    try:
+        res = s3.delete_objects(Bucket=bucket.name, Delete={'Objects': batch, 'Quiet': True})
+    except ClientError as e:
+        bucket.fail_count += len(batch)
+        bucket.error = e.response['Error']['Code']
+    else:
+        if res.get('Errors'):
+            bucket.fail_count += len(res['Errors'])
+            bucket.error = res['Errors'][0]['Code']
+
+
+def create_xlsx(EC2=False, Volumes=False, Snapshots=False, Images=False, SG=False, RDS=False, RDS_Snaps=False, S3_Objects=False):
+    '''
+    Create the intial xlsx file with the releavant tabs based on the above param,
+    '''
+    logger.info('Creating excel')
+    report = create_report(xlsx_name)
+
+    if EC2:
+        report.add_sheet('EC2',
+            ("OperationDone", "Age", "InstanceId", "InstanceType", "AvailabilityZone",
+             "State", "Volumes",  "Account",
+             "Tags"))
+
+    if Volumes:
+        report.add_sheet('Volumes',
+            ("OperationDone","Age" ,"VolumeId", "AvailabilityZone", "State", "VolumeType", "Size(GB)", "Iops", "Account", "Tags",
+             "Errors"))
+
+    if Images:
+        report.add_sheet('Images',
+            ("OperationDone", "Age", "ImageId", "Name", "Region", "Account", "ImageType", "CreationDate", "Snapshots",
+             "Tags", "Errors"))
+
+    if Snapshots or Images:  # the images cleaner reports the snapshots of the AMIs it deregisters
+        report.add_sheet('Snapshots', ("OperationDone","Age","SnapshotID", "VolumeId", "Region", "Account", "Tags",
+                                       "Used by", "Errors"))
+
+    if SG:
+        report.add_sheet('SG',
+            ("OperationDone", "SG Id", "SG Name", "Account", "Region", "VpcId", "Instances", "Tags","Errors"))
+
+    if RDS:
+        report.add_sheet('RDS Instances',
+            ("OperationDone", "Age","Region", "DBInstanceIdentifier", "DBInstanceStatus", "DBInstanceClass",
+             "AllocatedStorage", "Automatic Backups", "Account",  "Tags", "Errors"))
+
+    if RDS_Snaps:
+        report.add_sheet('RDS Snapshots',
+            ("OperationDone", "Age", "Region", "DBSnapshotIdentifier", "DBInstanceIdentifier", "SnapshotType", "Account",
+             "Tags", "Errors"))
+
+    if S3_Objects:
+        report.add_sheet('S3 Objects', ("OperationDone", "Bucket", "Tags", "Key Count", "Failed Count","Account", "Errors"))
+
+    if EC2 or Volumes or RDS_Snaps:
+        report.add_sheet('Filters', ("Sheet", "Region", "Account", "Server side filter", "Returned by the API"))
+
+
+def print_results_xlsx(**kwargs):
+    '''
+    Add row to the report created with create_xlsx(), rows are buffered and written once by run_aws_cleanup()
+    :param data: the resource record (see resourceRecords.py), for the EC2 error rows the list of instance ids
+    :param sheetname: the sheet of the resource
+    '''
+    sheetname = kwargs['sheetname']
+
+    error = kwargs.get('error')
+    if kwargs['sheetname'] == 'EC2' and error is not None:
+        _add_row(sheetname, (kwargs['OperationDone'], kwargs['data'], error))
+    else:
+        _add_row(sheetname, kwargs['data'].row())
+        if _inventory is not None:
+            _inventory.add_record(kwargs['data'])
+
+
+def _report_metrics(target_account):
+    '''
+    Add the API calls stats of the run to the Metrics sheet
+    '''
+    report = get_report(xlsx_name)
+    report.add_sheet('Metrics', METRICS_HEADERS)
+    report.extend('Metrics', _metrics.rows(target_account))
+
+
+def _report_filter(sheetname, region, target_account, filters, candidates):
+    '''
+    Add the server side filter of a cleaner to the Filters sheet, with the number of candidates the API returned.
+    The resources the filter left out are not counted: they never come over the wire, counting them would take
+    the full listing the filter avoids, and the inventory only keeps what the filtered scans returned
+    '''
+    server_filter = ', '.join(f"{f['Name']}={','.join(f['Values'])}" for f in filters)
+    _add_row('Filters', (sheetname, region, target_account, server_filter, candidates))
+
+
+def _add_row(sheetname, row):
+    '''
+    Add the row to the report, when running inside a _run_cleaners() task keep it with the task rows
+    '''
+    rows = getattr(_region_rows, 'rows', None)
+    if rows is None:
+        get_report(xlsx_name).append(sheetname, row)
+    else:
+        rows.append((sheetname, row))
+
+
+def run_aws_cleanup(xlsxname, dry_run=True,EC2=False, Volumes=False, Snapshots=False, Images=False, SG=False, RDS=False, RDS_Snaps=False, S3_Objects=False, target_account='Main', createxlsx= True, job_id=None, full_sweep=False, savexlsx=True):
+    '''
+    Called from view.py, main function to run the cleanup operation, will call relevant cleanup function based on param recieved from views.py
+    :param xlsxname: name of the report file, written in the format of its suffix (see reportSink.REPORT_FORMATS)
+    :param target_account: Main, Second or another account of config.txt (see CleanerConfig.account())
+    :param createxlsx: does xlsx file need to be created or not
+    :param savexlsx: write the xlsx file at the end, False to leave the rows in the report for the caller to merge
+    :param job_id: the CleanupJob running the cleanup, a dry run scan is the plan of the job
+    :param full_sweep: scan all the regions, even the ones that were empty on the last scans
+    :return:
+    '''
+    global xlsx_name
+    global _inventory
+    global _clients
+    global _metrics
+
+    xlsx_name = xlsxname
+
+    config = load_config()  # read config.txt once, all the cleaners of the run use the same values
+    set_outputs(config)
+    _metrics = ApiMetrics()
+    _clients = _new_client_factory(config, _metrics)
+    logger.info('entering run_aws_cleanup() for target %s', target_account)
+
+    regions = _discover_regions(target_account, config) if config.aws_regions_all else config.regions
+    logger.info('Regions from config file are - %s', regions)
+
+    if createxlsx:
+        create_xlsx(EC2=EC2, Volumes=Volumes, Snapshots=Snapshots, Images=Images, SG=SG, RDS=RDS, RDS_Snaps=RDS_Snaps, S3_Objects=S3_Objects)
+
+    # resource types scanned by this run and their regions, S3 buckets are global
+    scope = {sheet: regions for sheet, selected in (('EC2', EC2), ('Volumes', Volumes), ('Images', Images),
+                                                   ('Snapshots', Snapshots), ('SG', SG), ('RDS Instances', RDS),
+                                                   ('RDS Snapshots', RDS_Snaps)) if selected}
+    if S3_Objects:
+        scope['S3 Objects'] = ('',)
+    if Images and not Snapshots:  # only the snapshots of the deregistered AMIs, none of them is marked gone
+        scope['Snapshots'] = ()
+    _inventory = InventoryWriter('aws', config.aws_account(target_account), dry_run, scope, target_account, job_id)
+
+    # all the cleaners run together, each (cleaner, region) once the cleaners it depends on are done in its region.
+    # The EC2 and images cleaners add the instances and AMIs of the region to the graph of the snapshots cleaner
+    graphs = {}  # region -> ReferenceGraph of this run
+    cleaners = [(sheet, regions, clean_region) for sheet, selected, clean_region in (
+        ('EC2', EC2, functools.partial(_clean_ec2_region, graphs=graphs)), ('Volumes', Volumes, _clean_volumes_region),
+        ('Images', Images, functools.partial(_clean_images_region, graphs=graphs)),
+        ('Snapshots', Snapshots, functools.partial(_clean_snapshot_region, graphs=graphs)),
+        ('SG', SG, _clean_sg_region), ('RDS Instances', RDS, _clean_rds_instances_region),
+        ('RDS Snapshots', RDS_Snaps, _clean_rds_instances_snaps_region)) if selected]
+    if S3_Objects:  # buckets are global
+        cleaners.append(('S3 Objects', ('',), lambda region, *args: clean_S3_objects(*args)))
+    # a failed (cleaner, region) is an ERROR row, what the others did is still recorded before the error is raised
+    error = _run_cleaners(cleaners, target_account, dry_run, config, full_sweep=full_sweep)
+
+    logger.info('Writing inventory')
+    with _metrics.timed('cleaner', 'Write inventory'):
+        run = _inventory.flush()
+    _inventory = None
+    logger.info('inventory scan %s: %s resources, %s changed', run.pk, run.resource_count, run.changed_count)
+
+    _report_metrics(target_account)
+    if savexlsx:
+        logger.info('Writing excel')
+        get_report(xlsx_name).save()
+    if error:
+        raise error
+
+
+# how apply reads the planned resources again, per sheet: (service, iter_* function, id filter, record, owner param)
+_PLAN_LOOKUP = {
+    'EC2': ('ec2', iter_instances, 'instance-id', Ec2Record, None),
+    'Volumes': ('ec2', iter_volumes, 'volume-id', VolumeRecord, None),
+    'Images': ('ec2', iter_images, 'image-id', ImageRecord, 'Owners'),
+    'Snapshots': ('ec2', iter_snapshots, 'snapshot-id', SnapshotRecord, 'OwnerIds'),
+    'SG': ('ec2', iter_security_groups, 'group-id', SecurityGroupRecord, None),
+    'RDS Instances': ('rds', iter_db_instances, 'db-instance-id', DBInstanceRecord, None),
+    'RDS Snapshots': ('rds', iter_db_snapshots, 'db-snapshot-id', DBSnapshotRecord, None),
+}
+
+# the call apply makes for each planned (sheet, operation): (client method, id param, other params)
+_PLAN_ACTIONS = {
+    ('EC2', 'Terminate'): ('terminate_instances', 'InstanceIds', {}),
+    ('EC2', 'Shutdown'): ('stop_instances', 'InstanceIds', {}),
+    ('Volumes', 'Terminate'): ('delete_volume', 'VolumeId', {}),
+    ('Images', 'Deregister'): ('deregister_image', 'ImageId', {}),
+    ('Snapshots', 'Delete'): ('delete_snapshot', 'SnapshotId', {}),
+    ('SG', 'Deleting'): ('delete_security_group', 'GroupId', {}),
+    ('RDS Instances', 'Terminate'): ('delete_db_instance', 'DBInstanceIdentifier',
+                                     {'SkipFinalSnapshot': True, 'DeleteAutomatedBackups': True}),
+    ('RDS Instances', 'Shutdown'): ('stop_db_instance', 'DBInstanceIdentifier', {}),
+    ('RDS Snapshots', 'Delete'): ('delete_db_snapshot', 'DBSnapshotIdentifier', {}),
+}
+
+
+def run_aws_apply(xlsxname, plan_run, EC2=False, Volumes=False, Snapshots=False, Images=False, SG=False, RDS=False,
+                  RDS_Snaps=False, S3_Objects=False, createxlsx=True, job_id=None, savexlsx=True):
+    '''
+    Apply the plan of a dry run scan (see inventoryStore.load_plan()) instead of scanning the account again,
+    only the planned resources are read again, by id, and the ones that changed since the dry run are skipped
+    :param plan_run: ScanRun of the dry run
+    :param EC2..S3_Objects: the sheets of the report, same as the dry run
+    :param savexlsx: write the xlsx file at the end, False to leave the rows in the report for the caller to merge
+    '''
+    global xlsx_name
+    global _inventory
+    global _clients
+    global _metrics
+
+    xlsx_name = xlsxname
+
+    config = load_config()
+    set_outputs(config)
+    _metrics = ApiMetrics()
+    _clients = _new_client_factory(config, _metrics)
+    target_account = plan_run.target
+    logger.info('entering run_aws_apply() for scan %s, target %s', plan_run.pk, target_account)
+    if config.aws_account(target_account) != plan_run.account:
+        raise ValueError(f'{target_account} account is not {plan_run.account} anymore, run a new dry run')
+
+    if createxlsx:
+        create_xlsx(EC2=EC2, Volumes=Volumes, Snapshots=Snapshots, Images=Images, SG=SG, RDS=RDS, RDS_Snaps=RDS_Snaps, S3_Objects=S3_Objects)
+
+    plan = load_plan(plan_run)
+    _inventory = InventoryWriter('aws', plan_run.account, False, {sheet: () for sheet in plan}, target_account,
+                                 job_id)
+
+    cleaners = [(sheet, list(plan[sheet]), functools.partial(_apply_plan_region, sheet=sheet, planned=plan[sheet]))
+                for sheet in _PLAN_LOOKUP if sheet in plan]  # same order as run_aws_cleanup()
+    if 'S3 Objects' in plan:
+        cleaners.append(('S3 Objects', ('',), lambda region, target_account, dry_run, config:
+                         _apply_plan_buckets(plan['S3 Objects'][''], target_account, config)))
+    error = _run_cleaners(cleaners, target_account, False, config, scan=False)
+
+    logger.info('Writing inventory')
+    with _metrics.timed('cleaner', 'Write inventory'):
+        _inventory.flush()
+    _inventory = None
+
+    _report_metrics(target_account)
+    if savexlsx:
+        logger.info('Writing excel')
+        get_report(xlsx_name).save()
+    if error:
+        raise error
+
+
+def _apply_plan_region(region, target_account, dry_run, config, sheet, planned):
+    '''
+    Apply the plan of one sheet for a single region, called by run_aws_apply() for each region
+    :param planned: dict of region -> {resource id: (operation, fingerprint)}
+    '''
+    service, iterate, id_filter, record_class, owner = _PLAN_LOOKUP[sheet]
+    planned = planned[region]
+    client = _aws_client(service, region, target_account, config)
+    kwargs = {owner: [config.aws_account(target_account)]} if owner else {}
+
+    def report(record, error):
+        if error:
+            logger.error('%s', error)
+        if sheet == 'EC2':  # no error column for EC2, same as the instances stop/terminate of clean_ec2()
+            if error:
+                print_results_xlsx(data=record.instance_id, sheetname='EC2', OperationDone=f'ERROR-{record.operation}',
+                                   error=str(error))
+        else:
+            record.error = error
+        print_results_xlsx(data=record, sheetname=sheet)
+
+    found = set()
+    with DeleteExecutor(config.delete_workers) as deleter:
+        for resource in iter_by_ids(iterate, client, id_filter, planned, **kwargs):
+            record = record_class.from_api(resource, region, target_account)
+            resource_id = getattr(record, record.id_field)
+            planned_resource = planned.get(resource_id)
+            if planned_resource is None:  # the API returned more than asked, not part of the plan
+                logger.debug('%s %s not in the plan, skipped', sheet, resource_id)
+                continue
+            found.add(resource_id)
+
+            record.operation, planned_fingerprint = planned_resource
+            if fingerprint(record_state(record), record.operation) != planned_fingerprint:
+                logger.info('%s %s changed since the dry run, skipped', sheet, resource_id)
+                record.operation = 'Skip(changed)'
+                deleter.submit(record)
+            else:
+                method, id_param, params = _PLAN_ACTIONS[(sheet, record.operation)]
+                params = dict(params, **{id_param: [resource_id] if id_param.endswith('Ids') else resource_id})
+                deleter.submit(record, getattr(client, method), **params)
+            for done in deleter.results():
+                report(*done)
+
+        for done in deleter.results(wait=True):
+            report(*done)
+
+    for resource_id in planned.keys() - found:
+        logger.info('%s %s not found anymore, skipped', sheet, resource_id)
+
+
+def _apply_plan_buckets(planned, target_account, config):
+    '''
+    Empty the buckets planned by the dry run, _clean_bucket() checks the bucket tags again before deleting anything
+    :param planned: {bucket name: (operation, fingerprint)}
+    '''
+    s3 = _aws_client('s3', 'us-east-1', target_account, config)
+    policy = compile_policy(config, 'S3_Objects')
+    with ThreadPoolExecutor(max_workers=config.s3_bucket_workers, thread_name_prefix='bucket') as pool:
+        buckets = pool.map(lambda name: _clean_bucket(s3, {'Name': name}, target_account, False, policy),
+                           planned)
+
+        for bucket in buckets:
+            print_results_xlsx(data=bucket, sheetname='S3 Objects')
+
+
+def _run_regions(regions, clean_region, target_account, dry_run, config, sheet=None):
+    '''
+    Run clean_region() for all regions, a single cleaner run of _run_cleaners()
+    :param clean_region: the single region cleanup function
+    :param sheet: sheet of the cleaner, the empty regions are tracked per account and sheet
+    '''
+    error = _run_cleaners([(sheet, regions, clean_region)], target_account, dry_run, config, scan=sheet is not None)
+    if error:
+        raise error
+
+
+def _run_cleaners(cleaners, target_account, dry_run, config, scan=True, full_sweep=True):
+    '''
+    Run the cleaners on their regions with a TaskScheduler of aws_region_workers threads (config.txt), a
+    (cleaner, region) task starts once the cleaners it depends on (_DEPENDS_ON) are done in its region.
+    The rows of each task are added to the report in the cleaners then regions order so the report is always the same.
+    Regions where the cleaner found nothing on the last scans (empty_region_scans in config.txt) only get
+    a probe, and a full scan if the probe finds something.
+    A task failing doesn't lose the rows it added before (e.g. what it deleted), an ERROR-region row is added to
+    the sheet of the cleaner and the resources the task didn't see are not marked gone in the inventory
+    :param cleaners: list of (sheet, regions, single region cleanup function)
+    :param scan: track the empty regions of the cleaners, False when applying a plan
+    :param full_sweep: scan all the regions, False to only probe the regions that were empty on the last scans
+    :return: the error of the first task that failed, for the caller to raise once the run is recorded
+    '''
+    account = config.aws_account(target_account)
+    scheduler = TaskScheduler(config.aws_region_workers, TERMINATE_POLL_SECONDS)
+    for sheet, regions, clean_region in cleaners:
+        probe_regions = set()
+        if scan and sheet in _REGION_PROBES and config.empty_region_scans and not full_sweep:
+            probe_regions = empty_regions(account, sheet, config.empty_region_scans)
+        for region in regions:
+            region = region.strip()
+            task = functools.partial(_run_region_task, sheet, region, clean_region, region in probe_regions,
+                                     target_account, dry_run, config)
+            scheduler.add((sheet, region), task, after=[(dep, region) for dep in _DEPENDS_ON.get(sheet, ())])
+
+    report = get_report(xlsx_name)
+    first_error = None
+    found = {}  # sheet -> {region: resources found}
+    for (sheet, region), (rows, error) in scheduler.run().items():
+        if error:  # keep the rows of the task and of the other tasks, the error is returned after the merge
+            logger.error('%s region %s failed: %s', sheet, region, error)
+            first_error = first_error or error
+            rows = list(error.rows if isinstance(error, RegionTaskError) else rows or ())
+            if sheet in report.sheets:
+                rows.append((sheet, ('ERROR-region', region, str(error))))
+            if _inventory is not None:
+                _inventory.exclude(sheet, region)
+        for sheetname, row in rows:
+            report.append(sheetname, row)
+        if not error:
+            found.setdefault(sheet, {})[region] = sum(1 for sheetname, row in rows if sheetname == sheet)
+
+    if scan:
+        for sheet, regions_found in found.items():
+            if sheet in _REGION_PROBES:
+                record_region_scans(account, sheet, regions_found)
+    return first_error
+
+
+class RegionTaskError(Exception):
+    '''
+    A (cleaner, region) task of _run_cleaners() failed, with the report rows it added before the error
+    '''
+
+    def __init__(self, sheet, region, error, rows):
+        super().__init__(f'{sheet} {region}: {type(error).__name__}: {error}')
+        self.error = error
+        self.rows = rows
+
+
+def _run_region_task(sheet, region, clean_region, probe, target_account, dry_run, config):
+    '''
+    A (cleaner, region) task of _run_cleaners()
+    :param probe: the region was empty on the last scans, probe it first
+    :return: the report rows of the task, as a Pending if clean_region() returned one
+    '''
+    _region_rows.rows = []
+    try:
+        if probe and not _probe_region(sheet, region, target_account, config):
+            logger.info('region %s: no %s on the last scans and the probe found none, skipped', region, sheet)
+            return _region_rows.rows
+        result = clean_region(region, target_account, dry_run, config)
+        if isinstance(result, Pending):
+            return Pending(_region_rows.rows, result.poll)
+        return _region_rows.rows
+    except Exception as e:  # the cleaners depending on this one are not run, see TaskScheduler
+        raise RegionTaskError(sheet, region, e, _region_rows.rows) from e
+    finally:
+        _region_rows.rows = None
+
+
+def _probe_region(sheet, region, target_account, config):
+    '''
+    One small describe call for the cleaner in the region
+    :return: True if the region has resources for the cleaner
+    '''
+    service, operation, params, result_key = _REGION_PROBES[sheet]
+    client = _aws_client(service, region, target_account, config)
+    response = getattr(client, operation)(**params(config.aws_account(target_account)))
+    return bool(response.get(result_key))
+
+
+def _discover_regions(target_account, config):
+    '''
+    The regions enabled for the account (opt-in regions included once enabled) from describe_regions,
+    cached for REGIONS_CACHE_SECONDS, the default regions if the call fails
+    '''
+    account = config.aws_account(target_account)
+    cached = _discovered_regions.get(account)
+    if cached and time.monotonic() - cached[0] < REGIONS_CACHE_SECONDS:
+        return cached[1]
+
+    try:
+        response = _aws_client('ec2', 'us-east-1', target_account, config).describe_regions()
+    except ClientError as e:
+        logger.error('describe_regions failed, using the default regions: %s', e)
+        return AWS_REGIONS
+
+    regions = tuple(sorted(region['RegionName'] for region in response['Regions']))
+    logger.info('regions enabled for %s: %s', account, regions)
+    _discovered_regions[account] = (time.monotonic(), regions)
+    return regions
+
+
+def _aws_client(service, region, target_account, config, type='client'):
+    '''
+    Return the client of the run for the account/region/service, created once and shared by all the cleaners
+    :param type: default is client, can be resource(for S3)
+    '''
+    global _clients
+    if _clients is None:  # cleaner called on its own, outside run_aws_cleanup()
+        _clients = _new_client_factory(config)
+
+    if type == 'client':
+        return _clients.client(service, region, target_account)
+    return _clients.resource(service, region, target_account)
+
+
+def list_organization_accounts(config):
+    '''
+    Ids of the active accounts of the organization, listed with the Main account credentials (the management
+    account or a delegated administrator), the accounts already in config.txt are left out
+    '''
+    known = {account.account_id for account in config.aws_accounts}
+    client = _new_client_factory(config).client('organizations', 'us-east-1', 'Main')
+    account_ids = []
+    for page in client.get_paginator('list_accounts').paginate():
+        account_ids += [account['Id'] for account in page['Accounts']
+                        if account['Status'] == 'ACTIVE' and account['Id'] not in known]
+    return account_ids
+
+
+def _new_client_factory(config, metrics=None):
+    '''
+    Client factory for a run, Main uses the default credentials and the other accounts their role_to_assume session
+    :param metrics: ApiMetrics measuring the calls of the run
+    '''
+
+    def session_for(target_account):
+        role_arn = config.account(target_account).role_to_assume
+        if not role_arn:
+            logger.debug('Normal Client')
+            return new_session()
+        logger.info('Assume Role Client for %s', target_account)
+        with _role_sessions_lock:
+            return _role_session(role_arn)
+
+    # a region client is shared by the cleaners running on the region at the same time (up to aws_region_workers),
+    # each with its thread and delete workers, the S3 client by all the bucket workers
+    region_threads = min(config.aws_region_workers, REGION_CLIENT_CLEANERS) * (config.delete_workers + 1)
+    return ClientFactory(session_for, max(10, region_threads, config.s3_bucket_workers), metrics)
+
+
+def _role_session(role_arn):
+    '''
+    Return the boto3 session of the role, created with a single sts.assume_role call and reused for all services
+    and regions, botocore refresh the credentials by itself shortly before they expire
+    '''
+    if role_arn not in _role_sessions:
+
+        def refresh():
+            logger.info('sts assume_role for %s', role_arn)
+            sts = boto3.session.Session().client('sts')
+            if _metrics is not None:  # the credentials are refreshed by the run using the session at that time
+                _metrics.register(sts)
+            credentials = sts.assume_role(RoleArn=role_arn, RoleSessionName='cleanersession')['Credentials']
+            return {
+                'access_key': credentials['AccessKeyId'],
+                'secret_key': credentials['SecretAccessKey'],
+                'token': credentials['SessionToken'],
+                'expiry_time': credentials['Expiration'].isoformat(),
+            }
+
+        botocore_session = get_session()
+        botocore_session._credentials = RefreshableCredentials.create_from_metadata(
+            metadata=refresh(), refresh_using=refresh, method='sts-assume-role')
+        _role_sessions[role_arn] = boto3.session.Session(botocore_session=botocore_session)
+
+    return _role_sessions[role_arn]
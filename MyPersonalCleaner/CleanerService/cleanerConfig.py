@@ -0,0 +1,216 @@
+import configparser
+import os
+import re
+import threading
+from dataclasses import dataclass
+from types import MappingProxyType
+
+CONFIG_FILE = 'config.txt'
+
+# used when aws_regions_all is set and describe_regions can't be called
+AWS_REGIONS = ('eu-north-1', 'ap-south-1', 'eu-west-3', 'eu-west-2', 'eu-west-1', 'ap-northeast-2',
+               'ap-northeast-1', 'sa-east-1', 'ca-central-1', 'ap-southeast-1', 'ap-southeast-2',
+               'eu-central-1', 'us-east-1', 'us-east-2', 'us-west-1', 'us-west-2')
+
+_REGION_NAME = re.compile(r'^[a-z]{2}(-gov)?-[a-z]+-\d$')  # e.g. us-east-1, opt-in regions are not in AWS_REGIONS
+_ACCOUNT_NAME = re.compile(r'^[\w-]{1,32}$')  # used in the report file name and ScanRun.target
+_ACCOUNT_ID = re.compile(r'^\d{12}$')
+
+RESERVED_ACCOUNT_NAMES = ('main', 'second', 'both', 'all')  # Both and All select several accounts on the home page
+
+CLEANUP_MODES = ('keeptag', 'keeptag_withdate')
+CLEANUP_RESOURCES = ('ec2', 'volumes', 'snapshots', 'images', 'sg', 'rds', 'rds_snaps', 's3_objects', 'azure_rg')
+
+# (section, option) -> value used when the option is not in config.txt, the options added after the first
+# release so an existing config.txt keeps working, empty_region_scans 0 keeps scanning all the regions as before
+OPTION_DEFAULTS = {
+    ('general', 'aws_region_workers'): '4',
+    ('general', 's3_bucket_workers'): '4',
+    ('general', 'delete_workers'): '10',
+    ('general', 'empty_region_scans'): '0',
+    ('general', 'aws_account_workers'): '4',
+    ('aws_details', 'organizations_role'): '',
+    ('azure_details', 'delete_timeout'): '3600',
+}
+
+_cache = {}  # config file path -> (mtime, size, CleanerConfig)
+_cache_lock = threading.Lock()
+
+
+class ConfigError(ValueError):
+    '''
+    config.txt is missing a value or has a value that is not valid, the message list all the problems found
+    '''
+
+
+@dataclass(frozen=True)
+class AwsAccount:
+    '''
+    An AWS account to clean, Main uses the default credentials and the others assume role_to_assume
+    '''
+    name: str  # Main, Second, a name of [aws_accounts] or the id of an account listed by Organizations
+    account_id: str
+    role_to_assume: str
+
+
+@dataclass(frozen=True)
+class CleanerConfig:
+    '''
+    Read only snapshot of config.txt, loaded once per run with load_config() and passed to the cleaners
+    '''
+    regions: tuple  # all the regions enabled for the account are discovered when aws_regions_all is set
+    aws_regions_all: bool
+    logs_console: bool
+    logs_file: bool
+    aws_region_workers: int
+    s3_bucket_workers: int
+    delete_workers: int
+    empty_region_scans: int  # regions empty on that many scans in a row only get a probe, 0 to always scan
+    azure_delete_timeout: int
+    aws_account_workers: int
+    aws_accounts: tuple  # AwsAccount, Main and Second first then the [aws_accounts] ones in file order
+    organizations_role: str  # role name assumed in the accounts listed by Organizations, empty to not list them
+    azure_client_secret: str
+    azure_client_id: str
+    azure_tenant_id: str
+    azure_subscription_id: str
+    cleanup_time: int
+    cleanup_modes: MappingProxyType  # resource name (lower case) -> keeptag / keeptag_withdate
+
+    def cleanup_mode(self, resource):
+        '''
+        :param resource: resource name as in the cleanup section, e.g. EC2, Snapshots
+        '''
+        return self.cleanup_modes[resource.lower()]
+
+    def aws_account(self, target_account):
+        '''
+        :param target_account: Main, Second or another account name, see account()
+        :return: the AWS account id
+        '''
+        return self.account(target_account).account_id
+
+    def account(self, target_account):
+        '''
+        :param target_account: name of a configured account, or the id of an account of the organization
+        :return: the AwsAccount
+        :raise KeyError: if the account is not configured and can't be an organization account
+        '''
+        for account in self.aws_accounts:
+            if account.name == target_account:
+                return account
+        if self.organizations_role and _ACCOUNT_ID.match(target_account):
+            return AwsAccount(target_account, target_account,
+                              f'arn:aws:iam::{target_account}:role/{self.organizations_role}')
+        raise KeyError(f'AWS account {target_account} is not in config.txt')
+
+
+def load_config(path=CONFIG_FILE):
+    '''
+    Return the config of the file, the file is only parsed again if it changed since the last call
+    :raise ConfigError: if the file is missing values or has invalid ones
+    '''
+    try:
+        stat = os.stat(path)
+    except OSError:
+        raise ConfigError(f'config file {path} not found')
+
+    key = os.path.abspath(path)
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return cached[2]
+
+        config = _parse(path)
+        _cache[key] = (stat.st_mtime_ns, stat.st_size, config)
+        return config
+
+
+def _parse(path):
+    '''
+    Parse and validate config.txt, collect all the errors before failing so they can be fixed in one go
+    '''
+    parser = configparser.ConfigParser()
+    parser.read(path)
+    errors = []
+
+    def get(section, option):
+        try:
+            return parser[section][option].strip()
+        except KeyError:
+            if (section, option) in OPTION_DEFAULTS:
+                return OPTION_DEFAULTS[(section, option)]
+            errors.append(f'[{section}] {option} is missing')
+            return ''
+
+    def get_bool(section, option):
+        value = get(section, option)
+        if value and value.lower() not in parser.BOOLEAN_STATES:
+            errors.append(f'[{section}] {option} must be true/false, got {value!r}')
+        return parser.BOOLEAN_STATES.get(value.lower(), False)
+
+    def get_int(section, option, minimum):
+        value = get(section, option)
+        try:
+            number = int(value)
+        except ValueError:
+            if value:
+                errors.append(f'[{section}] {option} must be a number, got {value!r}')
+            return minimum
+        if number < minimum:
+            errors.append(f'[{section}] {option} must be at least {minimum}, got {number}')
+        return number
+
+    aws_regions_all = get_bool('general', 'aws_regions_all')
+    if aws_regions_all:
+        regions = AWS_REGIONS
+    else:
+        regions = tuple(region.strip() for region in get('general', 'aws_regions').split(',') if region.strip())
+        bad_region = [region for region in regions if not _REGION_NAME.match(region)]
+        if bad_region:
+            errors.append(f'[general] aws_regions has unknown regions {bad_region}')
+
+    aws_accounts = [AwsAccount('Main', get('aws_details', 'aws_account'), ''),
+                    AwsAccount('Second', get('aws_details_2nd', 'aws_account'),
+                               get('aws_details_2nd', 'role_to_assume'))]
+    if parser.has_section('aws_accounts'):
+        # name = account id, role arn
+        for name, value in parser['aws_accounts'].items():
+            account_id, _, role_arn = (part.strip() for part in value.partition(','))
+            if not _ACCOUNT_NAME.match(name) or name.lower() in RESERVED_ACCOUNT_NAMES:
+                errors.append(f'[aws_accounts] {name} is not a valid account name')
+            elif not account_id or not role_arn.startswith('arn:'):
+                errors.append(f'[aws_accounts] {name} must be "account id, role arn", got {value!r}')
+            aws_accounts.append(AwsAccount(name, account_id, role_arn))
+
+    cleanup_modes = {}
+    for resource in CLEANUP_RESOURCES:
+        mode = get('cleanup', resource)
+        if mode and mode not in CLEANUP_MODES:
+            errors.append(f'[cleanup] {resource} must be one of {CLEANUP_MODES}, got {mode!r}')
+        cleanup_modes[resource] = mode
+
+    config = CleanerConfig(
+        regions=regions,
+        aws_regions_all=aws_regions_all,
+        logs_console=get_bool('general', 'logs_console'),
+        logs_file=get_bool('general', 'logs_file'),
+        aws_region_workers=get_int('general', 'aws_region_workers', 1),
+        s3_bucket_workers=get_int('general', 's3_bucket_workers', 1),
+        delete_workers=get_int('general', 'delete_workers', 1),
+        empty_region_scans=get_int('general', 'empty_region_scans', 0),
+        azure_delete_timeout=get_int('azure_details', 'delete_timeout', 0),
+        aws_account_workers=get_int('general', 'aws_account_workers', 1),
+        aws_accounts=tuple(aws_accounts),
+        organizations_role=get('aws_details', 'organizations_role'),
+        azure_client_secret=get('azure_details', 'client_secret'),
+        azure_client_id=get('azure_details', 'client_id'),
+        azure_tenant_id=get('azure_details', 'tenant_id'),
+        azure_subscription_id=get('azure_details', 'subscription_id'),
+        cleanup_time=get_int('cleanup', 'time', 0),
+        cleanup_modes=MappingProxyType(cleanup_modes),
+    )
+
+    if errors:
+        raise ConfigError(f'{path}: ' + ', '.join(errors))
+    return config
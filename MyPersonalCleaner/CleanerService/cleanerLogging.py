@@ -0,0 +1,117 @@
+'''
+Logging of the cleaners, set up by LOGGING in settings.py.
+The cleaner threads only put the records on a queue (QueueLogHandler), a listener thread writes them through a
+MemoryHandler buffer to a rotating log file, so a region thread or a delete worker never waits for the disk.
+The buffer is written every `capacity` records, on an ERROR and at the end of each job (flush()).
+logs_console / logs_file of config.txt switch the two outputs on and off for each run, see set_outputs().
+The account worker processes send their records to the listener of the job process, see forward_to().
+'''
+import logging
+import logging.handlers
+import os
+import queue
+
+LOGGER_NAME = 'CleanerService'
+
+_outputs = {'console': False, 'file': False}
+_FLUSH = object()  # queued by QueueLogHandler.flush(), the listener then writes the buffer
+
+
+def set_outputs(config):
+    '''
+    Apply logs_console and logs_file of config.txt to the handlers of the cleaners
+    '''
+    _outputs['console'] = config.logs_console
+    _outputs['file'] = config.logs_file
+
+
+def flush():
+    '''
+    Write the records buffered so far, called when a job ends
+    '''
+    for handler in logging.getLogger(LOGGER_NAME).handlers:
+        handler.flush()
+
+
+def listen(log_queue):
+    '''
+    Start a listener handing the records of the account worker processes to the handlers of this process
+    :return: the started QueueListener, stop() it once the workers are done
+    '''
+    listener = logging.handlers.QueueListener(log_queue, *logging.getLogger(LOGGER_NAME).handlers,
+                                              respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def forward_to(log_queue):
+    '''
+    In an account worker process, send the records of the cleaners to the job process (see listen()) instead of
+    opening the log file a second time, the rotation is not safe with several processes writing the file.
+    The records are only sent when an output is enabled (set_outputs() runs in the worker too), nothing is
+    formatted or pickled when the logs are off
+    '''
+    logger = logging.getLogger(LOGGER_NAME)
+    for handler in logger.handlers[:]:
+        logger.removeHandler(handler)
+        handler.close()
+    handler = logging.handlers.QueueHandler(log_queue)
+    handler.addFilter(OutputSwitch(tuple(_outputs)))
+    logger.addHandler(handler)
+
+
+class OutputSwitch(logging.Filter):
+    '''
+    Let the records through only when the output is enabled in config.txt, checked before the record is formatted
+    :param output: console or file, or a tuple of them for a handler feeding several outputs (any enabled)
+    '''
+
+    def __init__(self, output):
+        super().__init__()
+        self.outputs = (output,) if isinstance(output, str) else tuple(output)
+
+    def filter(self, record):
+        return any(_outputs[output] for output in self.outputs)
+
+
+class _BufferListener(logging.handlers.QueueListener):
+
+    def handle(self, record):
+        if record is _FLUSH:
+            self.handlers[0].flush()
+        else:
+            super().handle(record)
+
+
+class QueueLogHandler(logging.handlers.QueueHandler):
+    '''
+    Queue the records for a listener thread writing them to a RotatingFileHandler through a MemoryHandler
+    :param filename: the log file, its directory is created
+    :param maxBytes: size of the log file before it is rotated
+    :param backupCount: rotated files kept
+    :param capacity: records buffered before they are written
+    '''
+
+    def __init__(self, filename, maxBytes=10 * 2 ** 20, backupCount=5, capacity=500):
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        # created before this handler so logging.shutdown() (or a new dictConfig) closes them after it, once the
+        # listener has written what is left in the queue
+        # the records are formatted by this handler before they are queued, the file gets the message as is
+        self.file_handler = logging.handlers.RotatingFileHandler(filename, maxBytes=maxBytes,
+                                                                 backupCount=backupCount, encoding='utf-8', delay=True)
+        self.buffer = logging.handlers.MemoryHandler(capacity, flushLevel=logging.ERROR, target=self.file_handler)
+        super().__init__(queue.SimpleQueue())
+        self.listener = _BufferListener(self.queue, self.buffer)
+        self.listener.start()
+
+    def flush(self):
+        if self.listener:
+            self.queue.put_nowait(_FLUSH)
+
+    def close(self):
+        if self.listener:
+            self.listener.stop()
+            self.listener = None
+            self.buffer.close()
+            self.file_handler.close()
+        super().close()
@@ -0,0 +1,137 @@
+'''
+Keep / delete decisions of the cleaners, the same rules for every resource type:
+ - keeptag_withdate: a resource created cleanup_time days ago or less is kept (age in calendar days, UTC)
+ - a resource is kept when its keep tag is its id (or any keep tag, for the types in RULES matching 'any')
+ - EC2 and RDS instances kept by their tag are stopped unless they also have a keep_state tag
+ - everything else is deleted
+The rules of a resource type are compiled once per (cleaner, region) with compile_policy() and evaluated on
+batches of records with numpy arrays, the date of today is taken once when the policy is compiled.
+'''
+import datetime
+from itertools import islice
+
+import numpy as np
+
+# decisions, index of the operation reported for them in RULES
+KEEP, DELETE, STOP, KEEP_AGE = range(4)
+
+BATCH_SIZE = 1000  # records evaluated together, one EC2 page
+
+# [cleanup] resource -> (keep tag value that keeps the resource: 'id' or 'any',
+#                        stopped when only kept by the keep tag (no keep_state tag),
+#                        operation reported for KEEP, DELETE, STOP and KEEP_AGE)
+RULES = {
+    'ec2': ('id', True, ('keep', 'Terminate', 'Shutdown', 'keep')),
+    'volumes': ('id', False, ('Keep', 'Terminate', None, 'Keep')),
+    'snapshots': ('id', False, ('keep', 'Delete', None, 'keep')),
+    'images': ('id', False, ('Keep', 'Deregister', None, 'Keep')),
+    'sg': ('any', False, ('N/A', 'Deleting', None, 'N/A')),
+    'rds': ('id', True, ('DoNothing', 'Terminate', 'Shutdown', 'Ignore')),
+    'rds_snaps': ('id', False, ('Ignore', 'Delete', None, 'Ignore')),
+    's3_objects': ('any', False, ('DoNothing', 'Delete', None, 'DoNothing')),
+    'azure_rg': ('any', False, ('Keep', 'Delete', None, 'Keep')),
+}
+
+
+def compile_policy(config, resource):
+    '''
+    :param config: CleanerConfig, the cleanup mode of the resource and cleanup_time are used
+    :param resource: resource name as in the cleanup section, e.g. EC2, RDS_Snaps
+    :return: the CleanupPolicy of the resource type
+    '''
+    keep, stop, operations = RULES[resource.lower()]
+    return CleanupPolicy(config.cleanup_mode(resource), config.cleanup_time, operations, keep, stop)
+
+
+def batches(iterable, size=BATCH_SIZE):
+    '''
+    Yield lists of up to size items of the iterable, read lazily
+    '''
+    iterator = iter(iterable)
+    batch = list(islice(iterator, size))
+    while batch:
+        yield batch
+        batch = list(islice(iterator, size))
+
+
+def _day(value):
+    '''
+    Day of a creation time: a datetime (converted to UTC when it has a timezone), an ISO string like the images
+    CreationDate or None when unknown
+    '''
+    if value is None:
+        return 'NaT'
+    if isinstance(value, str):
+        return value[:10]
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc)
+    return value.date()
+
+
+class CleanupPolicy:
+    '''
+    Compiled rules of a resource type
+    :param mode: keeptag or keeptag_withdate
+    :param cleanup_time: days a resource is kept in keeptag_withdate mode
+    :param operations: operation reported for KEEP, DELETE, STOP and KEEP_AGE
+    :param keep: 'id' when the keep tag must be the resource id, 'any' when any keep tag keeps the resource
+    :param stop: the resources kept by their keep tag without a keep_state tag are stopped
+    :param today: date the ages are counted to, today (UTC) by default
+    '''
+
+    def __init__(self, mode, cleanup_time, operations, keep='id', stop=False, today=None):
+        self.by_age = mode == 'keeptag_withdate'
+        self.cleanup_time = cleanup_time
+        self.operations = operations
+        self.keep = keep
+        self.stop = stop
+        self.today = np.datetime64(today or datetime.datetime.now(datetime.timezone.utc).date(), 'D')
+
+    def decide(self, ids, tags, created=None, eligible=None):
+        '''
+        Decisions for a batch of resources, given as columns
+        :param ids: resource ids
+        :param tags: tag dicts, None for the untagged resources
+        :param created: creation times (see _day()), None when the resource type has none and the age rule is
+                        not applied. A resource with an unknown creation time is kept in keeptag_withdate mode
+        :param eligible: bools, False for the resources that can't be deleted (e.g. in use), they are kept
+        :return: (array of decisions, list of ages in days or None when the age rule is not applied)
+        '''
+        tagged = np.array([bool(tag) and 'keep' in tag for tag in tags], dtype=bool)
+        if self.keep == 'id':
+            keep_values = np.array([tag.get('keep') if tag else None for tag in tags], dtype=object)
+            tagged &= keep_values == np.array(ids, dtype=object)
+
+        decisions = np.where(tagged, KEEP, DELETE).astype(np.int8)
+        if self.stop:
+            keep_state = np.array([bool(tag) and 'keep_state' in tag for tag in tags], dtype=bool)
+            decisions[tagged & ~keep_state] = STOP
+        if eligible is not None:
+            decisions[~np.asarray(eligible, dtype=bool)] = KEEP
+
+        ages = None
+        if self.by_age and created is not None:
+            days = np.array([_day(value) for value in created], dtype='datetime64[D]')
+            unknown = np.isnat(days)
+            age = (self.today - days).astype(np.int64)
+            decisions[unknown | (age <= self.cleanup_time)] = KEEP_AGE
+            ages = [None if missing else value for missing, value in zip(unknown.tolist(), age.tolist())]
+        return decisions, ages
+
+    def apply(self, records, eligible=None):
+        '''
+        Set the operation of a batch of records of the same type (see resourceRecords.py), and their age in
+        keeptag_withdate mode
+        '''
+        if not records:
+            return
+        record_type = type(records[0])
+        created = ([getattr(record, record_type.created_field) for record in records]
+                   if record_type.created_field else None)
+        decisions, ages = self.decide([getattr(record, record_type.id_field) for record in records],
+                                      [record.tags for record in records], created, eligible)
+        for record, decision in zip(records, decisions.tolist()):
+            record.operation = self.operations[decision]
+        if ages is not None:
+            for record, age in zip(records, ages):
+                record.age = age
@@ -0,0 +1,62 @@
+import threading
+
+from botocore.config import Config
+
+CONNECT_TIMEOUT = 10  # seconds
+READ_TIMEOUT = 60
+# botocore retries, the adaptive mode also slows the client down when it gets throttled. The only retry layer of
+# the cleaners, DeleteExecutor leaves the throttled deletes to it
+MAX_ATTEMPTS = 10
+
+
+class ClientFactory:
+    '''
+    The boto3 clients of a cleanup run, one per (account, region, service) created on first use and shared by all
+    the cleaners and their threads (boto3 clients are thread safe), so the connections and endpoint resolution of
+    a region are reused instead of being set up again by each cleaner
+    '''
+
+    def __init__(self, session_for, max_pool_connections=10, metrics=None):
+        '''
+        :param session_for: function returning the boto3 session of a target account (Main/Second),
+                            called once per account
+        :param max_pool_connections: connections kept per client, should cover the threads sharing a client
+        :param metrics: ApiMetrics measuring the calls of the clients
+        '''
+        self._session_for = session_for
+        self.metrics = metrics
+        self._sessions = {}
+        self._clients = {}
+        self._lock = threading.Lock()  # boto3 sessions are not thread safe, create the clients one at a time
+        self.config = Config(max_pool_connections=max_pool_connections, connect_timeout=CONNECT_TIMEOUT,
+                             read_timeout=READ_TIMEOUT, retries={'mode': 'adaptive', 'max_attempts': MAX_ATTEMPTS})
+
+    def client(self, service, region, target_account):
+        key = (target_account, region, service)
+        with self._lock:
+            if key not in self._clients:
+                self._clients[key] = self._measure(self.session(target_account).client(
+                    service, region_name=region, config=self.config))
+            return self._clients[key]
+
+    def resource(self, service, region, target_account):
+        '''
+        boto3 resources are not thread safe, a new one is returned on each call
+        '''
+        with self._lock:
+            resource = self.session(target_account).resource(service, region_name=region, config=self.config)
+        self._measure(resource.meta.client)
+        return resource
+
+    def session(self, target_account):
+        '''
+        The boto3 session of the account, the caller must hold the lock
+        '''
+        if target_account not in self._sessions:
+            self._sessions[target_account] = self._session_for(target_account)
+        return self._sessions[target_account]
+
+    def _measure(self, client):
+        if self.metrics is not None:
+            self.metrics.register(client)
+        return client
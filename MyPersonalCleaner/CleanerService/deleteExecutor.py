@@ -0,0 +1,79 @@
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+# error codes AWS returns when the API rate limit is hit, the clients of clientFactory.py retry them (adaptive mode)
+# and apiMetrics.py counts them
+THROTTLING_CODES = ('RequestLimitExceeded', 'Throttling', 'ThrottlingException', 'TooManyRequestsException',
+                    'SlowDown')
+
+
+class DeleteExecutor:
+    '''
+    Run the delete calls of a region concurrently with a bounded number of calls in flight.
+    Throttled calls are not retried here, the clients do it with the adaptive retry mode of clientFactory.py which
+    also slows all the threads sharing the client down, a second retry loop would multiply the attempts.
+    Results are returned in the order the resources were submitted, so the report keeps the inventory order:
+
+        with DeleteExecutor(10) as deleter:
+            for snap in snapshots:
+                deleter.submit(snap, ec2.delete_snapshot, SnapshotId=snap['SnapshotId'], DryRun=dry_run)
+                for snap, error in deleter.results():
+                    ...
+            for snap, error in deleter.results(wait=True):
+                ...
+    '''
+
+    def __init__(self, max_in_flight=10):
+        self._pool = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='delete')
+        self._queued = threading.BoundedSemaphore(max_in_flight * 2)  # stop the inventory from running too far ahead
+        self._pending = deque()  # (record, future) in submit order
+
+    def submit(self, record, call=None, **kwargs):
+        '''
+        Queue the delete call for the resource, without call the resource only keeps its place in the results
+        :param record: returned as is with the result, e.g. the resource dict
+        :param call: boto3 client method, e.g. ec2.delete_snapshot
+        '''
+        if call is None:
+            future = Future()
+            future.set_result(None)
+        else:
+            self._queued.acquire()
+            future = self._pool.submit(self._call, call, kwargs)
+            future.add_done_callback(lambda _: self._queued.release())
+        self._pending.append((record, future))
+
+    def results(self, wait=False):
+        '''
+        Yield (record, error) for the resources done so far, in submit order, error is None on success
+        :param wait: wait for all the submitted calls
+        '''
+        while self._pending and (wait or self._pending[0][1].done()):
+            record, future = self._pending.popleft()
+            yield record, future.result()
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _call(self, call, kwargs):
+        '''
+        :return: None if the call succeeded (or would have, for DryRun), the ClientError otherwise, or the
+                 BotoCoreError (e.g. ReadTimeoutError) once the client ran out of retries
+        '''
+        try:
+            call(**kwargs)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'DryRunOperation':
+                return e
+        except BotoCoreError as e:  # a single resource, the other deletes of the batch go on
+            return e
+        return None
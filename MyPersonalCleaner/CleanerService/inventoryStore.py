@@ -0,0 +1,229 @@
+'''
+Local inventory of the scanned resources (ScanRun, InventoryResource and Decision in models.py).
+The resources of a scan are collected while the cleaners run and written in bulk once the scan is done,
+only the resources whose state or decision changed since the previous scan are updated.
+'''
+import dataclasses
+import datetime
+import hashlib
+import json
+import threading
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ScanRun, InventoryResource, Decision, RegionScanState
+
+# operations that change the resource, a Decision is kept for them and pending_actions() lists them
+ACTION_OPERATIONS = ('Delete', 'Terminate', 'Deregister', 'Deleting', 'Shutdown')
+
+BATCH_SIZE = 500  # rows per bulk query, keeps each query under the sqlite variables limit
+
+# record fields that are not part of the resource state, age changes every day, account is the Main/Second label
+# and used_by comes from the other resources of the scan
+_NOT_STATE = ('operation', 'age', 'error', 'account', 'used_by')
+
+
+class InventoryWriter:
+    '''
+    Collect the resources of one scan, add() can be called from the region threads,
+    flush() writes them once the scan finished
+    '''
+
+    def __init__(self, cloud, account, dry_run, scope, target='', job_id=None):
+        '''
+        :param cloud: aws or azure
+        :param account: AWS account id or Azure subscription id
+        :param scope: dict of resource type -> regions scanned (None for all), resources of the scope that
+                      the scan did not find are marked gone
+        :param target: Main / Second
+        :param job_id: the CleanupJob running the scan
+        '''
+        self.cloud = cloud
+        self.account = account
+        self.dry_run = dry_run
+        self.scope = scope
+        self.target = target
+        self.job_id = job_id
+        self.started = timezone.now()
+        self._items = {}  # (resource type, region, resource id) -> (state, operation, error)
+        self._lock = threading.Lock()
+
+    def add(self, resource_type, region, resource_id, state, operation, error=None):
+        '''
+        :param state: dict of the resource fields, json serializable
+        '''
+        with self._lock:
+            self._items[(resource_type, region or '', resource_id)] = (state, operation, error)
+
+    def exclude(self, resource_type, region):
+        '''
+        The scan of the resource type failed in the region, the resources it didn't find there are not marked gone
+        '''
+        with self._lock:
+            if self.scope.get(resource_type):
+                self.scope[resource_type] = [scanned for scanned in self.scope[resource_type]
+                                             if scanned.strip() != region]
+
+    def add_record(self, record):
+        '''
+        Add a resource record of resourceRecords.py
+        '''
+        self.add(record.kind, getattr(record, 'region', ''), getattr(record, record.id_field), record_state(record),
+                 record.operation, getattr(record, 'error', None))
+
+    def flush(self):
+        '''
+        Write the scan: new resources are inserted, changed ones updated and the ones not found anymore marked gone
+        :return: the ScanRun
+        '''
+        now = timezone.now()
+        with self._lock:
+            items, self._items = self._items, {}
+
+        with transaction.atomic():
+            run = ScanRun.objects.create(cloud=self.cloud, account=self.account, target=self.target,
+                                         job_id=self.job_id, dry_run=self.dry_run, started=self.started,
+                                         finished=now, resource_count=len(items))
+
+            existing = {(resource.resource_type, resource.region, resource.resource_id): resource
+                        for resource in InventoryResource.objects.filter(
+                            account=self.account, resource_type__in=list(self.scope)).only(
+                            'id', 'resource_type', 'region', 'resource_id', 'fingerprint', 'gone')}
+
+            new, changed = [], []
+            fingerprints = {}
+            for key, (state, operation, error) in items.items():
+                fingerprints[key] = state_fingerprint = fingerprint(state, operation)
+                resource = existing.get(key)
+                if resource is None:
+                    new.append(InventoryResource(account=self.account, resource_type=key[0], region=key[1],
+                                                 resource_id=key[2], data=state, operation=operation,
+                                                 fingerprint=state_fingerprint, first_seen=now, changed=now,
+                                                 last_run=run))
+                elif resource.fingerprint != state_fingerprint or resource.gone:
+                    resource.data = state
+                    resource.operation = operation
+                    resource.fingerprint = state_fingerprint
+                    resource.gone = False
+                    resource.changed = now
+                    resource.last_run = run
+                    changed.append(resource)
+
+            gone = []
+            for key, resource in existing.items():
+                regions = self.scope.get(key[0])
+                if key not in items and not resource.gone and (regions is None or key[1] in regions):
+                    resource.gone = True
+                    resource.changed = now
+                    resource.last_run = run
+                    gone.append(resource)
+
+            InventoryResource.objects.bulk_create(new, batch_size=BATCH_SIZE)
+            InventoryResource.objects.bulk_update(
+                changed, ['data', 'operation', 'fingerprint', 'gone', 'changed', 'last_run'], batch_size=BATCH_SIZE)
+            InventoryResource.objects.bulk_update(gone, ['gone', 'changed', 'last_run'], batch_size=BATCH_SIZE)
+
+            actions = {key: item for key, item in items.items() if item[1] in ACTION_OPERATIONS}
+            if actions:
+                ids = self._resource_ids(actions)
+                Decision.objects.bulk_create(
+                    [Decision(run=run, resource_id=ids[key], operation=operation, fingerprint=fingerprints[key],
+                              error=str(error) if error else '')
+                     for key, (state, operation, error) in actions.items()], batch_size=BATCH_SIZE)
+
+            run.changed_count = len(new) + len(changed) + len(gone)
+            run.save(update_fields=['changed_count'])
+        return run
+
+    def _resource_ids(self, keys):
+        '''
+        Primary keys of the resources, bulk_create doesn't return them on sqlite
+        '''
+        keys = list(keys)
+        ids = {}
+        for i in range(0, len(keys), BATCH_SIZE):
+            batch = keys[i:i + BATCH_SIZE]
+            rows = InventoryResource.objects.filter(
+                account=self.account, resource_id__in={key[2] for key in batch}).values_list(
+                'id', 'resource_type', 'region', 'resource_id')
+            ids.update({(resource_type, region, resource_id): pk for pk, resource_type, region, resource_id in rows})
+        return ids
+
+
+def pending_actions(account=None, resource_type=None):
+    '''
+    Resources the last scan decided to delete/stop (or would have, in dry run) and that are still there,
+    answered from the local inventory without calling AWS/Azure
+    '''
+    resources = InventoryResource.objects.filter(gone=False, operation__in=ACTION_OPERATIONS)
+    if account:
+        resources = resources.filter(account=account)
+    if resource_type:
+        resources = resources.filter(resource_type=resource_type)
+    return resources
+
+
+def empty_regions(account, resource_type, min_empty_scans):
+    '''
+    Regions where the cleaner found nothing on the last min_empty_scans scans of the account
+    '''
+    return set(RegionScanState.objects.filter(account=account, resource_type=resource_type,
+                                              empty_scans__gte=min_empty_scans).values_list('region', flat=True))
+
+
+def record_region_scans(account, resource_type, found):
+    '''
+    Update the empty scans count of the regions scanned (or probed) by the cleaner
+    :param found: dict of region -> number of resources found
+    '''
+    now = timezone.now()
+    with transaction.atomic():
+        states = {state.region: state for state in RegionScanState.objects.filter(
+            account=account, resource_type=resource_type, region__in=list(found))}
+        new, changed = [], []
+        for region, count in found.items():
+            state = states.get(region) or RegionScanState(account=account, resource_type=resource_type,
+                                                          region=region)
+            state.empty_scans = 0 if count else state.empty_scans + 1
+            state.last_scan = now
+            if count:
+                state.last_found = now
+            (changed if state.pk else new).append(state)
+        RegionScanState.objects.bulk_create(new)
+        RegionScanState.objects.bulk_update(changed, ['empty_scans', 'last_scan', 'last_found'])
+
+
+def load_plan(run):
+    '''
+    The plan of a dry run scan, what apply has to do
+    :return: dict of resource type -> region -> {resource id: (operation, fingerprint)}
+    '''
+    plan = {}
+    decisions = run.decisions.values_list('resource__resource_type', 'resource__region', 'resource__resource_id',
+                                          'operation', 'fingerprint')
+    for resource_type, region, resource_id, operation, state_fingerprint in decisions.iterator():
+        plan.setdefault(resource_type, {}).setdefault(region, {})[resource_id] = (operation, state_fingerprint)
+    return plan
+
+
+def record_state(record):
+    '''
+    The record fields that describe the resource, as a json serializable dict
+    '''
+    state = {}
+    for field in dataclasses.fields(record):
+        if field.name in _NOT_STATE:
+            continue
+        value = getattr(record, field.name)
+        if isinstance(value, (datetime.datetime, datetime.date)):
+            value = value.isoformat()
+        state[field.name] = value
+    return state
+
+
+def fingerprint(state, operation):
+    '''
+    sha1 of the resource state and the decision, used to find the resources that changed between scans
+    '''
+    return hashlib.sha1(json.dumps([state, operation], sort_keys=True, default=str).encode()).hexdigest()
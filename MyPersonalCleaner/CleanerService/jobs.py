@@ -0,0 +1,302 @@
+import functools
+import multiprocessing
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from time import strftime, time
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .models import CleanupJob, ScanRun
+from .cleanResources import list_organization_accounts
+from .azureCleanup import clean_az_rg, apply_az_plan
+from .accountWorker import init_worker, clean_account, apply_account
+from .reportSink import create_report, close_report, report_format, REPORT_FORMATS
+from .apiMetrics import ApiMetrics, publish
+from .cleanerConfig import load_config
+from .cleanerLogging import set_outputs, flush, listen
+
+_pool = None  # local worker pool running the cleanup jobs, created on first use
+_pool_lock = threading.Lock()
+BOOT_ID_FILE = '/proc/sys/kernel/random/boot_id'  # changes on every boot, linux only
+
+
+def submit_cleanup(dry_run, account, targets, plan=None, full_sweep=False, report_format='xlsx'):
+    '''
+    Save a new cleanup job and queue it on the worker pool, return without waiting for it
+    :param account: an account name of config.txt, Both or All, see aws_targets()
+    :param targets: list of targets as selected on the cleanup page
+    :param plan: id of a dry run job, apply what it planned instead of scanning again
+    :param full_sweep: scan all the regions, even the ones that were empty on the last scans
+    :param report_format: one of reportSink.REPORT_FORMATS, the report is written in the format of its file name
+    :return: the CleanupJob
+    '''
+    report_name = strftime('ResourcesCleaner_' + account + '_' + "%Y-%b-%d_%H-%M-%S") + REPORT_FORMATS[report_format][0]
+    if dry_run:
+        report_name = 'DryRun_' + report_name
+    elif plan:
+        report_name = 'Apply_' + report_name
+
+    params = {'dry_run': dry_run, 'account': account, 'targets': targets}
+    if plan:
+        params['plan'] = plan
+    if full_sweep:
+        params['full_sweep'] = True
+
+    pool = _get_pool()
+    recover_jobs()  # before creating the job, the server processes that died since the last job left theirs
+    job = CleanupJob.objects.create(params=params, report_name=report_name, owner=process_id())
+    pool.submit(_run_job, job.pk)
+    return job
+
+
+def submit_apply(plan_job):
+    '''
+    Queue a job deleting what the dry run job planned, see run_cleanup()
+    :param plan_job: a finished dry run CleanupJob
+    :return: the new CleanupJob
+    '''
+    if not plan_job.can_apply():
+        raise ValueError(f'Job {plan_job.pk} is not a finished dry run')
+    return submit_cleanup(False, plan_job.params['account'], plan_job.params['targets'], plan_job.pk,
+                          report_format=report_format(plan_job.report_name))
+
+
+def report_path(job):
+    '''
+    Path of the report of the job, each job has its own file in CLEANUP_REPORTS_DIR
+    '''
+    return os.path.join(settings.CLEANUP_REPORTS_DIR, f'{job.pk}_{job.report_name}')
+
+
+def expire_reports():
+    '''
+    Remove the reports written more than CLEANUP_REPORTS_MAX_AGE seconds ago, run when the worker pool starts and
+    when a job finishes so the reports can be downloaded several times
+    '''
+    oldest = time() - settings.CLEANUP_REPORTS_MAX_AGE
+    with os.scandir(settings.CLEANUP_REPORTS_DIR) as entries:
+        for entry in entries:
+            try:
+                if entry.is_file() and entry.stat().st_mtime < oldest:
+                    os.remove(entry.path)
+            except FileNotFoundError:  # removed by another server process
+                pass
+
+
+def run_cleanup(xlsx_name, dry_run, account, targets, plan=None, job_id=None, full_sweep=False):
+    '''
+    Run the selected cleanups for the account(s) and write the report to xlsx_name
+    :param account: an account name of config.txt, Both or All, see aws_targets()
+    :param targets: list of targets as selected on the cleanup page
+    :param plan: id of a dry run job, apply what its scans planned instead of scanning again
+    :param job_id: the job running the cleanup
+    :param full_sweep: scan all the regions, even the ones that were empty on the last scans
+    '''
+    config = load_config()
+    set_outputs(config)
+
+    EC2 = Volumes = 'ec2_ebs' in targets or 'all' in targets
+    Snapshots = Images = 'ami_snaps' in targets or 'all' in targets
+    SG = 'sg' in targets or 'all' in targets
+    RDS = RDS_Snaps = 'rds_snaps' in targets or 'all' in targets
+    S3_Objects = 'S3 Objects' in targets or 'all' in targets
+    Azure_RG = 'Azure RG' in targets or 'all' in targets
+    sheets = (EC2, Volumes, Snapshots, Images, SG, RDS, RDS_Snaps, S3_Objects)
+
+    if plan:
+        scans = ScanRun.objects.filter(job_id=plan).order_by('pk')
+        aws_scans = [scan for scan in scans if scan.cloud == 'aws']
+        if aws_scans:
+            _run_accounts(xlsx_name, config, [(scan.target, apply_account, (scan.pk, sheets, job_id))
+                                              for scan in aws_scans])
+        for scan in scans:
+            if scan.cloud == 'azure':
+                apply_az_plan(xlsx_name, scan, config, job_id)
+        return
+
+    if any(sheets):
+        _run_accounts(xlsx_name, config, [(name, clean_account, (name, dry_run, sheets, job_id, full_sweep))
+                                          for name in aws_targets(account, config)])
+
+    if Azure_RG:
+        clean_az_rg(xlsx_name, dry_run, config, job_id)
+
+
+def aws_targets(account, config):
+    '''
+    Names of the AWS accounts selected on the home page
+    :param account: an account name of config.txt, Both (Main and Second) or All (all the accounts of config.txt,
+                    and the accounts of the organization when organizations_role is set)
+    '''
+    if account == 'Both':
+        return ['Main', 'Second']
+    if account == 'All':
+        names = [aws_account.name for aws_account in config.aws_accounts]
+        if config.organizations_role:
+            names += list_organization_accounts(config)
+        return names
+    config.account(account)  # KeyError if the account was removed from config.txt
+    return [account]
+
+
+def _run_accounts(xlsx_name, config, tasks):
+    '''
+    Run the AWS accounts on a pool of aws_account_workers processes (config.txt), one account failing doesn't stop
+    the others, its error is raised once the rows of all the accounts are in the report, in the accounts order
+    :param tasks: list of (account name, accountWorker function, its arguments after the report key)
+    '''
+    report = create_report(xlsx_name)
+    workers = min(config.aws_account_workers, len(tasks))
+    pool = listener = None
+    if workers > 1:
+        # spawn, forking the server process would copy its threads state and database connections
+        context = multiprocessing.get_context('spawn')
+        log_queue = context.Queue()
+        listener = listen(log_queue)
+        pool = ProcessPoolExecutor(workers, mp_context=context, initializer=init_worker, initargs=(log_queue,))
+
+    failed = []
+    try:
+        if pool:
+            results = [pool.submit(run, f'{xlsx_name}#{name}', *args).result for name, run, args in tasks]
+        else:  # a single account runs in the job thread, no process to start
+            results = [functools.partial(run, f'{xlsx_name}#{name}', *args) for name, run, args in tasks]
+
+        for (name, run, args), result in zip(tasks, results):
+            try:
+                account_sheets, error = result()
+            except Exception as e:  # the worker process died, keep the rows of the other accounts
+                account_sheets, error = {}, f'{type(e).__name__}: {e}'
+            # the rows of a failed account too, what it deleted before failing, raise after the merge
+            for title, rows in account_sheets.items():
+                report.add_sheet(title, rows[0])
+                report.extend(title, rows[1:])
+            publish(account_sheets.get('Metrics', [()])[1:])
+            if error:
+                failed.append(f'{name}: {error}')
+    finally:
+        if pool:
+            pool.shutdown()
+            listener.stop()
+
+    if report.sheets:
+        metrics = ApiMetrics()
+        with metrics.timed('cleaner', 'Write report'):
+            report.save()
+        publish(metrics.rows(''))
+    if failed:
+        raise RuntimeError(f'{len(failed)} of {len(tasks)} AWS accounts failed - ' + ', '.join(failed))
+
+
+def has_report(job):
+    '''
+    The job finished and its report can be downloaded: a failed job keeps the report of what it did before failing
+    '''
+    return job.status in (CleanupJob.DONE, CleanupJob.FAILED) and os.path.isfile(report_path(job))
+
+
+def process_id():
+    '''
+    Id of this server process, its pid on this boot of the machine: with several server processes (WSGI workers)
+    each one runs its own jobs
+    '''
+    return f'{_boot_id()}:{os.getpid()}'
+
+
+def recover_jobs():
+    '''
+    Fail the jobs left queued/running by server processes that are gone, they can't finish anymore.
+    The jobs of the other running server processes are left alone
+    '''
+    boot_id = _boot_id()
+    orphaned = []
+    for job in CleanupJob.objects.filter(status__in=[CleanupJob.QUEUED, CleanupJob.RUNNING]).only('owner'):
+        owner_boot_id, _, pid = job.owner.rpartition(':')
+        # no owner: created before the owner was recorded
+        if owner_boot_id != boot_id or not pid.isdigit() or not _process_alive(int(pid)):
+            orphaned.append(job.pk)
+    if orphaned:
+        CleanupJob.objects.filter(pk__in=orphaned, status__in=[CleanupJob.QUEUED, CleanupJob.RUNNING]).update(
+            status=CleanupJob.FAILED, error='Server restarted before the job finished', finished=timezone.now())
+
+
+def _boot_id():
+    '''
+    Id of the current boot of the machine, the host name where the boot id is not available (windows): a reused pid
+    of a process from before a reboot is then taken for a running server process
+    '''
+    try:
+        with open(BOOT_ID_FILE) as file:
+            return file.read().strip()
+    except OSError:
+        return socket.gethostname()
+
+
+def _process_alive(pid):
+    if pid == os.getpid():
+        return True
+    if os.name == 'nt':  # os.kill() would terminate the process
+        import ctypes
+        STILL_ACTIVE = 259
+        handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        exit_code = ctypes.c_ulong()
+        try:
+            ctypes.windll.kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+        finally:
+            ctypes.windll.kernel32.CloseHandle(handle)
+        return exit_code.value == STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # running as another user
+        return True
+    return True
+
+
+def _get_pool():
+    '''
+    Create the worker pool on first use
+    '''
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            os.makedirs(settings.CLEANUP_REPORTS_DIR, exist_ok=True)
+            expire_reports()
+            _pool = ThreadPoolExecutor(max_workers=settings.CLEANUP_JOB_WORKERS, thread_name_prefix='cleanup-job')
+        return _pool
+
+
+def _run_job(job_id):
+    '''
+    Worker pool entry point, run the job and keep its status up to date in the database
+    '''
+    try:
+        job = CleanupJob.objects.get(pk=job_id)
+        job.status = CleanupJob.RUNNING
+        job.started = timezone.now()
+        job.save(update_fields=['status', 'started'])
+
+        xlsx_name = report_path(job)
+        try:
+            run_cleanup(xlsx_name, job_id=job.pk, **job.params)
+        except Exception as e:
+            job.status = CleanupJob.FAILED
+            job.error = f'{type(e).__name__}: {e}'
+        else:
+            job.status = CleanupJob.DONE
+        finally:
+            close_report(xlsx_name)
+            flush()
+
+        job.finished = timezone.now()
+        job.save(update_fields=['status', 'error', 'finished'])
+        expire_reports()
+    finally:
+        connection.close()  # each worker thread has its own db connection
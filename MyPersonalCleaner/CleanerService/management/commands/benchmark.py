@@ -0,0 +1,222 @@
+'''
+Offline benchmark of the AWS cleanup, run_aws_cleanup() is run end to end on synthetic fleets (see syntheticFleet.py)
+in a throwaway test database, nothing is sent to AWS and the inventory is left untouched.
+Each result is appended to the results file and compared with the previous result of the same case and size:
+    python manage.py benchmark --sizes 1000,10000,100000 --cases snapshots,volumes,sg,s3,all,apply
+The apply case times run_aws_apply() of the plan of a dry run of all the cleaners (the dry run is not timed).
+'''
+import datetime
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from CleanerService import cleanResources
+from CleanerService.cleanerConfig import load_config
+from CleanerService.models import ScanRun, InventoryResource, RegionScanState
+from CleanerService.reportSink import get_report, close_report, REPORT_FORMATS
+from CleanerService.syntheticFleet import SyntheticFleet
+
+# case -> cleaners (run_aws_cleanup flags) of the case
+CASES = {
+    'ec2': ('EC2',),
+    'volumes': ('Volumes',),
+    'snapshots': ('Snapshots',),
+    'images': ('Images',),
+    'sg': ('SG',),
+    'rds': ('RDS',),
+    'rds_snaps': ('RDS_Snaps',),
+    's3': ('S3_Objects',),
+    'all': ('EC2', 'Volumes', 'Snapshots', 'Images', 'SG', 'RDS', 'RDS_Snaps', 'S3_Objects'),
+    'apply': ('EC2', 'Volumes', 'Snapshots', 'Images', 'SG', 'RDS', 'RDS_Snaps', 'S3_Objects'),
+}
+
+APPLY_CASES = ('apply',)  # cases timing run_aws_apply() of a dry run plan instead of run_aws_cleanup()
+
+NOT_RESOURCE_SHEETS = ('Filters', 'Metrics')
+
+
+class Command(BaseCommand):
+    help = 'Run the AWS cleaners on synthetic fleets and compare with the previous benchmark results'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000', help='resources of each type, comma separated')
+        parser.add_argument('--cases', default='snapshots,volumes,sg,s3,all,apply',
+                            help=f'comma separated, one of {", ".join(CASES)}')
+        parser.add_argument('--objects-per-bucket', type=int, default=10)
+        parser.add_argument('--latency', type=float, default=0,
+                            help='milliseconds each synthetic API call takes, 0 to only measure the cleaner itself')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='run the cleaners in dry run, the delete calls are answered with DryRunOperation '
+                                 '(not for the apply cases, a plan is always applied for real)')
+        parser.add_argument('--report-format', choices=list(REPORT_FORMATS), default='xlsx',
+                            help='format the report is written in')
+        parser.add_argument('--output', default=os.path.join(settings.BASE_DIR, 'benchmarks', 'results.jsonl'),
+                            help='results file, one json line per case and size')
+        parser.add_argument('--threshold', type=float, default=10,
+                            help='percent slower or bigger than the previous result reported as a regression')
+        parser.add_argument('--no-memory', action='store_true', help="don't run the cases again for the peak memory")
+        parser.add_argument('--no-save', action='store_true', help="don't add the results to the results file")
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError(f'--sizes must be numbers, got {options["sizes"]!r}')
+        cases = options['cases'].split(',')
+        unknown = [case for case in cases if case not in CASES]
+        if unknown:
+            raise CommandError(f'unknown cases {unknown}, use {", ".join(CASES)}')
+
+        previous = _load_results(options['output'])
+        version = _version()
+        test_db = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            for size in sizes:
+                for case in cases:
+                    result = self._run_case(case, size, options['objects_per_bucket'], options['dry_run'],
+                                            not options['no_memory'], options['report_format'],
+                                            options['latency'] / 1000)
+                    result['version'] = version
+                    self._compare(result, previous.get((case, size, options['dry_run'], options['report_format'],
+                                                        options['latency'])), options['threshold'])
+                    if not options['no_save']:
+                        _save_result(options['output'], result)
+        finally:
+            connection.creation.destroy_test_db(test_db, verbosity=0)
+
+    def _run_case(self, case, size, objects_per_bucket, dry_run, memory, report_format, latency):
+        '''
+        Run the cleaners of the case on a new fleet and an empty inventory, then again with tracemalloc for the
+        peak memory (tracing makes the run several times slower so it is not timed)
+        :return: the result dict
+        '''
+        regions = load_config().regions
+        report_path = os.path.join(tempfile.gettempdir(),
+                                   f'benchmark_{os.getpid()}_{case}_{size}' + REPORT_FORMATS[report_format][0])
+        try:
+            seconds = self._run_cleanup(case, size, objects_per_bucket, dry_run, report_path, latency)
+            report = get_report(report_path)
+            start = time.perf_counter()
+            report.save()
+            report_seconds = time.perf_counter() - start
+            resources = sum(len(rows) - 1 for title, rows in report.sheets.items() if title not in NOT_RESOURCE_SHEETS)
+            api_calls = sum(row[4] for row in report.sheets['Metrics'][1:] if row[0] != 'cleaner')
+            report_bytes = os.path.getsize(report_path)
+            close_report(report_path)
+
+            peak = None
+            if memory:
+                tracemalloc.start()
+                try:
+                    self._run_cleanup(case, size, objects_per_bucket, dry_run, report_path, latency)
+                    peak = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+                finally:
+                    tracemalloc.stop()
+        finally:
+            close_report(report_path)
+            if os.path.isfile(report_path):
+                os.remove(report_path)
+
+        return {
+            'case': case, 'size': size, 'dry_run': dry_run, 'report_format': report_format,
+            'latency_ms': round(latency * 1000, 3), 'regions': len(regions),
+            'time': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'resources': resources, 'api_calls': api_calls, 'seconds': round(seconds, 3),
+            'resources_per_second': round(resources / seconds, 1) if seconds else 0,
+            'peak_memory_mb': peak,
+            'report_write_seconds': round(report_seconds, 3), 'report_bytes': report_bytes,
+        }
+
+    def _run_cleanup(self, case, size, objects_per_bucket, dry_run, report_path, latency):
+        '''
+        run_aws_cleanup() of the case on a new fleet and an empty inventory, the report is left open.
+        For the apply cases, run_aws_apply() of the plan of a dry run scan of the fleet
+        :return: seconds taken
+        '''
+        fleet = SyntheticFleet(load_config().regions, size, objects_per_bucket, latency)
+        for model in (InventoryResource, ScanRun, RegionScanState):
+            model.objects.all().delete()
+
+        new_session = cleanResources.new_session
+        cleanResources.new_session = fleet.session
+        try:
+            flags = {flag: True for flag in CASES[case]}
+            if case in APPLY_CASES:
+                plan_path = report_path + '.plan'
+                try:
+                    cleanResources.run_aws_cleanup(plan_path, True, **flags, full_sweep=True, savexlsx=False)
+                finally:
+                    close_report(plan_path)
+                plan_run = ScanRun.objects.filter(dry_run=True).latest('pk')
+                start = time.perf_counter()
+                cleanResources.run_aws_apply(report_path, plan_run, **flags, savexlsx=False)
+            else:
+                start = time.perf_counter()
+                cleanResources.run_aws_cleanup(report_path, dry_run, **flags, full_sweep=True, savexlsx=False)
+            return time.perf_counter() - start
+        finally:
+            cleanResources.new_session = new_session
+
+    def _compare(self, result, previous, threshold):
+        '''
+        Print the result and its change since the previous one, changes above threshold percent are regressions
+        '''
+        line = (f"{result['case']:<10} {result['size']:>7}: {result['resources']} resources in {result['seconds']}s "
+                f"({result['resources_per_second']}/s), {result['api_calls']} API calls, "
+                f"peak {result['peak_memory_mb'] or '-'} MB, report written in {result['report_write_seconds']}s")
+        if not previous:
+            self.stdout.write(line + ', no previous result')
+            return
+
+        def change(key):
+            return (result[key] - previous[key]) * 100 / previous[key] if result[key] and previous[key] else 0
+
+        speed, memory, report = (change('resources_per_second'), change('peak_memory_mb'),
+                                 change('report_write_seconds'))
+        line += (f" | vs {previous.get('version') or previous['time']}: speed {speed:+.1f}%, memory {memory:+.1f}%, "
+                 f"report {report:+.1f}%")
+        if speed < -threshold or memory > threshold or report > threshold:
+            self.stdout.write(self.style.WARNING(line + ' REGRESSION'))
+        else:
+            self.stdout.write(self.style.SUCCESS(line))
+
+
+def _load_results(path):
+    '''
+    The last result of each (case, size, dry run, report format, latency) in the results file
+    '''
+    results = {}
+    if os.path.isfile(path):
+        with open(path) as file:
+            for line in file:
+                if line.strip():
+                    result = json.loads(line)
+                    results[(result['case'], result['size'], result['dry_run'], result.get('report_format', 'xlsx'),
+                             result.get('latency_ms', 0))] = result
+    return results
+
+
+def _save_result(path, result):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'a') as file:
+        file.write(json.dumps(result) + '\n')
+
+
+def _version():
+    '''
+    git commit of the code benchmarked, empty if not in a git checkout
+    '''
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=settings.BASE_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
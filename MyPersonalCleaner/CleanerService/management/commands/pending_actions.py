@@ -0,0 +1,26 @@
+'''
+What would be deleted or stopped, answered from the local inventory without calling AWS or Azure:
+    python manage.py pending_actions --account 123456789012 --type Snapshots
+'''
+from django.core.management.base import BaseCommand
+
+from CleanerService.inventoryStore import pending_actions
+
+
+class Command(BaseCommand):
+    help = 'List the resources the last scans decided to delete or stop and that are still there'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--account', help='AWS account id or Azure subscription id, all the accounts by default')
+        parser.add_argument('--type', dest='resource_type',
+                            help='resource type as in the report sheets, e.g. Snapshots, all the types by default')
+
+    def handle(self, *args, **options):
+        resources = pending_actions(options['account'], options['resource_type']).order_by(
+            'account', 'resource_type', 'region', 'resource_id').values_list(
+            'account', 'resource_type', 'region', 'resource_id', 'operation')
+        count = 0
+        for account, resource_type, region, resource_id, operation in resources.iterator():
+            self.stdout.write(f'{account}\t{resource_type}\t{region or "-"}\t{resource_id}\t{operation}')
+            count += 1
+        self.stdout.write(f'{count} pending actions')
@@ -0,0 +1,66 @@
+# Generated by Django 3.2.25 on 2026-10-18 15:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('CleanerService', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScanRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cloud', models.CharField(max_length=10)),
+                ('account', models.CharField(max_length=64)),
+                ('dry_run', models.BooleanField()),
+                ('started', models.DateTimeField()),
+                ('finished', models.DateTimeField()),
+                ('resource_count', models.IntegerField(default=0)),
+                ('changed_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='InventoryResource',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account', models.CharField(max_length=64)),
+                ('region', models.CharField(blank=True, max_length=32)),
+                ('resource_type', models.CharField(max_length=32)),
+                ('resource_id', models.CharField(max_length=255)),
+                ('data', models.JSONField()),
+                ('operation', models.CharField(max_length=32)),
+                ('fingerprint', models.CharField(max_length=40)),
+                ('gone', models.BooleanField(default=False)),
+                ('first_seen', models.DateTimeField()),
+                ('changed', models.DateTimeField()),
+                ('last_run', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='CleanerService.scanrun')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Decision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('operation', models.CharField(max_length=32)),
+                ('error', models.TextField(blank=True)),
+                ('resource', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='decisions', to='CleanerService.inventoryresource')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='decisions', to='CleanerService.scanrun')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='inventoryresource',
+            index=models.Index(fields=['account', 'resource_type', 'operation'], name='CleanerServ_account_1282f6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inventoryresource',
+            index=models.Index(fields=['resource_id'], name='CleanerServ_resourc_142f95_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='inventoryresource',
+            constraint=models.UniqueConstraint(fields=('account', 'region', 'resource_type', 'resource_id'), name='unique_inventory_resource'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.2.25 on 2026-10-18 15:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('CleanerService', '0002_inventory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='decision',
+            name='fingerprint',
+            field=models.CharField(blank=True, max_length=40),
+        ),
+        migrations.AddField(
+            model_name='scanrun',
+            name='job',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='scans', to='CleanerService.cleanupjob'),
+        ),
+        migrations.AddField(
+            model_name='scanrun',
+            name='target',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+    ]
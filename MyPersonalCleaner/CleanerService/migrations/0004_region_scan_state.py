@@ -0,0 +1,29 @@
+# Generated by Django 3.2.25 on 2026-10-18 15:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('CleanerService', '0003_plan_apply'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RegionScanState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account', models.CharField(max_length=64)),
+                ('resource_type', models.CharField(max_length=32)),
+                ('region', models.CharField(max_length=32)),
+                ('empty_scans', models.IntegerField(default=0)),
+                ('last_scan', models.DateTimeField()),
+                ('last_found', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='regionscanstate',
+            constraint=models.UniqueConstraint(fields=('account', 'resource_type', 'region'), name='unique_region_scan_state'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 15:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('CleanerService', '0004_region_scan_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cleanupjob',
+            name='owner',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
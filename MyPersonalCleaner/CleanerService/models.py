@@ -1,3 +1,109 @@
-from django.db import models
-
-# Create your models here.
+from django.db import models
+
+
+class CleanupJob(models.Model):
+    '''
+    A cleanup run submitted from the cleanup page, executed in the background by jobs.py
+    '''
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    params = models.JSONField()  # dry_run, account and targets as selected on the cleanup page
+    report_name = models.CharField(max_length=255)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    owner = models.CharField(max_length=64, blank=True)  # server process running the job, see jobs.process_id()
+
+    def can_apply(self):
+        '''
+        A finished dry run, its plan can be applied by a new job
+        '''
+        return self.status == self.DONE and bool(self.params.get('dry_run')) and not self.params.get('plan')
+
+    def __str__(self):
+        return f'Job {self.pk} ({self.status})'
+
+
+class ScanRun(models.Model):
+    '''
+    One scan of an account (a run_aws_cleanup() or clean_az_rg() call), written by inventoryStore.py
+    '''
+    cloud = models.CharField(max_length=10)  # aws / azure
+    account = models.CharField(max_length=64)  # AWS account id or Azure subscription id
+    target = models.CharField(max_length=32, blank=True)  # Main / Second, the account as selected for the job
+    job = models.ForeignKey(CleanupJob, on_delete=models.SET_NULL, null=True, blank=True, related_name='scans')
+    dry_run = models.BooleanField()
+    started = models.DateTimeField()
+    finished = models.DateTimeField()
+    resource_count = models.IntegerField(default=0)  # resources seen by the scan
+    changed_count = models.IntegerField(default=0)  # resources added, changed or gone since the previous scan
+
+    def __str__(self):
+        return f'Scan {self.pk} of {self.account}'
+
+
+class InventoryResource(models.Model):
+    '''
+    Last known state of a scanned resource, only written when its fingerprint changes between scans
+    '''
+    account = models.CharField(max_length=64)
+    region = models.CharField(max_length=32, blank=True)  # empty for global resources (S3 buckets)
+    resource_type = models.CharField(max_length=32)  # sheet name of the resource, e.g. Snapshots
+    resource_id = models.CharField(max_length=255)
+    data = models.JSONField()  # record fields, see resourceRecords.py
+    operation = models.CharField(max_length=32)  # decision of the last scan, e.g. Delete, keep
+    fingerprint = models.CharField(max_length=40)  # sha1 of data and operation
+    gone = models.BooleanField(default=False)  # not returned anymore by the last scan of its region
+    first_seen = models.DateTimeField()
+    changed = models.DateTimeField()
+    last_run = models.ForeignKey(ScanRun, on_delete=models.SET_NULL, null=True, related_name='+')  # last change
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['account', 'region', 'resource_type', 'resource_id'],
+                                               name='unique_inventory_resource')]
+        indexes = [models.Index(fields=['account', 'resource_type', 'operation']),
+                   models.Index(fields=['resource_id'])]
+
+    def __str__(self):
+        return f'{self.resource_type} {self.resource_id}'
+
+
+class Decision(models.Model):
+    '''
+    What a scan did (or would do in dry run) to a resource, only kept for the actions, not for kept resources.
+    The decisions of a dry run scan are the plan applied by an apply job
+    '''
+    run = models.ForeignKey(ScanRun, on_delete=models.CASCADE, related_name='decisions')
+    resource = models.ForeignKey(InventoryResource, on_delete=models.CASCADE, related_name='decisions')
+    operation = models.CharField(max_length=32)
+    fingerprint = models.CharField(max_length=40, blank=True)  # resource state when decided, see inventoryStore.py
+    error = models.TextField(blank=True)
+
+    def __str__(self):
+        return f'{self.operation} (scan {self.run_id})'
+
+
+class RegionScanState(models.Model):
+    '''
+    How many scans in a row found nothing for a cleaner in a region of an account,
+    regions empty on the last scans get a cheap probe instead of a full scan (see cleanResources._run_cleaners())
+    '''
+    account = models.CharField(max_length=64)
+    resource_type = models.CharField(max_length=32)  # sheet name of the cleaner, e.g. Volumes
+    region = models.CharField(max_length=32)
+    empty_scans = models.IntegerField(default=0)  # 0 if the last scan found resources
+    last_scan = models.DateTimeField()
+    last_found = models.DateTimeField(null=True, blank=True)  # last scan that found resources
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['account', 'resource_type', 'region'],
+                                               name='unique_region_scan_state')]
+
+    def __str__(self):
+        return f'{self.resource_type} {self.region} of {self.account}'
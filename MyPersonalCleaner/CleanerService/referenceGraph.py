@@ -0,0 +1,81 @@
+'''
+References between the EC2 resources of a region: the snapshots of each AMI (its block device mappings), the
+volumes of each instance and the volume each snapshot was taken from.
+The images cleaner fills it while it lists the AMIs of the region and handles the snapshots of the AMIs it
+deregisters, the snapshots cleaner of the region runs after it (see cleanResources._DEPENDS_ON) and skips the
+snapshots of the registered AMIs up front instead of failing with InvalidSnapshot.InUse.
+The EC2 cleaner adds the instances it lists, the snapshots cleaner lists them itself only when it needs the
+instance of a volume and the EC2 cleaner of the run did not list them.
+A graph is created per run and region (see cleanResources.run_aws_cleanup()), nothing is kept between runs.
+'''
+import threading
+
+
+class ReferenceGraph:
+
+    def __init__(self):
+        self.images_listed = False  # all the AMIs of the region were added
+        self.instances_listed = False  # all the instances of the region were added
+        self._image_snapshots = {}  # image id -> snapshot ids
+        self._snapshot_images = {}  # snapshot id -> image ids
+        self._volume_instances = {}  # volume id -> instance id
+        self._removed_images = set()  # deregistered by the run (or would be, in dry run)
+        self._handled_snapshots = set()  # reported with their AMI, the snapshots cleaner leaves them out
+        self._lock = threading.Lock()
+        self._list_lock = threading.Lock()  # the instances are listed once
+
+    def add_image(self, image_id, snapshot_ids):
+        with self._lock:
+            self._image_snapshots[image_id] = tuple(snapshot_ids)
+            for snapshot_id in snapshot_ids:
+                self._snapshot_images.setdefault(snapshot_id, []).append(image_id)
+
+    def add_instance(self, instance_id, volume_ids):
+        with self._lock:
+            for volume_id in volume_ids:
+                self._volume_instances[volume_id] = instance_id
+
+    def remove_image(self, image_id):
+        with self._lock:
+            self._removed_images.add(image_id)
+
+    def orphaned_snapshots(self):
+        '''
+        Snapshots of the removed AMIs that no registered AMI uses
+        :return: dict of snapshot id -> the removed AMI it belonged to
+        '''
+        with self._lock:
+            return {snapshot_id: image_id for image_id in sorted(self._removed_images)
+                    for snapshot_id in self._image_snapshots.get(image_id, ())
+                    if not self._registered_images(snapshot_id)}
+
+    def images_using(self, snapshot_id):
+        '''
+        The registered (not removed) AMIs using the snapshot
+        '''
+        with self._lock:
+            return self._registered_images(snapshot_id)
+
+    def volume_instance(self, volume_id, list_instances=None):
+        '''
+        The instance the volume is attached to
+        :param list_instances: called once if the instances were not added yet, yields (instance id, volume ids)
+        '''
+        if not self.instances_listed and list_instances is not None:
+            with self._list_lock:
+                if not self.instances_listed:
+                    for instance_id, volume_ids in list_instances():
+                        self.add_instance(instance_id, volume_ids)
+                    self.instances_listed = True
+        return self._volume_instances.get(volume_id)
+
+    def mark_handled(self, snapshot_id):
+        with self._lock:
+            self._handled_snapshots.add(snapshot_id)
+
+    def is_handled(self, snapshot_id):
+        return snapshot_id in self._handled_snapshots
+
+    def _registered_images(self, snapshot_id):
+        return [image_id for image_id in self._snapshot_images.get(snapshot_id, ())
+                if image_id not in self._removed_images]
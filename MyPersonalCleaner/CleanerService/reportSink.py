@@ -0,0 +1,175 @@
+import csv
+import io
+import json
+import threading
+import zipfile
+from openpyxl import Workbook
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # the parquet reports are only offered when pyarrow is installed
+    pyarrow = None
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# report format -> (suffix of the report file, content type), the format of a report follows its file name.
+# xlsx is capped at 1,048,576 rows per sheet, the other formats write one file per sheet (same columns) in a zip
+REPORT_FORMATS = {
+    'xlsx': ('.xlsx', XLSX_CONTENT_TYPE),
+    'jsonl': ('.jsonl.zip', 'application/zip'),
+    'csv': ('.csv.zip', 'application/zip'),
+    'parquet': ('.parquet.zip', 'application/zip'),
+}
+
+_reports = {}  # report file name -> ReportSink, one per run
+_reports_lock = threading.Lock()
+
+
+class ReportSink:
+    '''
+    Keep all the report rows of a run in memory (per sheet) and write the xlsx file once,
+    instead of loading and saving the whole workbook for every row
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.sheets = {}  # sheet title -> list of rows, first row is the header, order of insert is the sheet order
+        self._lock = threading.Lock()
+
+    def add_sheet(self, title, headers):
+        '''
+        Add a sheet with its header row, do nothing if the sheet already exist
+        '''
+        with self._lock:
+            if title not in self.sheets:
+                self.sheets[title] = [tuple(headers)]
+
+    def append(self, title, row):
+        '''
+        Buffer a single row for the sheet, nothing is written to disk until save()
+        '''
+        with self._lock:
+            self.sheets[title].append(tuple(row))
+
+    def extend(self, title, rows):
+        '''
+        Buffer the rows for the sheet, e.g. the rows of an account cleaned in a worker process
+        '''
+        with self._lock:
+            self.sheets[title].extend(tuple(row) for row in rows)
+
+    def save(self):
+        '''
+        Write all buffered sheets to the report file in one pass, in the format of its file name (see REPORT_FORMATS)
+        '''
+        with self._lock:
+            getattr(self, '_save_' + report_format(self.path))()
+
+    def _save_xlsx(self):
+        wb = Workbook(write_only=True)  # openpyxl write only mode
+        for title, rows in self.sheets.items():
+            ws = wb.create_sheet(title)
+            for row in rows:
+                ws.append(row)
+        wb.save(self.path)
+
+    def _save_jsonl(self):
+        '''
+        One object per row, keyed by the sheet header
+        '''
+        with zipfile.ZipFile(self.path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for title, rows in self.sheets.items():
+                with _zip_text(archive, title + '.jsonl') as file:
+                    for row in _padded(rows):
+                        file.write(json.dumps(dict(zip(rows[0], row)), default=str) + '\n')
+
+    def _save_csv(self):
+        with zipfile.ZipFile(self.path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for title, rows in self.sheets.items():
+                with _zip_text(archive, title + '.csv') as file:
+                    csv.writer(file).writerows(rows)
+
+    def _save_parquet(self):
+        if pyarrow is None:
+            raise ValueError('The parquet reports need pyarrow, pip install pyarrow')
+        # parquet pages are compressed already
+        with zipfile.ZipFile(self.path, 'w', zipfile.ZIP_STORED) as archive:
+            for title, rows in self.sheets.items():
+                columns = list(zip(*_padded(rows))) or [()] * len(rows[0])
+                table = pyarrow.Table.from_arrays([_arrow_array(column) for column in columns], names=list(rows[0]))
+                with archive.open(_entry_name(title + '.parquet'), 'w', force_zip64=True) as file:
+                    pyarrow.parquet.write_table(table, file)
+
+
+def report_format(path):
+    '''
+    Format of the report file, from its suffix, xlsx when the suffix is not one of REPORT_FORMATS
+    '''
+    for name, (suffix, content_type) in REPORT_FORMATS.items():
+        if str(path).endswith(suffix):
+            return name
+    return 'xlsx'
+
+
+def available_formats():
+    '''
+    The report formats that can be selected, parquet needs pyarrow
+    '''
+    return [name for name in REPORT_FORMATS if name != 'parquet' or pyarrow is not None]
+
+
+def _entry_name(name):
+    return name.replace('/', '_').replace('\\', '_')
+
+
+def _zip_text(archive, name):
+    '''
+    Text file written in the zip as it goes, the rows are never joined in memory
+    '''
+    return io.TextIOWrapper(archive.open(_entry_name(name), 'w', force_zip64=True), encoding='utf-8', newline='')
+
+
+def _padded(rows):
+    '''
+    The rows of a sheet after its header, the short ones (e.g. the EC2 error rows) padded with None to the header
+    '''
+    width = len(rows[0])
+    return [row + (None,) * (width - len(row)) if len(row) < width else row for row in rows[1:]]
+
+
+def _arrow_array(values):
+    '''
+    Column of a parquet sheet, typed by pyarrow, as strings when the values are of mixed types
+    '''
+    try:
+        return pyarrow.array(values)
+    except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+        return pyarrow.array([None if value is None else str(value) for value in values], pyarrow.string())
+
+
+def create_report(path):
+    '''
+    Start a new empty report for the file name, replace any report already open for it
+    '''
+    with _reports_lock:
+        _reports[path] = ReportSink(path)
+        return _reports[path]
+
+
+def get_report(path):
+    '''
+    Return the report open for the file name, create it if needed
+    '''
+    with _reports_lock:
+        if path not in _reports:
+            _reports[path] = ReportSink(path)
+        return _reports[path]
+
+
+def close_report(path):
+    '''
+    Release the buffered rows of the report, the file itself is not touched
+    '''
+    with _reports_lock:
+        _reports.pop(path, None)
@@ -0,0 +1,272 @@
+'''
+Compact records of the resources found by the cleaners, only the fields needed to decide what to do with the
+resource and to report it are kept, the botocore response dicts are dropped as soon as the record is built.
+__slots__ is set by hand (dataclass(slots=True) needs python 3.10) so the fields can't have defaults,
+use the from_api() constructors.
+Each record class has a kind (its report sheet), id_field (the field holding the resource id) and created_field
+(its creation time, None if the API doesn't return one) used by cleanupPolicy.
+'''
+import sys
+from dataclasses import dataclass
+
+
+def tags_from_list(tag_list):
+    '''
+    Convert AWS [{'Key': .., 'Value': ..}] tags to a dict, keys are interned as the same few keys (keep,
+    keep_state, Name..) repeat on every resource
+    :return: dict of tags, None if the resource has no tags
+    '''
+    if not tag_list:
+        return None
+    return {sys.intern(tag.get('Key')): tag.get('Value') for tag in tag_list}
+
+
+def _cell(value, empty='None'):
+    '''
+    Report cell of an optional value (tags, error)
+    '''
+    return str(value) if value is not None else empty
+
+
+def _age(age):
+    '''
+    Report cell of the resource age in days, only set in keeptag_withdate mode
+    '''
+    return age if age is not None else 'N/A'
+
+
+@dataclass
+class Ec2Record:
+    kind = 'EC2'  # report sheet / inventory resource type
+    id_field = 'instance_id'
+    created_field = 'launch_time'
+    __slots__ = ('instance_id', 'instance_type', 'availability_zone', 'state', 'volumes', 'launch_time',
+                 'region', 'account', 'tags', 'operation', 'age')
+    instance_id: str
+    instance_type: str
+    availability_zone: str
+    state: str
+    volumes: tuple  # (volume id, attachment status)
+    launch_time: object
+    region: str
+    account: str
+    tags: dict
+    operation: str
+    age: int
+
+    @classmethod
+    def from_api(cls, instance, region, account):
+        return cls(instance['InstanceId'], instance['InstanceType'], instance['Placement']['AvailabilityZone'],
+                   instance['State']['Name'],
+                   tuple((bdm['Ebs']['VolumeId'], bdm['Ebs']['Status']) for bdm in instance['BlockDeviceMappings']
+                         if 'Ebs' in bdm),
+                   instance['LaunchTime'], region, account, tags_from_list(instance.get('Tags')), 'keep', None)
+
+    def row(self):
+        volume_list = ''.join(f"{volume_id}({status}),  " for volume_id, status in self.volumes)
+        return (self.operation, _age(self.age), self.instance_id, self.instance_type, self.availability_zone,
+                self.state, volume_list, self.account, _cell(self.tags, 'N/A'))
+
+
+@dataclass
+class VolumeRecord:
+    kind = 'Volumes'  # report sheet / inventory resource type
+    id_field = 'volume_id'
+    created_field = 'create_time'
+    __slots__ = ('volume_id', 'availability_zone', 'state', 'volume_type', 'size', 'iops', 'create_time',
+                 'region', 'account', 'tags', 'operation', 'age', 'error')
+    volume_id: str
+    availability_zone: str
+    state: str
+    volume_type: str
+    size: int
+    iops: int
+    create_time: object
+    region: str
+    account: str
+    tags: dict
+    operation: str
+    age: int
+    error: object
+
+    @classmethod
+    def from_api(cls, volume, region, account):
+        return cls(volume['VolumeId'], volume['AvailabilityZone'], volume['State'], volume['VolumeType'],
+                   volume['Size'], volume.get('Iops'), volume['CreateTime'], region, account,
+                   tags_from_list(volume.get('Tags')), 'Keep', None, None)
+
+    def row(self):
+        return (self.operation, _age(self.age), self.volume_id, self.availability_zone, self.state,
+                self.volume_type, self.size, self.iops, self.account, _cell(self.tags), _cell(self.error))
+
+
+@dataclass
+class ImageRecord:
+    kind = 'Images'  # report sheet / inventory resource type
+    id_field = 'image_id'
+    created_field = 'creation_date'
+    __slots__ = ('image_id', 'name', 'image_type', 'creation_date', 'snapshots', 'region', 'account', 'tags',
+                 'operation', 'age', 'error')
+    image_id: str
+    name: str
+    image_type: str
+    creation_date: str
+    snapshots: tuple  # snapshot ids of the block device mappings
+    region: str
+    account: str
+    tags: dict
+    operation: str
+    age: int
+    error: object
+
+    @classmethod
+    def from_api(cls, image, region, account):
+        return cls(image['ImageId'], image.get('Name'), image['ImageType'], image['CreationDate'],
+                   tuple(bdm['Ebs']['SnapshotId'] for bdm in image.get('BlockDeviceMappings', [])
+                         if bdm.get('Ebs', {}).get('SnapshotId')),
+                   region, account, tags_from_list(image.get('Tags')), 'Keep', None, None)
+
+    def row(self):
+        return (self.operation, _age(self.age), self.image_id, self.name, self.region, self.account,
+                self.image_type, self.creation_date, ', '.join(self.snapshots), _cell(self.tags), _cell(self.error))
+
+
+@dataclass
+class SnapshotRecord:
+    kind = 'Snapshots'  # report sheet / inventory resource type
+    id_field = 'snapshot_id'
+    created_field = 'start_time'
+    __slots__ = ('snapshot_id', 'volume_id', 'volume_size', 'start_time', 'region', 'account', 'tags',
+                 'operation', 'age', 'error', 'used_by')
+    snapshot_id: str
+    volume_id: str
+    volume_size: int
+    start_time: object
+    region: str
+    account: str
+    tags: dict
+    operation: str
+    age: int
+    error: object
+    used_by: str  # AMIs or instance using the snapshot, see referenceGraph.py
+
+    @classmethod
+    def from_api(cls, snap, region, account):
+        return cls(snap['SnapshotId'], snap['VolumeId'], snap['VolumeSize'], snap['StartTime'], region, account,
+                   tags_from_list(snap.get('Tags')), 'keep', None, None, '')
+
+    def row(self):
+        return (self.operation, _age(self.age), self.snapshot_id, self.volume_id, self.region, self.account,
+                _cell(self.tags), self.used_by, _cell(self.error))
+
+
+@dataclass
+class SecurityGroupRecord:
+    kind = 'SG'  # report sheet / inventory resource type
+    id_field = 'group_id'
+    created_field = None
+    __slots__ = ('group_id', 'group_name', 'vpc_id', 'region', 'account', 'instances', 'tags', 'operation',
+                 'error')
+    group_id: str
+    group_name: str
+    vpc_id: str
+    region: str
+    account: str
+    instances: str
+    tags: dict
+    operation: str
+    error: object
+
+    @classmethod
+    def from_api(cls, sg, region, account):
+        return cls(sg['GroupId'], sg['GroupName'], sg.get('VpcId'), region, account, 'N/A',
+                   tags_from_list(sg.get('Tags')), 'N/A', None)
+
+    def row(self):
+        return (self.operation, self.group_id, self.group_name, self.account, self.region, self.vpc_id,
+                self.instances, _cell(self.tags), _cell(self.error))
+
+
+@dataclass
+class DBInstanceRecord:
+    kind = 'RDS Instances'  # report sheet / inventory resource type
+    id_field = 'db_instance_id'
+    created_field = 'create_time'
+    __slots__ = ('db_instance_id', 'status', 'instance_class', 'allocated_storage', 'backups', 'create_time',
+                 'region', 'account', 'tags', 'operation', 'age', 'error')
+    db_instance_id: str
+    status: str
+    instance_class: str
+    allocated_storage: int
+    backups: str  # Enable / Disable, automatic backups
+    create_time: object
+    region: str
+    account: str
+    tags: dict
+    operation: str
+    age: int
+    error: object
+
+    @classmethod
+    def from_api(cls, db, region, account):
+        return cls(db['DBInstanceIdentifier'], db['DBInstanceStatus'], db['DBInstanceClass'],
+                   db['AllocatedStorage'], 'Disable' if db['BackupRetentionPeriod'] == 0 else 'Enable',
+                   db['InstanceCreateTime'], region, account, tags_from_list(db.get('TagList')), 'DoNothing', None,
+                   None)
+
+    def row(self):
+        return (self.operation, _age(self.age), self.region, self.db_instance_id, self.status,
+                self.instance_class, self.allocated_storage, self.backups, self.account, _cell(self.tags),
+                _cell(self.error))
+
+
+@dataclass
+class DBSnapshotRecord:
+    kind = 'RDS Snapshots'  # report sheet / inventory resource type
+    id_field = 'snapshot_id'
+    created_field = 'create_time'
+    __slots__ = ('snapshot_id', 'db_instance_id', 'snapshot_type', 'create_time', 'region', 'account', 'tags',
+                 'operation', 'age', 'error')
+    snapshot_id: str
+    db_instance_id: str
+    snapshot_type: str
+    create_time: object
+    region: str
+    account: str
+    tags: dict
+    operation: str
+    age: int
+    error: object
+
+    @classmethod
+    def from_api(cls, db_snap, region, account):
+        return cls(db_snap['DBSnapshotIdentifier'], db_snap['DBInstanceIdentifier'], db_snap['SnapshotType'],
+                   db_snap.get('SnapshotCreateTime'), region, account, tags_from_list(db_snap.get('TagList')),
+                   'Ignore', None, None)
+
+    def row(self):
+        return (self.operation, _age(self.age), self.region, self.snapshot_id, self.db_instance_id,
+                self.snapshot_type, self.account, _cell(self.tags), _cell(self.error))
+
+
+@dataclass
+class BucketRecord:
+    kind = 'S3 Objects'  # report sheet / inventory resource type
+    id_field = 'name'
+    created_field = None
+    __slots__ = ('name', 'account', 'tags', 'key_count', 'fail_count', 'operation', 'error')
+    name: str
+    account: str
+    tags: dict
+    key_count: int
+    fail_count: int
+    operation: str
+    error: object
+
+    @classmethod
+    def from_api(cls, bucket, account):
+        return cls(bucket['Name'], account, None, 0, 0, 'N/A', None)
+
+    def row(self):
+        return (self.operation, self.name, _cell(self.tags, '[]'), str(self.key_count), str(self.fail_count),
+                self.account, _cell(self.error))
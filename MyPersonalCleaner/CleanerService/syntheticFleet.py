@@ -0,0 +1,347 @@
+'''
+Synthetic AWS fleet for the benchmark command, a botocore before-call handler answers the calls of the cleaners
+from generated resources so no request leaves the process. It works like botocore Stubber but the responses are
+built from the call parameters (pagination, filters, ids) instead of a queue, so the cleaners run unchanged on
+their region threads and delete workers.
+The resources are generated page by page from their index, only the ids deleted by the run are kept.
+'''
+import datetime
+import threading
+import time
+
+import boto3
+from botocore import xform_name
+from botocore.awsrequest import AWSResponse
+
+CREATED = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+DRY_RUN_MESSAGE = 'Request would have succeeded, but DryRun flag is set.'
+
+
+class FleetError(Exception):
+    '''
+    Error response of a synthetic call, raised by the handlers
+    '''
+
+    def __init__(self, code, status=400):
+        super().__init__(code)
+        self.code = code
+        self.status = status
+
+
+def _tags(resource_id, i):
+    '''
+    Same mix of tags for all the resource types: untagged, kept, tagged without keep, kept with keep_state
+    '''
+    kind = i % 4
+    if kind == 0:
+        return []
+    if kind == 1:
+        return [{'Key': 'keep', 'Value': resource_id}]
+    if kind == 2:
+        return [{'Key': 'Name', 'Value': f'bench-{i}'}]
+    return [{'Key': 'keep', 'Value': resource_id}, {'Key': 'keep_state', 'Value': 'on'}]
+
+
+def _filter_values(params, name):
+    for f in params.get('Filters', []):
+        if f['Name'] == name:
+            return f['Values']
+    return None
+
+
+def _index(resource_id):
+    '''
+    Index of a generated resource from its id: vol-<region:2 hex><index:15 hex> or bench-db-<region>-<index>
+    '''
+    suffix = resource_id.rsplit('-', 1)[1]
+    return int(suffix) if resource_id.startswith('bench-') else int(suffix[2:], 16)
+
+
+class SyntheticFleet:
+    '''
+    size resources of each type (instances, volumes, snapshots, images, SGs, RDS instances and snapshots) spread
+    over the regions, plus size buckets of objects_per_bucket objects
+    :param latency: seconds each call takes, like the round trip to AWS
+    '''
+
+    def __init__(self, regions, size, objects_per_bucket=10, latency=0):
+        self.regions = {region: index for index, region in enumerate(regions)}
+        self.size = size
+        self.per_region = -(-size // len(regions))
+        self.objects_per_bucket = objects_per_bucket
+        self.latency = latency
+        self._gone = set()  # ids deleted by the run
+        self._instance_state = {}  # instance id -> state changed by the run
+        self._lock = threading.Lock()
+
+    def session(self):
+        '''
+        boto3 session whose clients are answered by the fleet
+        '''
+        session = boto3.session.Session(aws_access_key_id='benchmark', aws_secret_access_key='benchmark',
+                                        region_name=next(iter(self.regions)))
+        session.events.register('before-parameter-build', self._keep_params)
+        # last, the other before-call handlers (ApiMetrics) still see the calls
+        session.events.register_last('before-call', self.handle)
+        return session
+
+    def _keep_params(self, params, context, **kwargs):
+        # before-call only gets the serialized request, keep the call parameters for it like Stubber does
+        context['fleet_params'] = params
+
+    def handle(self, model, context, request_signer, **kwargs):
+        '''
+        before-call handler, return the (http response, parsed response) of the call
+        '''
+        handler = getattr(self, '_' + xform_name(model.name), None)
+        if self.latency:
+            time.sleep(self.latency)
+        try:
+            if handler is None:  # never let a call go to AWS
+                raise FleetError('UnsupportedOperation')
+            parsed = handler(request_signer.region_name, context.get('fleet_params', {}))
+            status = 200
+        except FleetError as e:
+            parsed = {'Error': {'Code': e.code, 'Message': DRY_RUN_MESSAGE if e.code == 'DryRunOperation' else e.code}}
+            status = e.status
+        parsed['ResponseMetadata'] = {'HTTPStatusCode': status, 'RetryAttempts': 0}
+        return AWSResponse(None, status, {}, None), parsed
+
+    def _page(self, make, params, token='NextToken', limit='MaxResults', next_token=None, count=None):
+        '''
+        One page of the resources 0..count-1 of a region, make() returns None for the deleted/filtered ones
+        :return: (list of resources, dict with the next page token when there are more)
+        '''
+        count = self.per_region if count is None else count
+        start = int(params.get(token) or 0)
+        end = min(count, start + params.get(limit, count))
+        items = [item for item in map(make, range(start, end)) if item is not None]
+        return items, ({next_token or token: str(end)} if end < count else {})
+
+    def _by_ids(self, make, resource_ids):
+        '''
+        The resources of an id filter (read by id, e.g. the apply of a plan), the deleted ones are missing
+        '''
+        items = (make(_index(resource_id)) for resource_id in resource_ids)
+        return [item for item in items if item is not None]
+
+    def _delete(self, resource_id, dry_run=False):
+        if dry_run:
+            raise FleetError('DryRunOperation', 412)
+        with self._lock:
+            if resource_id in self._gone:
+                raise FleetError('InvalidID.NotFound')
+            self._gone.add(resource_id)
+        return {}
+
+    # EC2
+
+    def _instance(self, r, i):
+        instance_id = f'i-{r:02x}{i:015x}'
+        state = self._instance_state.get(instance_id, 'stopped' if i % 10 == 9 else 'running')
+        return {'InstanceId': instance_id, 'InstanceType': 't3.micro', 'State': {'Name': state},
+                'Placement': {'AvailabilityZone': 'bench-1a'}, 'LaunchTime': CREATED,
+                'BlockDeviceMappings': [{'DeviceName': '/dev/xvda',
+                                         'Ebs': {'VolumeId': f'vol-{r:02x}{i:015x}', 'Status': 'attached'}}],
+                'SecurityGroups': [{'GroupId': f'sg-{r:02x}{i * 2 % self.per_region:015x}'}],
+                'Tags': _tags(instance_id, i)}
+
+    def _describe_instances(self, region, params):
+        r = self.regions[region]
+        instance_ids = params.get('InstanceIds') or _filter_values(params, 'instance-id')
+        if instance_ids:  # read by id, the terminated instances poll and the apply
+            instances = [self._instance(r, _index(instance_id)) for instance_id in instance_ids]
+            return {'Reservations': [{'ReservationId': 'r-bench', 'Instances': instances}]}
+
+        states = _filter_values(params, 'instance-state-name')
+
+        def make(i):
+            instance = self._instance(r, i)
+            if states is None or instance['State']['Name'] in states:
+                return {'ReservationId': f'r-{r:02x}{i:015x}', 'Instances': [instance]}
+
+        reservations, more = self._page(make, params)
+        return dict(more, Reservations=reservations)
+
+    def _change_instances(self, params, state):
+        if params.get('DryRun'):
+            raise FleetError('DryRunOperation', 412)
+        with self._lock:
+            for instance_id in params['InstanceIds']:
+                self._instance_state[instance_id] = state
+        return {}
+
+    def _terminate_instances(self, region, params):
+        return self._change_instances(params, 'terminated')
+
+    def _stop_instances(self, region, params):
+        return self._change_instances(params, 'stopped')
+
+    def _describe_volumes(self, region, params):
+        r = self.regions[region]
+        statuses = _filter_values(params, 'status')
+
+        def make(i):
+            volume_id = f'vol-{r:02x}{i:015x}'
+            state = 'in-use' if i % 5 == 0 else 'available'
+            if volume_id in self._gone or (statuses is not None and state not in statuses):
+                return None
+            return {'VolumeId': volume_id, 'AvailabilityZone': 'bench-1a', 'State': state, 'VolumeType': 'gp2',
+                    'Size': 8, 'Iops': 100, 'CreateTime': CREATED, 'Tags': _tags(volume_id, i)}
+
+        volume_ids = _filter_values(params, 'volume-id')
+        if volume_ids:  # read by id, the apply
+            return {'Volumes': self._by_ids(make, volume_ids)}
+        volumes, more = self._page(make, params)
+        return dict(more, Volumes=volumes)
+
+    def _delete_volume(self, region, params):
+        return self._delete(params['VolumeId'], params.get('DryRun'))
+
+    def _describe_snapshots(self, region, params):
+        r = self.regions[region]
+
+        def make(i):
+            snapshot_id = f'snap-{r:02x}{i:015x}'
+            if snapshot_id in self._gone:
+                return None
+            return {'SnapshotId': snapshot_id, 'VolumeId': f'vol-{r:02x}{i:015x}', 'VolumeSize': 8,
+                    'StartTime': CREATED, 'State': 'completed', 'Tags': _tags(snapshot_id, i)}
+
+        snapshot_ids = _filter_values(params, 'snapshot-id')
+        if snapshot_ids:  # read by id, the snapshots of the deregistered AMIs and the apply
+            return {'Snapshots': self._by_ids(make, snapshot_ids)}
+        snapshots, more = self._page(make, params)
+        return dict(more, Snapshots=snapshots)
+
+    def _delete_snapshot(self, region, params):
+        return self._delete(params['SnapshotId'], params.get('DryRun'))
+
+    def _describe_images(self, region, params):
+        r = self.regions[region]
+
+        def make(i):
+            image_id = f'ami-{r:02x}{i:015x}'
+            if image_id in self._gone:
+                return None
+            # every other AMI is backed by the snapshot of the same index
+            mappings = ([{'DeviceName': '/dev/xvda', 'Ebs': {'SnapshotId': f'snap-{r:02x}{i:015x}'}}]
+                        if i % 2 == 0 else [])
+            return {'ImageId': image_id, 'Name': f'bench-{i}', 'ImageType': 'machine',
+                    'CreationDate': '2020-01-01T00:00:00.000Z', 'BlockDeviceMappings': mappings,
+                    'Tags': _tags(image_id, i)}
+
+        image_ids = _filter_values(params, 'image-id')
+        if image_ids:  # read by id, the apply
+            return {'Images': self._by_ids(make, image_ids)}
+        images, more = self._page(make, params)
+        return dict(more, Images=images)
+
+    def _deregister_image(self, region, params):
+        return self._delete(params['ImageId'], params.get('DryRun'))
+
+    def _describe_security_groups(self, region, params):
+        r = self.regions[region]
+
+        def make(i):
+            group_id = f'sg-{r:02x}{i:015x}'
+            if group_id in self._gone:
+                return None
+            return {'GroupId': group_id, 'GroupName': 'default' if i == 0 else f'bench-{i}', 'VpcId': 'vpc-bench',
+                    'Tags': _tags(group_id, i)}
+
+        group_ids = _filter_values(params, 'group-id')
+        if group_ids:  # read by id, the apply
+            return {'SecurityGroups': self._by_ids(make, group_ids)}
+        groups, more = self._page(make, params)
+        return dict(more, SecurityGroups=groups)
+
+    def _delete_security_group(self, region, params):
+        return self._delete(params['GroupId'], params.get('DryRun'))
+
+    def _describe_network_interfaces(self, region, params):
+        r = self.regions[region]
+
+        def make(i):  # one ENI (e.g. a lambda) for every third SG
+            return {'NetworkInterfaceId': f'eni-{r:02x}{i:015x}', 'InterfaceType': 'lambda',
+                    'Groups': [{'GroupId': f'sg-{r:02x}{i * 3 + 1:015x}'}]}
+
+        interfaces, more = self._page(make, params, count=self.per_region // 3)
+        return dict(more, NetworkInterfaces=interfaces)
+
+    def _describe_regions(self, region, params):
+        return {'Regions': [{'RegionName': name} for name in self.regions]}
+
+    # RDS
+
+    def _describe_db_instances(self, region, params):
+        r = self.regions[region]
+
+        def make(i):
+            db_id = f'bench-db-{r}-{i}'
+            if db_id in self._gone:
+                return None
+            return {'DBInstanceIdentifier': db_id, 'DBInstanceStatus': 'available', 'DBInstanceClass': 'db.t3.micro',
+                    'AllocatedStorage': 20, 'BackupRetentionPeriod': i % 2 * 7, 'InstanceCreateTime': CREATED,
+                    'TagList': _tags(db_id, i)}
+
+        db_ids = _filter_values(params, 'db-instance-id')
+        if db_ids:  # read by id, the apply
+            return {'DBInstances': self._by_ids(make, db_ids)}
+        databases, more = self._page(make, params, 'Marker', 'MaxRecords')
+        return dict(more, DBInstances=databases)
+
+    def _delete_db_instance(self, region, params):
+        return self._delete(params['DBInstanceIdentifier'])
+
+    def _stop_db_instance(self, region, params):
+        return {}
+
+    def _describe_db_snapshots(self, region, params):
+        r = self.regions[region]
+
+        def make(i):
+            snapshot_id = f'bench-db-snap-{r}-{i}'
+            if snapshot_id in self._gone:
+                return None
+            return {'DBSnapshotIdentifier': snapshot_id, 'DBInstanceIdentifier': f'bench-db-{r}-{i}',
+                    'SnapshotType': 'manual', 'SnapshotCreateTime': CREATED, 'TagList': _tags(snapshot_id, i)}
+
+        snapshot_ids = _filter_values(params, 'db-snapshot-id')
+        if snapshot_ids:  # read by id, the apply
+            return {'DBSnapshots': self._by_ids(make, snapshot_ids)}
+        snapshots, more = self._page(make, params, 'Marker', 'MaxRecords')
+        return dict(more, DBSnapshots=snapshots)
+
+    def _delete_db_snapshot(self, region, params):
+        return self._delete(params['DBSnapshotIdentifier'])
+
+    # S3, the buckets are global
+
+    def _list_buckets(self, region, params):
+        return {'Buckets': [{'Name': f'bench-bucket-{i}', 'CreationDate': CREATED} for i in range(self.size)]}
+
+    def _get_bucket_tagging(self, region, params):
+        i = int(params['Bucket'].rsplit('-', 1)[1])
+        tags = _tags(params['Bucket'], i)
+        if not tags:
+            raise FleetError('NoSuchTagSet', 404)
+        return {'TagSet': tags}
+
+    def _get_bucket_versioning(self, region, params):
+        return {}
+
+    def _list_objects_v2(self, region, params):
+        bucket = params['Bucket']
+
+        def make(k):
+            return None if bucket in self._gone else {'Key': f'object-{k}', 'Size': 1}
+
+        objects, more = self._page(make, params, 'ContinuationToken', 'MaxKeys', 'NextContinuationToken',
+                                   self.objects_per_bucket)
+        return dict(more, Contents=objects, KeyCount=len(objects), IsTruncated=bool(more))
+
+    def _delete_objects(self, region, params):
+        with self._lock:  # the whole bucket is emptied by its last batch, good enough for the benchmark
+            self._gone.add(params['Bucket'])
+        return {}
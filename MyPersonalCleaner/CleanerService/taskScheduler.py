@@ -0,0 +1,121 @@
+'''
+Run the (cleaner, region) tasks of a cleanup on a bounded thread pool, in dependency order: a task starts as soon
+as the tasks it depends on are done, e.g. the volumes of a region are scanned once its instances are terminated
+while the other regions and cleaners keep going.
+A task waiting for AWS (instances terminating) returns a Pending result instead of blocking its thread, the
+scheduler calls the poll functions of all the pending tasks every poll_seconds.
+'''
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+class Pending:
+    '''
+    Result of a task that is only done once poll() returns True, e.g. the instances it terminated are gone
+    :param result: the task result, returned by TaskScheduler.run() once poll() returned True
+    :param poll: function without arguments, called by the scheduler thread, it must not block
+    '''
+
+    def __init__(self, result, poll):
+        self.result = result
+        self.poll = poll
+
+
+class DependencyFailed(Exception):
+    '''
+    Error of a task that was not run because a task it depends on failed
+    '''
+
+
+class TaskScheduler:
+    '''
+    DAG of tasks run on `workers` threads:
+
+        scheduler = TaskScheduler(4)
+        scheduler.add(('EC2', 'us-east-1'), clean_ec2_region)
+        scheduler.add(('Volumes', 'us-east-1'), clean_volumes_region, after=[('EC2', 'us-east-1')])
+        for key, (result, error) in scheduler.run().items():
+            ...
+    '''
+
+    def __init__(self, workers, poll_seconds=15, thread_name_prefix='region'):
+        self.workers = workers
+        self.poll_seconds = poll_seconds
+        self.thread_name_prefix = thread_name_prefix
+        self._tasks = {}  # key -> (run, keys of the tasks to wait for), in add order
+
+    def add(self, key, run, after=()):
+        '''
+        :param key: id of the task, e.g. (sheet, region)
+        :param run: function without arguments, returns the task result or a Pending
+        :param after: keys of the tasks that must be done first, keys that are not tasks of the run are ignored
+        '''
+        self._tasks[key] = (run, tuple(after))
+
+    def run(self):
+        '''
+        Run all the tasks, a task failing doesn't stop the others but the tasks depending on it are not run
+        :return: dict of key -> (result, exception or None), in add order
+        '''
+        done = {}
+        waiting = {key: {dep for dep in after if dep in self._tasks} for key, (run, after) in self._tasks.items()}
+        running = {}  # future -> key
+        pending = {}  # key -> Pending
+        next_poll = None
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.thread_name_prefix) as pool:
+            while waiting or running or pending:
+                eligible = [key for key, deps in waiting.items() if deps <= done.keys()]
+                for key in eligible:
+                    del waiting[key]
+                    failed = [dep for dep in self._tasks[key][1] if dep in done and done[dep][1] is not None]
+                    if failed:
+                        done[key] = (None, DependencyFailed(f'{key} not run, {failed[0]} failed'))
+                    else:
+                        running[pool.submit(self._tasks[key][0])] = key
+                if not running and not pending:
+                    if waiting and not eligible:
+                        raise ValueError(f'the tasks {list(waiting)} depend on each other')
+                    continue  # tasks made eligible by the tasks that just failed
+
+                timeout = max(0, next_poll - time.monotonic()) if pending else None
+                if running:
+                    finished, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                else:
+                    time.sleep(timeout)
+                    finished = ()
+
+                for future in finished:
+                    key = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        done[key] = (None, e)
+                        continue
+                    if not isinstance(result, Pending):
+                        done[key] = (result, None)
+                    elif not self._poll(key, result, done):  # polled once right away, it may be done already
+                        pending[key] = result
+                        next_poll = next_poll or time.monotonic() + self.poll_seconds
+
+                if pending and time.monotonic() >= next_poll:
+                    for key, task in list(pending.items()):
+                        if self._poll(key, task, done):
+                            del pending[key]
+                    next_poll = time.monotonic() + self.poll_seconds if pending else None
+
+        return {key: done[key] for key in self._tasks}
+
+    def _poll(self, key, task, done):
+        '''
+        Poll the pending task, add it to done if it is
+        :return: True if the task is done, a poll function raising fails the task
+        '''
+        try:
+            if not task.poll():
+                return False
+        except Exception as e:
+            done[key] = (task.result, e)
+        else:
+            done[key] = (task.result, None)
+        return True
@@ -1,3 +1,775 @@
-from django.test import TestCase
-
-# Create your tests here.
+import dataclasses
+import datetime
+import io
+import json
+import logging
+import os
+import queue
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+
+import boto3
+from botocore.exceptions import ClientError, EndpointConnectionError
+from botocore.stub import Stubber
+from django.core.management import call_command
+from django.test import TestCase, SimpleTestCase, override_settings
+from django.urls import reverse
+
+from . import accountWorker, cleanResources, cleanerLogging
+from .cleanResources import RegionTaskError
+from .cleanerConfig import load_config, ConfigError
+from .cleanupPolicy import CleanupPolicy, RULES, KEEP, DELETE, STOP, KEEP_AGE
+from .deleteExecutor import DeleteExecutor
+from .jobs import recover_jobs, process_id, report_path, expire_reports, _run_accounts
+from .models import CleanupJob, ScanRun, Decision, InventoryResource
+from . import reportSink
+from .reportSink import get_report, close_report, create_report
+from .resourceRecords import VolumeRecord
+from .syntheticFleet import SyntheticFleet, FleetError
+from .taskScheduler import TaskScheduler, Pending, DependencyFailed
+
+# config.txt of the first release, before the worker / timeout / organizations options were added
+FIRST_RELEASE_CONFIG = '''
+[general]
+aws_regions_all = false
+aws_regions = us-east-1, us-east-2
+logs_console = false
+logs_file = false
+
+[aws_details]
+aws_account = 1234567
+
+[aws_details_2nd]
+aws_account = 6543321
+role_to_assume = arn:aws:iam::6543321:role/Cleaner
+
+[azure_details]
+client_secret = 1
+client_id = 2
+tenant_id = 3
+subscription_id = 4
+
+[cleanup]
+time = 3
+ec2 = keeptag
+volumes = keeptag
+snapshots = keeptag
+images = keeptag
+sg = keeptag
+rds = keeptag
+rds_snaps = keeptag
+s3_objects = keeptag
+azure_rg = keeptag
+'''
+
+
+def first_release_config(directory):
+    '''
+    CleanerConfig of FIRST_RELEASE_CONFIG (regions us-east-1 and us-east-2), written to the directory
+    '''
+    path = os.path.join(directory, 'config.txt')
+    with open(path, 'w') as file:
+        file.write(FIRST_RELEASE_CONFIG)
+    return load_config(path)
+
+
+class ConfigTests(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, 'config.txt')
+
+    def write(self, text):
+        with open(self.path, 'w') as file:
+            file.write(text)
+
+    def test_first_release_config_gets_the_defaults(self):
+        self.write(FIRST_RELEASE_CONFIG)
+        config = load_config(self.path)
+        self.assertEqual(config.aws_region_workers, 4)
+        self.assertEqual(config.s3_bucket_workers, 4)
+        self.assertEqual(config.delete_workers, 10)
+        self.assertEqual(config.empty_region_scans, 0)
+        self.assertEqual(config.aws_account_workers, 4)
+        self.assertEqual(config.organizations_role, '')
+        self.assertEqual(config.azure_delete_timeout, 3600)
+
+    def test_missing_required_option(self):
+        self.write(FIRST_RELEASE_CONFIG.replace('aws_account = 1234567\n', ''))
+        with self.assertRaisesMessage(ConfigError, '[aws_details] aws_account is missing'):
+            load_config(self.path)
+
+    def test_configurations_page_with_first_release_config(self):
+        self.write(FIRST_RELEASE_CONFIG)
+        cwd = os.getcwd()
+        os.chdir(self.directory.name)  # the views read config.txt of the working directory
+        self.addCleanup(os.chdir, cwd)
+        response = self.client.get(reverse('configurations'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['config']['delete_workers'], '10')
+
+
+class RecoverJobsTests(TestCase):
+
+    def job(self, owner, status=CleanupJob.RUNNING):
+        return CleanupJob.objects.create(params={}, report_name='report.xlsx', owner=owner, status=status)
+
+    def status(self, job):
+        job.refresh_from_db()
+        return job.status
+
+    def test_only_the_jobs_of_gone_processes_fail(self):
+        boot_id = process_id().rpartition(':')[0]
+        own = self.job(process_id())
+        other_process = self.job(f'{boot_id}:{os.getppid()}', CleanupJob.QUEUED)  # another live process
+        gone_process = self.job(f'{boot_id}:{2 ** 22 + 1}')  # above the linux pid_max
+        before_reboot = self.job(f'another-boot:{os.getpid()}')
+        no_owner = self.job('')
+        done = self.job('', CleanupJob.DONE)
+
+        recover_jobs()
+
+        self.assertEqual(self.status(own), CleanupJob.RUNNING)
+        self.assertEqual(self.status(other_process), CleanupJob.QUEUED)
+        self.assertEqual(self.status(gone_process), CleanupJob.FAILED)
+        self.assertEqual(self.status(before_reboot), CleanupJob.FAILED)
+        self.assertEqual(self.status(no_owner), CleanupJob.FAILED)
+        self.assertEqual(self.status(done), CleanupJob.DONE)
+
+
+class ChangingFleet(SyntheticFleet):
+    '''
+    SyntheticFleet whose volumes of `changed` got a new tag since they were generated
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.changed = set()
+
+    def _describe_volumes(self, region, params):
+        response = super()._describe_volumes(region, params)
+        for volume in response['Volumes']:
+            if volume['VolumeId'] in self.changed:
+                volume['Tags'] = [{'Key': 'Name', 'Value': 'changed'}]
+        return response
+
+
+class ApplyPlanTests(TestCase):
+    '''
+    Dry run scan of the volumes of a synthetic fleet, then apply of its plan
+    '''
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.report_dir = directory.name
+        self.fleet = ChangingFleet(('us-east-1', 'us-east-2'), 40)
+        patch_session = mock.patch.object(cleanResources, 'new_session', self.fleet.session)
+        config = first_release_config(directory.name)
+        patch_config = mock.patch.object(cleanResources, 'load_config', lambda: config)
+        for patcher in (patch_session, patch_config):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def rows(self, name):
+        '''
+        Volumes rows of the report: {volume id: (operation, error)}
+        '''
+        path = os.path.join(self.report_dir, name)
+        self.addCleanup(close_report, path)
+        return {row[2]: (row[0], row[-1]) for row in get_report(path).sheets['Volumes'][1:]}
+
+    def test_dry_run_plan_then_apply(self):
+        cleanResources.run_aws_cleanup(os.path.join(self.report_dir, 'dry.xlsx'), True, Volumes=True,
+                                       full_sweep=True, savexlsx=False)
+        terminated = {volume_id for volume_id, (operation, _) in self.rows('dry.xlsx').items()
+                      if operation == 'Terminate'}
+        self.assertTrue(terminated)
+        self.assertEqual(self.fleet._gone, set())  # dry run
+
+        scan = ScanRun.objects.get(dry_run=True)
+        decisions = Decision.objects.filter(run=scan)
+        self.assertEqual({decision.resource.resource_id for decision in decisions}, terminated)
+        self.assertEqual({decision.operation for decision in decisions}, {'Terminate'})
+        self.assertTrue(all(decision.fingerprint for decision in decisions))
+
+        changed, gone, *unchanged = sorted(terminated)
+        self.fleet.changed.add(changed)
+        self.fleet._gone.add(gone)
+
+        cleanResources.run_aws_apply(os.path.join(self.report_dir, 'apply.xlsx'), scan, Volumes=True,
+                                     savexlsx=False)
+        rows = self.rows('apply.xlsx')
+        self.assertEqual(rows.pop(changed), ('Skip(changed)', 'None'))
+        self.assertNotIn(gone, rows)
+        self.assertEqual(rows, {volume_id: ('Terminate', 'None') for volume_id in unchanged})
+        self.assertEqual(self.fleet._gone, {gone, *unchanged})  # only the unchanged volumes were deleted
+
+
+class ServerFilterTests(SimpleTestCase):
+    '''
+    The EC2, volumes and RDS snapshots cleaners only ask the API for what they can clean
+    '''
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.config = first_release_config(directory.name)
+        self.report_path = os.path.join(directory.name, 'report.xlsx')
+        self.addCleanup(close_report, self.report_path)
+
+        self.ec2 = boto3.client('ec2', region_name='us-east-1', aws_access_key_id='test', aws_secret_access_key='test')
+        self.rds = boto3.client('rds', region_name='us-east-1', aws_access_key_id='test', aws_secret_access_key='test')
+        self.ec2_stub, self.rds_stub = Stubber(self.ec2), Stubber(self.rds)
+        for stub in (self.ec2_stub, self.rds_stub):
+            stub.activate()
+            self.addCleanup(stub.deactivate)
+        for patcher in (mock.patch.object(cleanResources, '_aws_client',
+                                          lambda service, *args, **kwargs: self.ec2 if service == 'ec2' else self.rds),
+                        mock.patch.object(cleanResources, 'xlsx_name', self.report_path)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        cleanResources.create_xlsx(EC2=True, Volumes=True, RDS_Snaps=True)
+
+    def test_filter_parameters(self):
+        # the expected params are checked by the stubber, the page size is added by awsInventory
+        self.ec2_stub.add_response('describe_instances', {'Reservations': []}, {
+            'Filters': [{'Name': 'instance-state-name', 'Values': ['pending', 'running', 'stopping', 'stopped']}],
+            'MaxResults': 1000})
+        self.ec2_stub.add_response('describe_volumes', {'Volumes': [{
+            'VolumeId': 'vol-1', 'AvailabilityZone': 'us-east-1a', 'State': 'available', 'VolumeType': 'gp2',
+            'Size': 1, 'CreateTime': datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc),
+            'Tags': [{'Key': 'keep', 'Value': 'vol-1'}]}]},
+            {'Filters': [{'Name': 'status', 'Values': ['available']}], 'MaxResults': 1000})
+        self.rds_stub.add_response('describe_db_snapshots', {'DBSnapshots': []},
+                                   {'SnapshotType': 'manual', 'MaxRecords': 100})
+
+        cleanResources._clean_ec2_region('us-east-1', 'Main', True, self.config)
+        cleanResources._clean_volumes_region('us-east-1', 'Main', True, self.config)
+        cleanResources._clean_rds_instances_snaps_region('us-east-1', 'Main', True, self.config)
+
+        self.ec2_stub.assert_no_pending_responses()
+        self.rds_stub.assert_no_pending_responses()
+        self.assertEqual(get_report(self.report_path).sheets['Filters'][1:], [
+            ('EC2', 'us-east-1', 'Main', 'instance-state-name=pending,running,stopping,stopped', 0),
+            ('Volumes', 'us-east-1', 'Main', 'status=available', 1),
+            ('RDS Snapshots', 'us-east-1', 'Main', 'SnapshotType=manual', 0),
+        ])
+
+
+class DeleteExecutorTests(SimpleTestCase):
+
+    def test_errors_are_not_retried(self):
+        calls = []
+
+        def delete(**kwargs):
+            calls.append(kwargs)
+            if kwargs['Id'] == 'dry-run':
+                raise ClientError({'Error': {'Code': 'DryRunOperation'}}, 'Delete')
+            if kwargs['Id'] == 'throttled':  # already retried by the client, see clientFactory.MAX_ATTEMPTS
+                raise ClientError({'Error': {'Code': 'RequestLimitExceeded'}}, 'Delete')
+            if kwargs['Id'] == 'unreachable':
+                raise EndpointConnectionError(endpoint_url='https://ec2.us-east-1.amazonaws.com')
+
+        with DeleteExecutor(2) as deleter:
+            for resource_id in ('deleted', 'dry-run', 'throttled', 'unreachable', 'kept'):
+                if resource_id == 'kept':
+                    deleter.submit(resource_id)
+                else:
+                    deleter.submit(resource_id, delete, Id=resource_id)
+            results = list(deleter.results(wait=True))
+
+        self.assertEqual([resource_id for resource_id, error in results],
+                         ['deleted', 'dry-run', 'throttled', 'unreachable', 'kept'])
+        self.assertEqual([error is None for resource_id, error in results], [True, True, False, False, True])
+        self.assertIsInstance(results[3][1], EndpointConnectionError)
+        self.assertEqual(len(calls), 4)
+
+
+class SyntheticFleetTests(SimpleTestCase):
+
+    def test_id_filters(self):
+        fleet = SyntheticFleet(('us-east-1',), 20)
+        session = fleet.session()
+        ec2, rds = session.client('ec2'), session.client('rds')
+        fleet._gone.add('vol-00000000000000002')
+        # describe call, id filter, list and id keys of the response, ids asked -> ids returned
+        for call, name, key, id_key, ids, expected in (
+                (ec2.describe_volumes, 'volume-id', 'Volumes', 'VolumeId',
+                 ['vol-00000000000000001', 'vol-00000000000000002', 'vol-00000000000000003'],
+                 ['vol-00000000000000001', 'vol-00000000000000003']),
+                (ec2.describe_snapshots, 'snapshot-id', 'Snapshots', 'SnapshotId',
+                 ['snap-00000000000000004'], ['snap-00000000000000004']),
+                (ec2.describe_images, 'image-id', 'Images', 'ImageId',
+                 ['ami-00000000000000005'], ['ami-00000000000000005']),
+                (ec2.describe_security_groups, 'group-id', 'SecurityGroups', 'GroupId',
+                 ['sg-0000000000000000a', 'sg-0000000000000000b'], ['sg-0000000000000000a', 'sg-0000000000000000b']),
+                (rds.describe_db_instances, 'db-instance-id', 'DBInstances', 'DBInstanceIdentifier',
+                 ['bench-db-0-12'], ['bench-db-0-12']),
+                (rds.describe_db_snapshots, 'db-snapshot-id', 'DBSnapshots', 'DBSnapshotIdentifier',
+                 ['bench-db-snap-0-13'], ['bench-db-snap-0-13'])):
+            with self.subTest(name):
+                response = call(Filters=[{'Name': name, 'Values': ids}])
+                self.assertEqual([resource[id_key] for resource in response[key]], expected)
+
+
+class ReportDownloadTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(CLEANUP_REPORTS_DIR=directory.name, CLEANUP_REPORTS_MAX_AGE=3600)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def report(self, age, status=CleanupJob.DONE):
+        job = CleanupJob.objects.create(params={}, report_name='report.csv', status=status)
+        with open(report_path(job), 'w') as file:
+            file.write('Sheet,Region\n')
+        written = datetime.datetime.now().timestamp() - age
+        os.utime(report_path(job), (written, written))
+        return job
+
+    def download(self, job):
+        response = self.client.get(reverse('cleanup_download', args=[job.pk]))
+        if response.status_code == 200:
+            self.assertEqual(b''.join(response.streaming_content), b'Sheet,Region\n')
+            response.close()
+        return response.status_code
+
+    def test_reports_expire_by_age(self):
+        recent, old = self.report(60), self.report(7200)
+        self.assertEqual(self.download(recent), 200)
+        self.assertEqual(self.download(recent), 200)  # not removed by the first download
+
+        expire_reports()
+        self.assertEqual(self.download(recent), 200)
+        self.assertEqual(self.download(old), 404)
+
+    def test_report_of_a_failed_job(self):
+        failed = self.report(60, CleanupJob.FAILED)  # the rows of the accounts that did not fail
+        running = self.report(60, CleanupJob.RUNNING)
+        self.assertTrue(self.client.get(reverse('cleanup_status', args=[failed.pk])).json()['download_url'])
+        self.assertEqual(self.download(failed), 200)
+        self.assertIsNone(self.client.get(reverse('cleanup_status', args=[running.pk])).json()['download_url'])
+        self.assertEqual(self.download(running), 404)
+
+
+class ReportSinkTests(SimpleTestCase):
+    '''
+    EC2 sheet with an error row, shorter than the header like the ones of print_results_xlsx()
+    '''
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def report(self, suffix):
+        path = os.path.join(self.directory, 'report' + suffix)
+        self.addCleanup(close_report, path)
+        report = create_report(path)
+        report.add_sheet('EC2', ('OperationDone', 'Age', 'Region', 'InstanceId'))
+        report.append('EC2', ('Terminate', 400, 'us-east-1', 'i-1'))
+        report.append('EC2', ('ERROR-Terminate', ['i-2', 'i-3'], 'RequestLimitExceeded'))
+        report.save()
+        return zipfile.ZipFile(path)
+
+    def test_jsonl_error_row(self):
+        with self.report('.jsonl.zip') as archive:
+            rows = [json.loads(line) for line in archive.read('EC2.jsonl').splitlines()]
+        self.assertEqual(rows[1], {'OperationDone': 'ERROR-Terminate', 'Age': ['i-2', 'i-3'],
+                                   'Region': 'RequestLimitExceeded', 'InstanceId': None})
+
+    @unittest.skipIf(reportSink.pyarrow is None, 'pyarrow is not installed')
+    def test_parquet_error_row(self):
+        with self.report('.parquet.zip') as archive:
+            table = reportSink.pyarrow.parquet.read_table(io.BytesIO(archive.read('EC2.parquet')))
+        self.assertEqual(table.to_pydict(), {
+            'OperationDone': ['Terminate', 'ERROR-Terminate'], 'Age': ['400', "['i-2', 'i-3']"],
+            'Region': ['us-east-1', 'RequestLimitExceeded'], 'InstanceId': ['i-1', None]})
+
+    def test_parquet_without_pyarrow(self):
+        with mock.patch.object(reportSink, 'pyarrow', None):
+            self.assertNotIn('parquet', reportSink.available_formats())
+            response = self.client.post(reverse('cleanup'), {'Runoption': 'dryrun', 'accounts': 'Main',
+                                                             'targets': 'sg', 'report_format': 'parquet'})
+        self.assertContains(response, 'parquet reports need pyarrow', status_code=400)
+
+
+class TaskSchedulerTests(SimpleTestCase):
+
+    def test_failed_dependency(self):
+        ran = []
+
+        def fail():
+            raise RuntimeError('EC2 failed')
+
+        scheduler = TaskScheduler(2, poll_seconds=0.01)
+        scheduler.add(('EC2', 'us-east-1'), fail)
+        scheduler.add(('Volumes', 'us-east-1'), lambda: ran.append('Volumes'), after=[('EC2', 'us-east-1')])
+        scheduler.add(('EC2', 'us-east-2'), lambda: 'us-east-2')
+        scheduler.add(('Volumes', 'us-east-2'), lambda: ran.append('Volumes') or 'done', after=[('EC2', 'us-east-2')])
+        results = scheduler.run()
+
+        self.assertIsInstance(results[('EC2', 'us-east-1')][1], RuntimeError)
+        self.assertIsInstance(results[('Volumes', 'us-east-1')][1], DependencyFailed)
+        self.assertEqual(results[('EC2', 'us-east-2')], ('us-east-2', None))  # the independent tasks keep going
+        self.assertEqual(results[('Volumes', 'us-east-2')], ('done', None))
+        self.assertEqual(ran, ['Volumes'])
+
+    def test_pending_task_is_polled_until_done(self):
+        polls = []
+        order = []
+
+        def terminating():
+            polls.append(None)
+            return len(polls) >= 3  # terminated on the third poll
+
+        scheduler = TaskScheduler(2, poll_seconds=0.01)
+        scheduler.add('EC2', lambda: order.append('EC2') or Pending('terminated', terminating))
+        scheduler.add('Volumes', lambda: order.append('Volumes') or 'volumes', after=['EC2'])
+        scheduler.add('Images', lambda: order.append('Images') or 'images')
+        results = scheduler.run()
+
+        self.assertEqual(results, {'EC2': ('terminated', None), 'Volumes': ('volumes', None),
+                                   'Images': ('images', None)})
+        self.assertEqual(len(polls), 3)
+        self.assertLess(order.index('EC2'), order.index('Volumes'))
+
+    def test_failed_poll(self):
+        def poll():
+            raise RuntimeError('describe_instances failed')
+
+        scheduler = TaskScheduler(1, poll_seconds=0.01)
+        scheduler.add('EC2', lambda: Pending('terminated', poll))
+        scheduler.add('SG', lambda: 'sg', after=['EC2'])
+        results = scheduler.run()
+
+        self.assertEqual(results['EC2'][0], 'terminated')
+        self.assertIsInstance(results['EC2'][1], RuntimeError)
+        self.assertIsInstance(results['SG'][1], DependencyFailed)
+
+
+class ClientPoolTests(SimpleTestCase):
+
+    def test_pool_covers_the_cleaners_of_a_region(self):
+        with tempfile.TemporaryDirectory() as directory:
+            config = first_release_config(directory)
+        # 4 region workers running ec2 cleaners of the same region, each with its thread and 10 delete workers
+        self.assertEqual(cleanResources._new_client_factory(config).config.max_pool_connections, 44)
+
+
+class CountingFleet(SyntheticFleet):
+    '''
+    SyntheticFleet counting the describe_instances and describe_images calls
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calls = {'instances': 0, 'images': 0}
+
+    def _describe_instances(self, region, params):
+        self.calls['instances'] += 1
+        return super()._describe_instances(region, params)
+
+    def _describe_images(self, region, params):
+        self.calls['images'] += 1
+        return super()._describe_images(region, params)
+
+
+class ReferenceGraphTests(SimpleTestCase):
+    '''
+    The snapshots cleaner reuses the instances and AMIs listed by the other cleaners of the run
+    '''
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.config = first_release_config(directory.name)
+        self.report_path = os.path.join(directory.name, 'report.xlsx')
+        self.addCleanup(close_report, self.report_path)
+        self.fleet = CountingFleet(('us-east-1',), 20)
+        session = self.fleet.session()
+        for patcher in (mock.patch.object(cleanResources, '_aws_client',
+                                          lambda service, region, *args, **kwargs: session.client(service, region)),
+                        mock.patch.object(cleanResources, 'xlsx_name', self.report_path)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        cleanResources.create_xlsx(EC2=True, Images=True, Snapshots=True)
+
+    def used_by(self):
+        report = get_report(self.report_path)
+        column = report.sheets['Snapshots'][0].index('Used by')
+        return [row[column] for row in report.sheets['Snapshots'][1:] if row[column]]
+
+    def test_graph_of_the_run(self):
+        graphs = {}
+        cleanResources._clean_ec2_region('us-east-1', 'Main', True, self.config, graphs=graphs)
+        cleanResources._clean_images_region('us-east-1', 'Main', True, self.config, graphs=graphs)
+        cleanResources._clean_snapshot_region('us-east-1', 'Main', True, self.config, graphs=graphs)
+        self.assertEqual(self.fleet.calls, {'instances': 1, 'images': 1})
+        self.assertIn('vol-00000000000000001 of i-00000000000000001', self.used_by())
+
+    def test_snapshots_cleaner_on_its_own(self):
+        for _ in range(2):  # nothing is kept from the previous run
+            cleanResources._clean_snapshot_region('us-east-1', 'Main', True, self.config)
+        self.assertEqual(self.fleet.calls, {'instances': 2, 'images': 2})
+        self.assertIn('vol-00000000000000001 of i-00000000000000001', self.used_by())
+
+
+# operation of the per cleaner code before CleanupPolicy for each RULES entry, keeptag mode, for the tags
+# untagged, no tags, other tag, keep=<id>, keep=on, keep=<id> and keep_state
+LEGACY_OPERATIONS = {
+    'ec2': ('Terminate', 'Terminate', 'Terminate', 'Shutdown', 'Terminate', 'keep'),
+    'volumes': ('Terminate', 'Terminate', 'Terminate', 'Keep', 'Terminate', 'Keep'),
+    'snapshots': ('Delete', 'Delete', 'Delete', 'keep', 'Delete', 'keep'),
+    'images': ('Deregister', 'Deregister', 'Deregister', 'Keep', 'Deregister', 'Keep'),
+    'sg': ('Deleting', 'Deleting', 'Deleting', 'N/A', 'N/A', 'N/A'),
+    'rds': ('Terminate', 'Terminate', 'Terminate', 'Shutdown', 'Terminate', 'DoNothing'),
+    'rds_snaps': ('Delete', 'Delete', 'Delete', 'Ignore', 'Delete', 'Ignore'),
+    's3_objects': ('Delete', 'Delete', 'Delete', 'DoNothing', 'DoNothing', 'DoNothing'),
+    'azure_rg': ('Delete', 'Delete', 'Delete', 'Keep', 'Keep', 'Keep'),
+}
+
+
+class CleanupPolicyTests(SimpleTestCase):
+    today = datetime.date(2024, 3, 10)
+
+    def policy(self, resource, mode='keeptag'):
+        keep, stop, operations = RULES[resource]
+        return CleanupPolicy(mode, 3, operations, keep, stop, today=self.today)
+
+    def test_rules_match_the_legacy_cleaners(self):
+        self.assertEqual(LEGACY_OPERATIONS.keys(), RULES.keys())
+        ids = [f'res-{i}' for i in range(6)]
+        tags = [None, {}, {'Name': 'web'}, {'keep': 'res-3'}, {'keep': 'on'}, {'keep': 'res-5', 'keep_state': 'on'}]
+        for resource, expected in LEGACY_OPERATIONS.items():
+            with self.subTest(resource):
+                policy = self.policy(resource)
+                decisions, ages = policy.decide(ids, tags)
+                self.assertEqual(tuple(policy.operations[decision] for decision in decisions.tolist()), expected)
+                self.assertIsNone(ages)
+
+    def test_keep_id_and_any(self):
+        tags = [{'keep': 'vol-1'}, {'keep': 'vol-1'}, {'keep': ''}]
+        decisions, _ = self.policy('volumes').decide(['vol-1', 'vol-2', 'vol-3'], tags)
+        self.assertEqual(decisions.tolist(), [KEEP, DELETE, DELETE])
+        decisions, _ = self.policy('sg').decide(['sg-1', 'sg-2', 'sg-3'], tags)
+        self.assertEqual(decisions.tolist(), [KEEP, KEEP, KEEP])
+
+    def test_keep_state(self):
+        ids = ['i-1', 'i-2', 'i-3']
+        tags = [{'keep': 'i-1'}, {'keep': 'i-2', 'keep_state': ''}, {'keep_state': 'on'}]
+        decisions, _ = self.policy('ec2').decide(ids, tags)
+        self.assertEqual(decisions.tolist(), [STOP, KEEP, DELETE])
+        decisions, _ = self.policy('images').decide(ids, tags)  # never stopped
+        self.assertEqual(decisions.tolist(), [KEEP, KEEP, DELETE])
+
+    def test_eligible(self):
+        ids = ['i-1', 'i-2', 'i-3', 'i-4']
+        tags = [None, None, {'keep': 'i-3'}, {'keep': 'i-4'}]
+        decisions, _ = self.policy('ec2').decide(ids, tags, eligible=[True, False, True, False])
+        self.assertEqual(decisions.tolist(), [DELETE, KEEP, STOP, KEEP])
+
+    def test_keeptag_withdate_ages(self):
+        utc = datetime.timezone.utc
+        created = [
+            datetime.datetime(2024, 3, 7, 23, 59, tzinfo=utc),  # 3 days, kept
+            datetime.datetime(2024, 3, 6, 23, 0, tzinfo=datetime.timezone(datetime.timedelta(hours=-5))),  # 7th UTC
+            datetime.datetime(2024, 3, 6, 12, 0, tzinfo=utc),  # 4 days
+            None,  # unknown, kept
+            '2024-03-09T10:00:00.000Z',  # images CreationDate
+            '2024-02-01T10:00:00.000Z',
+        ]
+        ids = [f'vol-{i}' for i in range(len(created))]
+        policy = self.policy('volumes', 'keeptag_withdate')
+        decisions, ages = policy.decide(ids, [None] * len(ids), created)
+        self.assertEqual(ages, [3, 3, 4, None, 1, 38])
+        self.assertEqual(decisions.tolist(), [KEEP_AGE, KEEP_AGE, DELETE, KEEP_AGE, KEEP_AGE, DELETE])
+
+        decisions, ages = policy.decide(['vol-1'], [None])  # resource type without creation time
+        self.assertEqual((decisions.tolist(), ages), ([DELETE], None))
+
+        ec2 = self.policy('ec2', 'keeptag_withdate')  # the age rule wins over stop
+        decisions, _ = ec2.decide(['i-1', 'i-2'], [{'keep': 'i-1'}, {'keep': 'i-2'}], created[:3:2])
+        self.assertEqual([ec2.operations[decision] for decision in decisions.tolist()], ['keep', 'Shutdown'])
+
+    def test_apply(self):
+        def volume(volume_id, tags, created):
+            return VolumeRecord.from_api({'VolumeId': volume_id, 'AvailabilityZone': 'us-east-1a', 'State': 'available',
+                                          'VolumeType': 'gp2', 'Size': 1, 'CreateTime': created, 'Tags': tags},
+                                         'us-east-1', 'Main')
+
+        recent = datetime.datetime(2024, 3, 9, tzinfo=datetime.timezone.utc)
+        old = datetime.datetime(2023, 3, 10, tzinfo=datetime.timezone.utc)
+        records = [volume('vol-1', [], recent), volume('vol-2', [], old),
+                   volume('vol-3', [{'Key': 'keep', 'Value': 'vol-3'}], old), volume('vol-4', [], old)]
+        self.policy('volumes', 'keeptag_withdate').apply(records, eligible=[True, True, True, False])
+        self.assertEqual([(record.operation, record.age) for record in records],
+                         [('Keep', 1), ('Terminate', 366), ('Keep', 366), ('Keep', 366)])
+        self.policy('volumes').apply([])  # nothing to do
+
+
+class PendingActionsTests(TestCase):
+
+    def resource(self, account, resource_type, resource_id, operation, gone=False):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        InventoryResource.objects.create(account=account, region='us-east-1', resource_type=resource_type,
+                                         resource_id=resource_id, data={}, operation=operation, fingerprint='',
+                                         gone=gone, first_seen=now, changed=now)
+
+    def pending(self, **options):
+        out = io.StringIO()
+        call_command('pending_actions', stdout=out, **options)
+        return out.getvalue().splitlines()
+
+    def test_pending_actions(self):
+        self.resource('111', 'Snapshots', 'snap-1', 'Delete')
+        self.resource('111', 'Snapshots', 'snap-2', 'keep')
+        self.resource('111', 'Snapshots', 'snap-3', 'Delete', gone=True)
+        self.resource('111', 'EC2', 'i-1', 'Shutdown')
+        self.resource('222', 'Volumes', 'vol-1', 'Terminate')
+
+        self.assertEqual(self.pending(), [
+            '111\tEC2\tus-east-1\ti-1\tShutdown',
+            '111\tSnapshots\tus-east-1\tsnap-1\tDelete',
+            '222\tVolumes\tus-east-1\tvol-1\tTerminate',
+            '3 pending actions'])
+        self.assertEqual(self.pending(account='111', resource_type='Snapshots'),
+                         ['111\tSnapshots\tus-east-1\tsnap-1\tDelete', '1 pending actions'])
+
+
+def _account_run(report_key, fail):
+    report = get_report(report_key)
+    report.add_sheet('Volumes', ('OperationDone', 'VolumeId'))
+    report.append('Volumes', ('Terminate', f'vol-{report_key[-1]}'))
+    if fail:  # after deleting vol-<account>
+        raise RuntimeError('us-east-2 failed')
+
+
+def _account(report_key, fail):
+    return accountWorker._collect(report_key, _account_run, report_key, fail)
+
+
+class RunAccountsTests(SimpleTestCase):
+
+    def test_rows_of_a_failed_account_are_kept(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'report.csv.zip')
+            self.addCleanup(close_report, path)
+            with self.assertRaisesMessage(RuntimeError, '1 of 3 AWS accounts failed - B: RuntimeError: us-east-2 failed'):
+                _run_accounts(path, mock.Mock(aws_account_workers=1),
+                              [('A', _account, (False,)), ('B', _account, (True,)), ('C', _account, (False,))])
+            with zipfile.ZipFile(path) as archive:
+                rows = archive.read('Volumes.csv').decode().splitlines()
+        self.assertEqual(rows, ['OperationDone,VolumeId', 'Terminate,vol-A', 'Terminate,vol-B', 'Terminate,vol-C'])
+
+
+class ForwardLogsTests(SimpleTestCase):
+    '''
+    forward_to() of the account worker processes, on a logger of its own
+    '''
+
+    def setUp(self):
+        self.logger = logging.getLogger('CleanerService-forward-test')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        for patcher in (mock.patch.object(cleanerLogging, 'LOGGER_NAME', self.logger.name),
+                        mock.patch.dict(cleanerLogging._outputs)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(lambda: [self.logger.removeHandler(handler) for handler in self.logger.handlers[:]])
+
+    def test_records_only_sent_when_an_output_is_enabled(self):
+        log_queue = queue.SimpleQueue()
+        cleanerLogging.forward_to(log_queue)
+        with tempfile.TemporaryDirectory() as directory:
+            config = first_release_config(directory)  # logs_console and logs_file off
+
+        cleanerLogging.set_outputs(config)
+        self.logger.info('off')
+        self.assertTrue(log_queue.empty())
+
+        cleanerLogging.set_outputs(dataclasses.replace(config, logs_file=True))
+        self.logger.info('file on')
+        self.assertEqual(log_queue.get_nowait().getMessage(), 'file on')
+
+
+class FailingFleet(SyntheticFleet):
+    '''
+    SyntheticFleet whose describe_volumes fails in the regions of `failing`
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.failing = set()
+
+    def _describe_volumes(self, region, params):
+        if region in self.failing:
+            raise FleetError('UnauthorizedOperation', 403)
+        return super()._describe_volumes(region, params)
+
+
+class FailedRegionTests(TestCase):
+    '''
+    A (cleaner, region) task failing doesn't lose what the other tasks, and the task itself, did
+    '''
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.report_dir = directory.name
+        self.config = first_release_config(directory.name)
+        self.fleet = FailingFleet(('us-east-1', 'us-east-2'), 40)
+        for patcher in (mock.patch.object(cleanResources, 'new_session', self.fleet.session),
+                        mock.patch.object(cleanResources, 'load_config', lambda: self.config)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def run_cleanup(self, name, dry_run):
+        path = os.path.join(self.report_dir, name)
+        self.addCleanup(close_report, path)
+        cleanResources.run_aws_cleanup(path, dry_run, Volumes=True, full_sweep=True, savexlsx=False)
+        return get_report(path).sheets['Volumes'][1:]
+
+    def test_other_regions_are_recorded(self):
+        self.run_cleanup('dry.xlsx', True)  # inventory of both regions
+        self.fleet.failing.add('us-east-2')
+
+        with self.assertRaisesMessage(RegionTaskError, 'Volumes us-east-2: ClientError'):
+            self.run_cleanup('run.xlsx', False)
+
+        rows = get_report(os.path.join(self.report_dir, 'run.xlsx')).sheets['Volumes'][1:]
+        deleted = {row[2] for row in rows if row[0] == 'Terminate'}
+        self.assertTrue(deleted)
+        self.assertEqual(deleted, self.fleet._gone)
+        self.assertEqual([row[:2] for row in rows if row[0].startswith('ERROR')], [('ERROR-region', 'us-east-2')])
+
+        run = ScanRun.objects.get(dry_run=False)
+        self.assertEqual(set(Decision.objects.filter(run=run).values_list('resource__resource_id', flat=True)),
+                         deleted)
+        volumes = InventoryResource.objects.filter(resource_type='Volumes')
+        self.assertTrue(volumes.filter(region='us-east-2').exists())
+        self.assertFalse(volumes.filter(region='us-east-2', gone=True).exists())  # not scanned, not gone
+
+    def test_rows_of_the_failed_task_are_kept(self):
+        def clean_region(region, target_account, dry_run, config):
+            cleanResources._add_row('Volumes', ('Terminate', 10, f'vol-{region}'))
+            if region == 'us-east-2':
+                raise FleetError('InternalError')
+
+        path = os.path.join(self.report_dir, 'report.xlsx')
+        self.addCleanup(close_report, path)
+        with mock.patch.object(cleanResources, 'xlsx_name', path):
+            cleanResources.create_xlsx(Volumes=True)
+            error = cleanResources._run_cleaners([('Volumes', ('us-east-1', 'us-east-2'), clean_region)],
+                                                 'Main', False, self.config, scan=False)
+
+        self.assertIsInstance(error, RegionTaskError)
+        self.assertEqual(get_report(path).sheets['Volumes'][1:], [
+            ('Terminate', 10, 'vol-us-east-1'), ('Terminate', 10, 'vol-us-east-2'),
+            ('ERROR-region', 'us-east-2', 'Volumes us-east-2: FleetError: InternalError')])
@@ -1,10 +1,15 @@
-from django.urls import path
-from .views import homepage_view,home_view,cleanup,configurations
-urlpatterns = [
-    path('', home_view, name='home'),
-    path('cleanup', cleanup,name='cleanup'),
-    path('configurations', configurations, name='configurations'),
-
-]
-
-
+from django.urls import path
+from .views import homepage_view,home_view,cleanup,configurations,cleanup_job,cleanup_status,cleanup_download,\
+    cleanup_apply
+urlpatterns = [
+    path('', home_view, name='home'),
+    path('cleanup', cleanup,name='cleanup'),
+    path('cleanup/<int:job_id>', cleanup_job, name='cleanup_job'),
+    path('cleanup/<int:job_id>/status', cleanup_status, name='cleanup_status'),
+    path('cleanup/<int:job_id>/download', cleanup_download, name='cleanup_download'),
+    path('cleanup/<int:job_id>/apply', cleanup_apply, name='cleanup_apply'),
+    path('configurations', configurations, name='configurations'),
+
+]
+
+